@@ -15,6 +15,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import calendar
+import codecs
+import collections
 import fcntl
 import json
 import os
@@ -28,10 +31,21 @@ import time
 import glob
 import platform
 import traceback
+import uuid
 import errno
 import re
 import logging
 import logging.handlers
+import math
+import tty
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from candy_board_qws import geofence
+from candy_board_qws import nmea
+from candy_board_qws import track
 
 logger = logging.getLogger('candy_board_qws')
 logger.setLevel(logging.INFO)
@@ -69,10 +83,221 @@ OSPEED = 5
 CC = 6
 
 
+# Number of bytes requested from the port per read(2) call.
+READ_CHUNK_SIZE = 4096
+# Default time (in seconds) to wait for a complete line.
+READ_LINE_TIMEOUT = 0.1
+
+
 def bps_to_termios_sym(bps):
     return BPS_SYMS[bps]
 
 
+# Final result codes terminating an AT command response, other than the
+# expected one (OK by default) and "+CME ERROR: <err>".
+FINAL_RESULT_CODES = (
+    "ERROR",
+    "NO DIALTONE",
+    "NO CARRIER",
+)
+
+# Maximum time (in seconds) to wait for an AT command response.
+AT_TIMEOUT = 65
+
+# Time (in seconds) to wait for a read command (e.g. AT+COPS?) or a
+# command without parameters (e.g. AT+CSQ) not listed in AT_TIMEOUTS
+AT_QUERY_TIMEOUT = 5
+
+# Time (in seconds) to wait for the response of an AT command by
+# prefix, the longest matching prefix wins. Other commands wait for
+# AT_QUERY_TIMEOUT or AT_TIMEOUT.
+AT_TIMEOUTS = {
+    "AT+COPS=": 180,
+    "AT+CGATT=": 140,
+    "AT+CGACT=": 150,
+    "AT+CFUN=": 15,
+    "AT+QPOWD": 65,
+    "AT+CLCK=": 5,
+    "AT+QGPSLOC": 10,
+    "AT+QGPSGNMEA": 5,
+}
+
+# Prefixes of unsolicited result codes (URCs). A line with one of them
+# is still taken as a response when it has the prefix of the pending
+# AT command, e.g. "+CREG: 0,1" for "AT+CREG?".
+URC_PREFIXES = (
+    "+CREG:",
+    "+CGREG:",
+    "+CEREG:",
+    "+CTZV:",
+    "+CTZE:",
+    "+QIND:",
+    "+QIURC:",
+    "+QUSIM:",
+    "+CPIN:",
+    "+CMTI:",
+    "+CRING:",
+    "+QGPSURC:",
+    "RING",
+    "RDY",
+)
+
+# URCs sharing their prefix with the response of a query, which are
+# told apart by the shape of their parameters
+REGISTRATION_PREFIXES = ("+CREG:", "+CGREG:", "+CEREG:")
+
+
+def is_registration_urc(line):
+    """Whether the line is a registration URC, e.g. "+CEREG: 2" or
+    "+CREG: 1,\"1A2B\",\"01234567\",7", rather than the response to
+    a query, e.g. "+CREG: 0,1", whose first two parameters are <n> and
+    <stat>.
+    """
+    if not line.startswith(REGISTRATION_PREFIXES):
+        return False
+    params = line.split(':', 1)[1].split(',')
+    return len(params) < 2 or not params[1].strip().isdigit()
+
+
+# Time (in seconds) the modem reader thread blocks on the serial port
+# before checking whether it's been stopped.
+READER_TIMEOUT = 1.0
+
+# TTL of a cached result field that never changes while the modem is
+# connected
+CACHE_FOREVER = float('inf')
+
+# Number of threads reading and performing socket requests concurrently
+WORKER_THREADS = 8
+
+# Priorities of the calls queued for the modem, highest first: commands
+# changing the modem state the others read (e.g. modem off), the other
+# commands, and the read-only ones (e.g. network show)
+PRIORITIES = ('control', 'default', 'telemetry')
+
+# A queued call is raised by one priority every this many seconds, so
+# that telemetry reads are never starved
+MODEM_AGING_INTERVAL = 5
+
+# Number of the finished jobs kept for job status, the oldest ones are
+# evicted first
+JOB_TABLE_SIZE = 100
+
+# Time (in seconds) job wait waits for a job by default
+JOB_WAIT_TIMEOUT = 30
+
+# network scan responds with the operators of the last scan until it's
+# older than this (in seconds) and scans again in the background
+NETWORK_SCAN_TTL = 3600
+
+# Time (in seconds) to wait for each chunk of a socket request
+RECV_TIMEOUT = 5
+
+# Time (in seconds) a kept-alive connection may stay idle
+KEEPALIVE_TIMEOUT = 60
+
+# Bytes of network events a watching client may leave unread before
+# it's disconnected
+WATCH_BUFFER_LIMIT = 65536
+
+# Seconds between network show refreshes while the network is watched
+# and no network_poll_interval is configured
+WATCH_POLL_INTERVAL = 10
+
+# Lowest RSSI (in dBm) of the signal buckets 1, 2, 3 and 4
+RSSI_BUCKET_FLOORS = (-105, -95, -85, -75)
+
+# A polled snapshot is no longer served after this many poll intervals
+# without a successful refresh
+SNAPSHOT_STALE_POLLS = 3
+
+# Seconds between the NMEA sentence polls when there is no NMEA port,
+# i.e. the native 1 Hz fix rate of the module
+NMEA_POLL_INTERVAL = 1.0
+
+# Sentences polled with AT+QGPSGNMEA, enough to build a fix. The fix is
+# complete once both GGA and RMC are parsed, so GSA comes first
+NMEA_POLL_TYPES = ('GSA', 'GGA', 'RMC')
+
+# Number of the latest fixes kept for gnss history, an hour at 1 Hz
+GNSS_HISTORY_SIZE = 3600
+
+# Seconds per sample of the satellite count and HDOP trend of a GNSS
+# session, and the number of samples kept
+GNSS_TREND_INTERVAL = 10
+GNSS_TREND_SIZE = 60
+
+# Number of the ended GNSS sessions gnss metrics reports
+GNSS_SESSIONS_KEPT = 10
+
+# File of the module the XTRA (assisted GNSS) data is uploaded to
+XTRA_UFS_FILE = 'UFS:xtra2.bin'
+
+# gnss start applies the XTRA file only while it's younger than this
+# (in seconds), the data is valid for up to 7 days after its download
+XTRA_MAX_AGE = 3 * 24 * 3600
+
+# Seconds the module waits for the data of AT+QFUPL
+UPLOAD_TIMEOUT = 60
+
+
+# AT commands whose responses don't change unless another command
+# changes the modem state, in addition to the read commands (<cmd>?)
+STATIC_QUERIES = (
+    "ATI",
+    "AT+GSN",
+    "AT+CIMI",
+    "AT+CNUM",
+    "AT+QCCID",
+)
+
+
+def is_query(cmd):
+    """Returns whether the AT command line only reads the modem state"""
+    parts = cmd.split(';')
+    for part in [parts[0]] + ['AT' + p for p in parts[1:]]:
+        if not part.endswith('?') and part not in STATIC_QUERIES:
+            return False
+    return True
+
+
+def at_timeout(cmd):
+    """Returns the time (in seconds) to wait for the response of the AT
+    command line, the sum for the commands of a compound one
+    """
+    parts = cmd.split(';')
+    timeout = 0
+    for part in [parts[0]] + ['AT' + p for p in parts[1:]]:
+        matches = [p for p in AT_TIMEOUTS if part.startswith(p)]
+        if matches:
+            timeout += AT_TIMEOUTS[max(matches, key=len)]
+        elif is_query(part) or '=' not in part:
+            timeout += AT_QUERY_TIMEOUT
+        else:
+            timeout += AT_TIMEOUT
+    return timeout
+
+
+def at_prefixes(cmd):
+    """Returns the prefixes of the information responses for the given
+    AT command line, e.g. ["+CSQ", "+COPS"] for "AT+CSQ;+COPS?".
+    """
+    return re.findall(r'(?:^AT|;)([+$][A-Za-z0-9]+)', cmd)
+
+
+def info_value(response):
+    """Returns the value of the information response of a successful AT
+    command, e.g. "1" for ("OK", "+CTZU: 1"), or None.
+    """
+    status, result = response
+    if status != "OK" or ': ' not in result:
+        return None
+    return result.split("\n")[0].split(': ', 1)[1].strip().strip('"')
+
+
+# Value of the NV item 4548 written by modem init and modem reset
+MODEM_INIT_NV_4548 = "0000400C00000210"
+
 CGREG_STATS = [
     "Unregistered",
     "Registered",
@@ -82,6 +307,72 @@ CGREG_STATS = [
     "Roaming"
 ]
 
+# <stat> of the operators listed by AT+COPS=?
+OPERATOR_STATS = [
+    "Unknown",
+    "Available",
+    "Current",
+    "Forbidden"
+]
+
+# <AcT> of the operators listed by AT+COPS=?
+OPERATOR_ACCESS = {
+    '0': 'GSM',
+    '2': 'UTRAN',
+    '3': 'GSM W/EGPRS',
+    '4': 'UTRAN W/HSDPA',
+    '5': 'UTRAN W/HSUPA',
+    '6': 'UTRAN W/HSDPA and HSUPA',
+    '7': 'E-UTRAN',
+    '8': 'eMTC',
+    '9': 'NB-IoT',
+}
+
+
+def parse_operators(result):
+    """Returns the operators listed by AT+COPS=?, e.g.
+    +COPS: (2,"NTT DOCOMO","DOCOMO","44010",7),,(0,1,2,3,4),(0,1,2)
+    """
+    operators = []
+    for stat, long_name, short_name, numeric, act in re.findall(
+            r'\((\d+),"([^"]*)","([^"]*)","([^"]*)"(?:,(\d+))?\)', result):
+        stat = int(stat)
+        operators.append({
+            'status': OPERATOR_STATS[stat]
+            if stat < len(OPERATOR_STATS) else "Unknown",
+            'longName': long_name,
+            'shortName': short_name,
+            'numeric': numeric,
+            'access': OPERATOR_ACCESS.get(act, 'N/A'),
+        })
+    return operators
+
+
+def qfupl_checksum(data):
+    """Checksum AT+QFUPL reports, the XOR of the 16 bit words"""
+    data = bytearray(data)
+    if len(data) % 2:
+        data.append(0)
+    value = 0
+    for i in range(0, len(data), 2):
+        value ^= (data[i] << 8) | data[i + 1]
+    return value
+
+
+def rssi_bucket(rssi):
+    """Returns the signal bucket, 0 to 4, of the RSSI in dBm shown by
+    network show, or None when it's unknown.
+    """
+    try:
+        rssi = int(rssi)
+    except (TypeError, ValueError):
+        return None
+    for bucket, floor in enumerate(RSSI_BUCKET_FLOORS):
+        if rssi < floor:
+            return bucket
+    return len(RSSI_BUCKET_FLOORS)
+
+
 # For local debugging:
 # import candy_board_qws
 # serial = candy_board_qws.SerialPort("/dev/ttyUSB2", 115200)
@@ -135,38 +426,100 @@ class SerialPort(object):
         attrs[CC][termios.VTIME] = 20
         termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
 
+        # Bytes read from the port but not yet returned as a line
+        self.rbuf = bytearray()
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
         self.ping()
 
     def available(self):
         return True
 
-    def read_until(self, until):
-        buf = ""
-        done = False
-        cnt = 0
-        while not done:
+    def _fill(self):
+        """Appends the bytes available on the port to the read buffer.
+        Returns the number of bytes read, 0 on EOF and None when
+        nothing can be read without blocking.
+        """
+        try:
+            data = os.read(self.fd, READ_CHUNK_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise
+        self.rbuf.extend(data)
+        return len(data)
+
+    def _take_until(self, until):
+        pos = self.rbuf.find(until)
+        if pos < 0:
+            return None
+        chunk = bytes(self.rbuf[:pos + len(until)])
+        del self.rbuf[:pos + len(until)]
+        return self.decoder.decode(chunk)
+
+    def _wait_readable(self, timeout):
+        """Sleeps in the kernel until the port becomes readable or the
+        timeout (in seconds) expires. Returns False on timeout.
+        """
+        timeout_ms = max(0, int(math.ceil(timeout * 1000)))
+        while True:
             try:
-                n = os.read(self.fd, 1).decode()
-            except UnicodeDecodeError:
-                n = '.'
-            if n == '':
-                if cnt > 200:
-                    buf = None
-                    break
-                cnt = cnt + 1
-                # FIXME: Maybe worth blocking instead of busy-looping?
-                time.sleep(0.01)
+                events = self.poller.poll(timeout_ms)
+                break
+            except (OSError, select.error) as e:
+                # Python 2 doesn't retry on EINTR
+                if e.args[0] != errno.EINTR:
+                    raise
+        for fd, event in events:
+            if event & select.POLLIN:
+                return True
+            if event & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                raise OSError(errno.EIO, "Serial port is disconnected")
+        return False
+
+    def read_until(self, until, timeout=READ_LINE_TIMEOUT):
+        until = until.encode()
+        deadline = time.time() + timeout
+        while True:
+            buf = self._take_until(until)
+            if buf is not None:
+                return buf
+            n = self._fill()
+            if n == 0:
+                raise OSError(errno.EIO, "Serial port is disconnected")
+            if n is not None:
                 continue
-            buf = buf + n
-            if n == until:
-                done = True
-        return buf
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            self._wait_readable(remaining)
 
-    def read_line(self):
+    def read_line(self, timeout=READ_LINE_TIMEOUT):
         try:
-            return self.read_until("\n").strip()
+            line = self.read_until("\n", timeout)
         except OSError:
             return None
+        if line is None:
+            return None
+        return line.strip()
+
+    def read_lines(self):
+        """Reads the bytes available without blocking and returns the
+        complete lines received so far.
+        """
+        if self._fill() == 0:
+            raise OSError(errno.EIO, "Serial port is disconnected")
+        lines = []
+        while True:
+            line = self._take_until(b"\n")
+            if line is None:
+                return lines
+            lines.append(line.strip())
+
+    def fileno(self):
+        return self.fd
 
     def write(self, str):
         os.write(self.fd, str.encode())
@@ -174,6 +527,25 @@ class SerialPort(object):
     def write_byte(self, byte):
         os.write(self.fd, byte)
 
+    def write_bytes(self, data, timeout=AT_TIMEOUT):
+        """Writes all the bytes, waiting for the port to drain"""
+        offset = 0
+        deadline = time.time() + timeout
+        while offset < len(data):
+            try:
+                written = os.write(
+                    self.fd, data[offset:offset + READ_CHUNK_SIZE])
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                written = 0
+            offset += written
+            if offset < len(data) and not written:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise IOError("write Timeout")
+                select.select([], [self.fd], [], remaining)
+
     def close(self):
         try:
             os.close(self.fd)
@@ -184,10 +556,8 @@ class SerialPort(object):
         ret = None
         for i in (0, loop):
             self.write("AT\r")
-            time.sleep(0.1)
             line = self.read_line()
             if line is None:
-                time.sleep(0.1)
                 continue
             else:
                 ret = ''
@@ -265,10 +635,13 @@ class LazySerialPort:
         self.serial = None
         self.serialport = serialport
         self.bps = bps
+        # incremented every time the port is (re)opened
+        self.session = 0
 
     def _serial(self):
         if self.serial is None:
             self.serial = SerialPort(self.serialport, self.bps)
+            self.session += 1
         return self.serial
 
     def available(self):
@@ -278,8 +651,30 @@ class LazySerialPort:
         except OSError:
             return False
 
-    def read_line(self):
-        return self._serial().read_line()
+    def read_line(self, timeout=READ_LINE_TIMEOUT):
+        """Returns the next line as SerialPort.read_line() does, but
+        raises OSError when the port is disconnected, e.g. when the module
+        has restarted. The port is then closed and reopened by the next
+        access as a new session.
+        """
+        try:
+            line = self._serial().read_until("\n", timeout)
+        except OSError:
+            self.close()
+            raise
+        if line is None:
+            return None
+        return line.strip()
+
+    def read_lines(self):
+        try:
+            return self._serial().read_lines()
+        except OSError:
+            self.close()
+            raise
+
+    def fileno(self):
+        return self._serial().fileno()
 
     def write(self, str):
         return self._serial().write(str)
@@ -287,6 +682,9 @@ class LazySerialPort:
     def write_byte(self, byte):
         return self._serial().write_byte(byte)
 
+    def write_bytes(self, data, timeout=AT_TIMEOUT):
+        return self._serial().write_bytes(data, timeout)
+
     def close(self):
         if self.serial is None:
             return
@@ -296,91 +694,1574 @@ class LazySerialPort:
             self.serial = None
 
 
+class DeadlineExceeded(Exception):
+    """Raised by send_at() once the client has given up on the command"""
+
+
+def command(**meta):
+    """Declares properties of a SockServer command method, e.g.
+    `@command(modem=False)` for a command not talking to the modem.
+    """
+    def decorator(f):
+        f.meta = dict(getattr(f, 'meta', {}), **meta)
+        return f
+    return decorator
+
+
+def command_meta(m):
+    meta = {
+        'modem': True,
+        # {<result field>: <TTL in seconds>} of a read-only command
+        'cache': None,
+        # whether the command changes the state read by the others
+        'invalidates': False,
+        # whether the command only reads the modem state, implied by `cache`
+        'readonly': False,
+        # name of the EventFeed attribute whose events are pushed to the
+        # connection after the response
+        'stream': None,
+        # one of PRIORITIES, implied by `invalidates` and `readonly`
+        'priority': None,
+        # name of the method taking (cmd, callback) used by perform_later()
+        # instead of blocking a thread until the response is ready
+        'later': None,
+    }
+    meta.update(getattr(m, 'meta', {}))
+    if meta['cache'] is not None:
+        meta['readonly'] = True
+    if meta['priority'] is None:
+        if meta['invalidates']:
+            meta['priority'] = 'control'
+        elif meta['readonly']:
+            meta['priority'] = 'telemetry'
+        else:
+            meta['priority'] = 'default'
+    return meta
+
+
+class UrcRegistry(object):
+    """Publish/subscribe registry of unsolicited result codes.
+
+    Callbacks are invoked on the thread reading the modem, so they must
+    return quickly.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.latest = {}
+
+    def subscribe(self, prefix, callback):
+        """Calls `callback(line)` for every URC starting with `prefix`.
+        An empty prefix subscribes to all URCs.
+        """
+        with self.lock:
+            self.subscribers = self.subscribers + [(prefix, callback)]
+
+    def unsubscribe(self, prefix, callback):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers
+                                if s != (prefix, callback)]
+
+    def last(self, prefix):
+        """Returns the last URC published with the given prefix
+        (e.g. "+CREG") or None.
+        """
+        return self.latest.get(prefix)
+
+    def publish(self, line):
+        self.latest[line.split(':')[0]] = line
+        for prefix, callback in self.subscribers:
+            if not line.startswith(prefix):
+                continue
+            try:
+                callback(line)
+            except Exception:
+                logger.error("URC Subscriber Error: %s" %
+                             (''.join(traceback
+                              .format_exception(*sys.exc_info())[-2:])
+                              .strip().replace('\n', ': '))
+                             )
+
+
+class ModemDemux(object):
+    """Routes the lines read from the modem either to the AT command
+    waiting for its response or to the URC registry.
+    """
+
+    def __init__(self, urc):
+        self.urc = urc
+        self.cond = threading.Condition()
+        self.prefixes = None
+        self.lines = []
+
+    def begin(self, prefixes):
+        """Starts collecting the response of an AT command whose
+        information responses have the given prefixes.
+        """
+        with self.cond:
+            self.prefixes = tuple(p + ":" for p in prefixes if p)
+            self.lines = []
+
+    def end(self):
+        with self.cond:
+            self.prefixes = None
+            self.lines = []
+
+    def _is_urc(self, line):
+        if self.prefixes is None:
+            return True
+        if line.startswith(self.prefixes):
+            return is_registration_urc(line)
+        return line.startswith(URC_PREFIXES)
+
+    def feed(self, line):
+        with self.cond:
+            if not self._is_urc(line):
+                self.lines.append(line)
+                self.cond.notify()
+                return
+        if line != "":
+            logger.debug("URC: [%s]" % line)
+            self.urc.publish(line)
+
+    def read_line(self, timeout=READ_LINE_TIMEOUT):
+        deadline = time.time() + timeout
+        with self.cond:
+            while not self.lines:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+            return self.lines.pop(0)
+
+
+class ModemReader(threading.Thread):
+    """Owns the serial port reading and feeds every line to the demux."""
+
+    def __init__(self, serial, demux):
+        super(ModemReader, self).__init__()
+        self.daemon = True
+        self.serial = serial
+        self.demux = demux
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            start = time.time()
+            try:
+                line = self.serial.read_line(READER_TIMEOUT)
+            except OSError:
+                line = None
+            if line is None:
+                # The port returns immediately while it's disconnected
+                if time.time() - start < READER_TIMEOUT / 2:
+                    self.stopped.wait(READER_TIMEOUT)
+                continue
+            self.demux.feed(line)
+
+
+class ModemCall(object):
+    def __init__(self, fn, args, priority='default', client=None):
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.client = client
+        self.queued = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args)
+        except Exception:
+            self.error = sys.exc_info()
+        finally:
+            with self.lock:
+                self.done.set()
+                callbacks = self.callbacks
+                self.callbacks = []
+            for callback in callbacks:
+                self._invoke(callback)
+
+    def add_done_callback(self, callback):
+        """Calls `callback(modem_call)` once the call is done, right away
+        if it's done already.
+        """
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        self._invoke(callback)
+
+    def _invoke(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            logger.error("Callback Error: %s" %
+                         (''.join(traceback
+                          .format_exception(*sys.exc_info())[-2:])
+                          .strip().replace('\n', ': '))
+                         )
+
+    def wait(self, deadline=None):
+        if deadline is None:
+            self.done.wait()
+        elif not self.done.wait(max(0.0, deadline - time.time())):
+            raise DeadlineExceeded()
+        if self.error is not None:
+            raise self.error[1]
+        return self.result
+
+
+class ModemQueue(threading.Thread):
+    """Runs the functions talking to the modem one at a time on a single
+    modem owner thread. The next call is the one of the highest priority,
+    raised by one every MODEM_AGING_INTERVAL spent in the queue, taking
+    turns between the clients of the same priority.
+    """
+
+    def __init__(self):
+        super(ModemQueue, self).__init__()
+        self.daemon = True
+        self.cond = threading.Condition()
+        self.pending = []
+        self.stopped = False
+        # {<client>: <turn>} of the last call run for the clients with
+        # pending calls
+        self.turns = {}
+        self.turn = 0
+        # {<priority>: [<calls>, <total wait>, <max wait>]}
+        self.waits = dict([(p, [0, 0.0, 0.0]) for p in PRIORITIES])
+
+    def is_current(self):
+        return threading.current_thread() is self
+
+    def call(self, fn, *args, **options):
+        """Runs `fn(*args)` on the modem thread and returns its result.
+        `priority` and `client` may be given as keyword arguments.
+        """
+        if self.is_current():
+            return fn(*args)
+        return self.submit(fn, *args, **options).wait()
+
+    def submit(self, fn, *args, **options):
+        """Queues `fn(*args)` and returns its ModemCall without waiting"""
+        modem_call = ModemCall(fn, args,
+                               options.get('priority', 'default'),
+                               options.get('client'))
+        with self.cond:
+            self.pending.append(modem_call)
+            self.cond.notify()
+        return modem_call
+
+    def stop(self):
+        """Stops the thread once the pending calls have run"""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def _level(self, modem_call, now):
+        return PRIORITIES.index(modem_call.priority) - \
+            int((now - modem_call.queued) / MODEM_AGING_INTERVAL)
+
+    def _next(self):
+        """Removes and returns the next call. The lock must be held."""
+        now = time.time()
+        modem_call = min(self.pending, key=lambda c: (
+            self._level(c, now),
+            PRIORITIES.index(c.priority),
+            self.turns.get(c.client, -1)))
+        self.pending.remove(modem_call)
+        self.turn += 1
+        if any(c.client == modem_call.client for c in self.pending):
+            self.turns[modem_call.client] = self.turn
+        else:
+            self.turns.pop(modem_call.client, None)
+        wait = now - modem_call.queued
+        stats = self.waits[modem_call.priority]
+        stats[0] += 1
+        stats[1] += wait
+        stats[2] = max(stats[2], wait)
+        return modem_call
+
+    def metrics(self):
+        """Returns the number of queued calls and the time (in seconds)
+        the calls have waited, per priority
+        """
+        with self.cond:
+            depth = dict([(p, 0) for p in PRIORITIES])
+            for modem_call in self.pending:
+                depth[modem_call.priority] += 1
+            return {
+                'depth': depth,
+                'wait': dict([(p, {
+                    'count': count,
+                    'avg': round(total / count, 3) if count else None,
+                    'max': round(longest, 3),
+                }) for p, (count, total, longest) in self.waits.items()]),
+            }
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if not self.pending:
+                    break
+                modem_call = self._next()
+            modem_call.run()
+
+
+class SingleFlight(object):
+    """Runs identical calls made at the same time only once. The callers
+    arriving while a call is in flight wait for it and share its result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def call(self, key, fn, *args, **options):
+        """Returns `fn(*args)`, or the result of the identical call in
+        flight. Raises DeadlineExceeded when that call isn't done by the
+        `deadline` option (seconds since the epoch) of the caller.
+        """
+        with self.lock:
+            flight = self.calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = ModemCall(fn, args)
+                self.calls[key] = flight
+        if leader:
+            try:
+                flight.run()
+            finally:
+                with self.lock:
+                    del self.calls[key]
+        return flight.wait(options.get('deadline'))
+
+    def submit(self, key, start):
+        """Returns the ModemCall in flight for the key, or the one
+        returned by `start()` when there's none.
+        """
+        with self.lock:
+            flight = self.calls.get(key)
+            if flight is not None:
+                return flight
+            flight = start()
+            self.calls[key] = flight
+        flight.add_done_callback(lambda f: self._land(key, f))
+        return flight
+
+    def _land(self, key, flight):
+        with self.lock:
+            if self.calls.get(key) is flight:
+                del self.calls[key]
+
+
+class Job(object):
+    """Command performed in the background for a request with "async":
+    true. The progress is the number of AT commands sent so far and the
+    last one.
+    """
+
+    def __init__(self, cmd):
+        self.id = uuid.uuid4().hex
+        self.command = '%s %s' % (cmd['category'], cmd['action'])
+        self.created = time.time()
+        self.finished = None
+        self.steps = 0
+        self.at = None
+        self.message = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.callbacks = []
+
+    def on_at(self, at):
+        self.steps += 1
+        self.at = at
+
+    def finish(self, message):
+        with self.lock:
+            self.message = message
+            self.finished = time.time()
+            self.done.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def remove_done_callback(self, callback):
+        with self.lock:
+            self.callbacks = [c for c in self.callbacks if c != callback]
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'command': self.command,
+                'state': 'done' if self.done.is_set() else 'running',
+                'created': track.format_timestamp(self.created),
+                'finished': track.format_timestamp(self.finished)
+                if self.finished is not None else None,
+                'progress': {
+                    'steps': self.steps,
+                    'at': self.at
+                },
+                'result': json.loads(self.message)
+                if self.message is not None else None
+            }
+
+
+class JobTable(object):
+    """Running jobs and the last `size` finished ones"""
+
+    def __init__(self, size=JOB_TABLE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()
+
+    def add(self, job):
+        with self.lock:
+            self.jobs[job.id] = job
+            self._evict()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if job.done.is_set()]
+        for job_id in finished[:max(0, len(finished) - self.size)]:
+            del self.jobs[job_id]
+
+    def on_finished(self, job):
+        with self.lock:
+            self._evict()
+
+
+# Response of a command refreshed in the background, never modified in
+# place but replaced as a whole
+Snapshot = collections.namedtuple('Snapshot',
+                                  ['timestamp', 'expires', 'session',
+                                   'message'])
+
+# Operators found by AT+COPS=? in the modem session
+OperatorScan = collections.namedtuple('OperatorScan',
+                                      ['timestamp', 'session', 'operators'])
+
+
+class Poller(threading.Thread):
+    """Performs a read-only command at a fixed interval and keeps its
+    latest successful response as a Snapshot in `server.snapshots`.
+    """
+
+    def __init__(self, server, cmd, interval, keep_snapshot=True):
+        super(Poller, self).__init__()
+        self.daemon = True
+        self.server = server
+        self.cmd = dict(cmd, fresh=True)
+        self.interval = interval
+        self.keep_snapshot = keep_snapshot
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def poll(self):
+        m = self.server.command_method(self.cmd)
+        generation = self.server.generation
+        session = getattr(self.server.serial, 'session', None)
+        message = self.server.perform(self.cmd)
+        if not self.keep_snapshot:
+            return
+        try:
+            status = json.loads(message)['status']
+        except (TypeError, ValueError, KeyError):
+            return
+        if status == 'OK':
+            now = time.time()
+            self.server.put_snapshot(m.__name__, Snapshot(
+                now, now + self.interval * SNAPSHOT_STALE_POLLS, session,
+                message), generation)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.error("Polling Error: %s" %
+                                      (''.join(traceback
+                                       .format_exception(*sys.exc_info())[-2:])
+                                       .strip().replace('\n', ': '))
+                                      )
+            self.stopped.wait(self.interval)
+
+
+class EventFeed(object):
+    """Pushes event messages to the watchers of a stream command.
+
+    Watchers are called with the lock held, on the thread publishing the
+    event, so they must return quickly. A watcher raising an exception
+    is removed. `on_watchers(count)` is called whenever the number of
+    watchers changes.
+    """
+
+    def __init__(self, on_watchers=None):
+        self.lock = threading.RLock()
+        self.watchers = []
+        self.on_watchers = on_watchers
+
+    def watch(self, callback):
+        with self.lock:
+            self.watchers = self.watchers + [callback]
+            count = len(self.watchers)
+        self._watchers_changed(count)
+
+    def unwatch(self, callback):
+        with self.lock:
+            if callback not in self.watchers:
+                return
+            self.watchers = [w for w in self.watchers if w != callback]
+            count = len(self.watchers)
+        self._watchers_changed(count)
+
+    def _watchers_changed(self, count):
+        if self.on_watchers is not None:
+            self.on_watchers(count)
+
+    def publish(self, message):
+        with self.lock:
+            count = len(self.watchers)
+            for callback in self.watchers:
+                try:
+                    callback(message)
+                except Exception:
+                    logger.error("Watcher Error: %s" %
+                                 (''.join(traceback
+                                  .format_exception(*sys.exc_info())[-2:])
+                                  .strip().replace('\n', ': '))
+                                 )
+                    self.watchers = [w for w in self.watchers
+                                     if w != callback]
+            removed = count != len(self.watchers)
+            count = len(self.watchers)
+        if removed:
+            self._watchers_changed(count)
+
+
+class NetworkState(EventFeed):
+    """Latest network state known to the server, fed by registration URCs
+    and network show. The watchers receive an event message whenever one
+    of its fields changes, so they add no traffic to the modem.
+    """
+
+    URC_FIELDS = {
+        '+CREG:': 'cs',
+        '+CGREG:': 'ps',
+        '+CEREG:': 'eps',
+    }
+
+    def __init__(self, on_watchers=None):
+        super(NetworkState, self).__init__(on_watchers)
+        self.state = {}
+
+    def update(self, fields):
+        with self.lock:
+            changed = sorted([name for name, value in fields.items()
+                              if self.state.get(name) != value])
+            if not changed:
+                return
+            self.state = dict(self.state, **fields)
+            self.publish(json.dumps({
+                'event': 'network',
+                'changed': changed,
+                'result': self.state
+            }))
+
+    def on_urc(self, line):
+        """Takes "+CREG: <stat>" and the like, reported while the URCs are
+        enabled by AT+CREG=1.
+        """
+        prefix, _, params = line.partition(':')
+        try:
+            stat = int(params.split(',')[0])
+            self.update({self.URC_FIELDS[prefix + ':']: CGREG_STATS[stat]})
+        except (KeyError, IndexError, ValueError):
+            pass
+
+
+class GnssFeed(EventFeed):
+    """Latest GNSS fix, pushed to the watchers as it arrives"""
+
+    def __init__(self, on_watchers=None):
+        super(GnssFeed, self).__init__(on_watchers)
+        self.latest = None
+
+    def put(self, fix):
+        with self.lock:
+            self.latest = fix
+            self.publish(json.dumps({
+                'event': 'gnss',
+                'result': fix
+            }))
+
+
+class GnssSession(object):
+    """Time to first fix, 516 (not fixed yet) responses and the
+    satellite count and HDOP trend of a GNSS session started by gnss
+    start, along with its configuration.
+    """
+
+    def __init__(self, config):
+        self.lock = threading.Lock()
+        self.config = config
+        self.started = time.time()
+        self.ended = None
+        self.ttff = None
+        self.ttff_3d = None
+        self.not_fixed = 0
+        self.fixes = 0
+        # [<seconds since the start>, <fixes>, <nsat sum>, <nsat count>,
+        #  <hdop sum>, <hdop count>] per GNSS_TREND_INTERVAL
+        self.trend = collections.deque(maxlen=GNSS_TREND_SIZE)
+
+    def on_fix(self, fix):
+        with self.lock:
+            if self.ended is not None:
+                return
+            elapsed = time.time() - self.started
+            self.fixes += 1
+            if self.ttff is None:
+                self.ttff = round(elapsed, 3)
+            if self.ttff_3d is None and fix.get('fix') == '3D':
+                self.ttff_3d = round(elapsed, 3)
+            since = int(elapsed // GNSS_TREND_INTERVAL) * GNSS_TREND_INTERVAL
+            if not self.trend or self.trend[-1][0] != since:
+                self.trend.append([since, 0, 0, 0, 0.0, 0])
+            sample = self.trend[-1]
+            sample[1] += 1
+            if fix.get('nsat') is not None:
+                sample[2] += fix['nsat']
+                sample[3] += 1
+            if fix.get('hdop') is not None:
+                sample[4] += fix['hdop']
+                sample[5] += 1
+
+    def acquiring(self):
+        """Whether the session is running without a 3D fix yet"""
+        with self.lock:
+            return self.ended is None and self.ttff_3d is None
+
+    def on_not_fixed(self):
+        with self.lock:
+            if self.ended is None:
+                self.not_fixed += 1
+
+    def end(self):
+        with self.lock:
+            if self.ended is None:
+                self.ended = time.time()
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'config': self.config,
+                'started': track.format_timestamp(self.started),
+                'ended': track.format_timestamp(self.ended)
+                if self.ended is not None else None,
+                'ttff': self.ttff,
+                'ttff3d': self.ttff_3d,
+                'notFixed': self.not_fixed,
+                'fixes': self.fixes,
+                'trend': [{
+                    'elapsed': since,
+                    'fixes': fixes,
+                    'nsat': round(float(nsat) / nsats, 1) if nsats else None,
+                    'hdop': round(hdop / hdops, 2) if hdops else None,
+                } for since, fixes, nsat, nsats, hdop, hdops in self.trend]
+            }
+
+
+class NmeaPort(object):
+    """Read-only NMEA port of the module, e.g. "/dev/ttyUSB1" """
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+        if os.isatty(self.fd):
+            tty.setraw(self.fd)
+        self.rbuf = b''
+
+    def read_lines(self, timeout):
+        """Returns the complete lines received within `timeout` seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, READ_CHUNK_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise
+        if not data:
+            raise IOError("NMEA port closed")
+        lines = (self.rbuf + data).split(b'\n')
+        self.rbuf = lines.pop()
+        return [l.decode('ascii', 'replace').strip() for l in lines]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class NmeaReader(threading.Thread):
+    """Parses the NMEA sentences of the module and puts the fixes to
+    `server.gnss`. The sentences are read from the NMEA port when the
+    server has one, and otherwise polled with gnss nmea.
+    """
+
+    def __init__(self, server):
+        super(NmeaReader, self).__init__()
+        self.daemon = True
+        self.server = server
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def read_port(self):
+        port = NmeaPort(self.server.nmea_port)
+        try:
+            while not self.stopped.is_set():
+                for line in port.read_lines(NMEA_POLL_INTERVAL):
+                    yield line
+        finally:
+            port.close()
+
+    def poll(self):
+        cmd = {'category': 'gnss', 'action': 'nmea'}
+        while not self.stopped.is_set():
+            started = time.time()
+            message = json.loads(self.server.perform(cmd))
+            if message['status'] == 'OK':
+                for line in message['result']:
+                    yield line
+            self.stopped.wait(
+                max(0, started + NMEA_POLL_INTERVAL - time.time()))
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                if self.server.nmea_port:
+                    lines = self.read_port()
+                else:
+                    lines = self.poll()
+                for fix in nmea.fixes(lines):
+                    self.server.put_fix(fix)
+            except Exception:
+                logger.error("NMEA Error: %s" %
+                                      (''.join(traceback
+                                       .format_exception(*sys.exc_info())[-2:])
+                                       .strip().replace('\n', ': '))
+                                      )
+                self.stopped.wait(NMEA_POLL_INTERVAL)
+
+
+class Watcher(object):
+    """Watcher of an EventFeed handing the events to `write(message)`.
+    The events are held back until start(), i.e. until the response to
+    the watch command has been written.
+    """
+
+    def __init__(self, feed, write):
+        self.feed = feed
+        self.write = write
+        self.lock = threading.Lock()
+        self.started = False
+        self.pending = []
+
+    def __call__(self, message):
+        with self.lock:
+            if not self.started:
+                self.pending.append(message)
+                return
+            self.write(message)
+
+    def start(self, state=None):
+        """Writes the events held back, except for the ones already
+        reflected in the state sent with the response.
+        """
+        with self.lock:
+            self.started = True
+            pending = self.pending
+            self.pending = []
+            for i in reversed(range(len(pending))):
+                if json.loads(pending[i])['result'] == state:
+                    pending = pending[i + 1:]
+                    break
+            for message in pending:
+                self.write(message)
+
+    def stop(self):
+        self.feed.unwatch(self)
+
+
+class ModemIdentity(object):
+    """Model and capabilities of the modem module, probed with ATI"""
+
+    def __init__(self, manufacturer, model, revision):
+        self.manufacturer = manufacturer
+        self.model = model
+        self.revision = revision
+        if model == 'UC20':
+            self.family = 'UC2x'
+        else:
+            self.family = 'EC2x'
+        # AT+QNWINFO, otherwise the band is shown by AT+QGBAND
+        self.qnwinfo = self.family != 'UC2x'
+        # AT+QGPSCFG="gnssconfig", otherwise "glonassenable"
+        self.gnssconfig = self.family != 'UC2x'
+        # QZSS along with GLONASS/BeiDou/Galileo by "gnssconfig"
+        self.qzss = self.gnssconfig
+
+    @staticmethod
+    def parse(result):
+        info = result.split("\n") + ["", "", ""]
+        return ModemIdentity(info[0], info[1], info[2][10:])
+
+
+class ResponseCache(object):
+    """Keeps the responses of read-only commands along with the TTL
+    declared for each of their result fields. A response is reused as a
+    whole while all of its fields are fresh, and the fresh fields are
+    available individually to the command producing it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.session = None
+
+    def check_session(self, session):
+        """Clears the cache when the modem has been reconnected"""
+        with self.lock:
+            if session != self.session:
+                self.entries = {}
+                self.session = session
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+    def put(self, key, ttls, message):
+        try:
+            result = json.loads(message)
+        except (TypeError, ValueError):
+            return
+        if result.get('status') != 'OK' or \
+                not isinstance(result.get('result'), dict):
+            return
+        now = time.time()
+        fields = {}
+        for name, value in result['result'].items():
+            if name in ttls:
+                fields[name] = (now + ttls[name], value)
+        if all([name in ttls for name in result['result']]):
+            expires = min([ttls[name] for name in result['result']] or [0])
+        else:
+            expires = 0
+        with self.lock:
+            self.entries[key] = (now, now + expires, message, fields)
+
+    def get(self, key):
+        """Returns the cached response marked with its age, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        created, expires, message, fields = entry
+        now = time.time()
+        if now >= expires:
+            return None
+        return '{"cached": true, "age": %.3f, %s' % (now - created,
+                                                      message[1:])
+
+    def fields(self, key, names):
+        """Returns the fresh values of the given result fields if all of
+        them are cached, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        values = {}
+        for name in names:
+            if name not in entry[3] or now >= entry[3][name][0]:
+                return None
+            values[name] = entry[3][name][1]
+        return values
+
+
 class SockServer(threading.Thread):
     def __init__(self, version,
-                 sock_path="/var/run/candy-board-service.sock", serial=None):
+                 sock_path="/var/run/candy-board-service.sock", serial=None,
+                 network_poll_interval=None, nmea_port=None,
+                 xtra_file=None):
         super(SockServer, self).__init__()
         self.version = version
         self.sock_path = sock_path
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.serial = serial
         self.debug = False
+        self.urc = UrcRegistry()
+        self.demux = None
+        self.reader = None
+        self.modem = None
+        # AT responses shared between the commands of a batch
+        self.memo = None
+        # deadline (seconds since the epoch) and AT command timeout (in
+        # seconds) of the command performed on the modem, from the
+        # `deadline` and `timeout_ms` of the request
+        self.deadline = None
+        self.at_timeout = None
+        # Job of the command performed on the modem, if any
+        self.job = None
+        self.jobs = JobTable()
+        self.cache = ResponseCache()
+        self.flights = SingleFlight()
+        # last OperatorScan, and the Job scanning for the operators
+        self.operator_scan = None
+        self.scan_job = None
+        self.scan_lock = threading.Lock()
+        self.identity = None
+        self.identity_session = None
+        # seconds between network show refreshes in the background
+        self.network_poll_interval = network_poll_interval
+        self.pollers = []
+        # {<command method name>: Snapshot} refreshed by the pollers
+        self.snapshots = {}
+        # incremented whenever a command invalidates the stored responses
+        self.generation = 0
+        self.snapshot_lock = threading.Lock()
+        self.network_state = NetworkState(self.update_watch_poller)
+        for prefix in NetworkState.URC_FIELDS:
+            self.urc.subscribe(prefix, self.network_state.on_urc)
+        # network show poller running while the network is watched
+        self.watch_poller = None
+        self.watch_lock = threading.Lock()
+        # whether the registration URCs are enabled, and in which session
+        self.watch_urcs = False
+        self.watch_session = None
+        # NMEA port of the module, the sentences are polled without it
+        self.nmea_port = nmea_port
+        self.gnss = GnssFeed(self.update_nmea_reader)
+        self.history = track.FixHistory(GNSS_HISTORY_SIZE)
+        self.geofences = geofence.Geofences()
+        # geofence enter/exit events
+        self.geofence_feed = EventFeed(self.update_nmea_reader)
+        # reader running while the GNSS fixes are watched
+        self.nmea_reader = None
+        # XTRA file applied by gnss start, and the (<session>, <path>,
+        # <mtime>) of the last one applied
+        self.xtra_file = xtra_file
+        self.xtra_applied = None
+        # (<session>,) of the last XTRA data injected
+        self.xtra_injected = None
+        # GNSS session started by gnss start, and the ended ones
+        self.gnss_session = None
+        self.gnss_sessions = collections.deque(maxlen=GNSS_SESSIONS_KEPT)
+        # {<watching connection>: Watcher}
+        self.watchers = {}
+        # (fn, args) run by the workers
+        self.tasks = queue.Queue()
+        # {<connection waiting for its next request>: <deadline>}
+        self.idle = {}
+        self.idle_lock = threading.Lock()
+        self.wakeup = os.pipe()
+
+    def start_reader(self):
+        """Starts the thread reading the modem. Solicited lines are then
+        handed over to send_at() and URCs are published to `self.urc`.
+        """
+        if self.reader is not None:
+            return
+        self.demux = ModemDemux(self.urc)
+        self.reader = ModemReader(self.serial, self.demux)
+        self.reader.start()
+
+    def start_pollers(self):
+        if self.network_poll_interval and not self.pollers:
+            poller = Poller(self, {'category': 'network', 'action': 'show'},
+                            self.network_poll_interval)
+            self.pollers.append(poller)
+            poller.start()
+
+    def stop_pollers(self):
+        for poller in self.pollers:
+            poller.stop()
+            poller.join()
+        self.pollers = []
+
+    def update_watch_poller(self, watchers):
+        """Keeps network show polled while there are watchers, unless the
+        configured poller already does.
+        """
+        with self.watch_lock:
+            if watchers and not self.network_poll_interval:
+                if self.watch_poller is None:
+                    self.watch_poller = Poller(
+                        self, {'category': 'network', 'action': 'show'},
+                        WATCH_POLL_INTERVAL, keep_snapshot=False)
+                    self.watch_poller.start()
+            elif self.watch_poller is not None:
+                self.watch_poller.stop()
+                self.watch_poller = None
+
+    def update_nmea_reader(self, watchers=None):
+        """Keeps the NMEA sentences read while there are GNSS or geofence
+        watchers, and while the GNSS session has no 3D fix yet so that
+        its time to first fix doesn't depend on when the clients locate
+        """
+        session = self.gnss_session
+        # without the modem thread, polling would race the requests
+        acquiring = session is not None and session.acquiring() and \
+            (self.modem is not None or bool(self.nmea_port))
+        with self.watch_lock:
+            if self.gnss.watchers or self.geofence_feed.watchers or \
+                    acquiring:
+                if self.nmea_reader is None:
+                    self.nmea_reader = NmeaReader(self)
+                    self.nmea_reader.start()
+            elif self.nmea_reader is not None:
+                self.nmea_reader.stop()
+                self.nmea_reader = None
+
+    def put_fix(self, fix):
+        """Keeps a new fix in the history, pushes it to the watchers and
+        the geofence transitions it makes to the geofence watchers
+        """
+        if not self.history.append(fix):
+            return
+        session = self.gnss_session
+        if session is not None:
+            acquiring = session.acquiring()
+            session.on_fix(fix)
+            if acquiring and not session.acquiring():
+                # the reader may have been kept for the first 3D fix only
+                self.update_nmea_reader()
+        self.gnss.put(fix)
+        for fence_id, transition in self.geofences.update(
+                fix['latitude'], fix['longitude']):
+            self.geofence_feed.publish(json.dumps({
+                'event': 'geofence',
+                'id': fence_id,
+                'transition': transition,
+                'result': fix
+            }))
+
+    def put_snapshot(self, name, snapshot, generation):
+        """Stores the snapshot unless a command has invalidated the state
+        since the poll started.
+        """
+        with self.snapshot_lock:
+            if generation != self.generation:
+                return False
+            self.snapshots[name] = snapshot
+        return True
+
+    def stop_reader(self):
+        if self.reader is None:
+            return
+        self.reader.stop()
+        self.reader.join()
+        self.reader = None
+        self.demux = None
 
     def recv(self, connection, size):
-        ready, _, _ = select.select([connection], [], [], 5)
-        if ready:
-            return connection.recv(size)
-        else:
-            raise IOError("recv Timeout")
+        """Receives `size` bytes. Returns None when the peer has closed
+        the connection before sending anything.
+        """
+        buf = b''
+        while len(buf) < size:
+            ready, _, _ = select.select([connection], [], [], RECV_TIMEOUT)
+            if not ready:
+                raise IOError("recv Timeout")
+            data = connection.recv(size - len(buf))
+            if not data:
+                if buf:
+                    raise IOError("Connection closed")
+                return None
+            buf += data
+        return buf
 
     def run(self):
+        if self.serial is not None:
+            self.start_reader()
+        if self.modem is None:
+            self.modem = ModemQueue()
+            self.modem.start()
+        self.start_pollers()
+        for i in range(WORKER_THREADS):
+            worker = threading.Thread(target=self.run_tasks)
+            worker.daemon = True
+            worker.start()
         self.sock.bind(self.sock_path)
         self.sock.listen(128)
-        header_packer = struct.Struct("I")
         print("Listening to the socket[%s]...." % self.sock_path)
 
         while True:
             try:
                 logger.debug("Waiting for an incoming request")
-                connection, client_address = self.sock.accept()
-                connection.setblocking(0)
-
-                # request
-                logger.debug("Request has arrived!")
-                header = self.recv(connection, header_packer.size)
-                size = header_packer.unpack(header)
-                logger.debug("Size:%d" % size)
-                unpacker_body = struct.Struct("%is" % size)
-                cmd_json = self.recv(connection, unpacker_body.size)
-                logger.debug("Body:[%s]" % cmd_json)
-                cmd = json.loads(cmd_json)
-
-                # response
-                logger.debug("Performing a command")
-                message = self.perform(cmd)
-                logger.debug("Command done!")
-                if message:
-                    size = len(message)
-                else:
-                    size = 0
-                packed_header = header_packer.pack(size)
-                connection.sendall(packed_header)
-                logger.debug("Size:%d" % size)
-                if size > 0:
-                    packer_body = struct.Struct("%is" % size)
-                    packed_message = packer_body.pack(message.encode('utf-8'))
-                    logger.debug("Body:[%s]" % message)
-                    connection.sendall(packed_message)
-
-            except socket.error as e:
-                if isinstance(e.args, tuple):
-                    if e[0] == errno.EPIPE:
-                        continue
-                logger.error("Socket Error: %s" %
+                self.poll_connections()
+            except Exception:
+                logger.error("Unexpected Error: %s" %
                                       (''.join(traceback
                                        .format_exception(*sys.exc_info())[-2:])
                                        .strip().replace('\n', ': '))
                                       )
 
+    def poll_connections(self):
+        """Accepts new connections and hands the connections whose request
+        has arrived to a worker, so that no worker waits for a client.
+        """
+        with self.idle_lock:
+            idle = list(self.idle.keys())
+        ready, _, _ = select.select([self.sock, self.wakeup[0]] + idle,
+                                    [], [], 1)
+        for r in ready:
+            if r is self.sock:
+                connection, client_address = self.sock.accept()
+                with self.idle_lock:
+                    self.idle[connection] = time.time() + RECV_TIMEOUT
+            elif r == self.wakeup[0]:
+                os.read(self.wakeup[0], 4096)
+            else:
+                # anything sent by a watching client ends the watch
+                self.unwatch_connection(r)
+                with self.idle_lock:
+                    del self.idle[r]
+                self.tasks.put((self.serve, (r,)))
+        now = time.time()
+        with self.idle_lock:
+            for connection, deadline in list(self.idle.items()):
+                if now > deadline:
+                    del self.idle[connection]
+                    connection.close()
+
+    def keep_alive(self, connection, timeout=KEEPALIVE_TIMEOUT):
+        """Watches the connection for the next request"""
+        with self.idle_lock:
+            self.idle[connection] = time.time() + timeout
+        os.write(self.wakeup[1], b'.')
+
+    def unwatch_connection(self, connection):
+        with self.idle_lock:
+            watcher = self.watchers.pop(connection, None)
+        if watcher is not None:
+            watcher.stop()
+
+    def stream_feed(self, cmd):
+        """Returns the EventFeed streamed by the command, or None"""
+        m = self.command_method(cmd)
+        if m is None or command_meta(m)['stream'] is None:
+            return None
+        return getattr(self, command_meta(m)['stream'])
+
+    def is_ok(self, message):
+        try:
+            return json.loads(message)['status'] == 'OK'
+        except (TypeError, ValueError, KeyError):
+            return False
+
+    def push_event(self, connection, message):
+        frame = self.pack_response(message)
+        try:
+            if connection.send(frame) == len(frame):
+                return
+        except socket.error:
+            pass
+        # wakes up poll_connections() to close the connection
+        connection.shutdown(socket.SHUT_RDWR)
+        raise IOError("Network watcher can't keep up with the events")
+
+    def run_tasks(self):
+        while True:
+            fn, args = self.tasks.get()
+            try:
+                fn(*args)
             except Exception:
                 logger.error("Unexpected Error: %s" %
-                                      (''.join(traceback
-                                       .format_exception(*sys.exc_info())[-2:])
-                                       .strip().replace('\n', ': '))
-                                      )
+                             (''.join(traceback
+                              .format_exception(*sys.exc_info())[-2:])
+                              .strip().replace('\n', ': '))
+                             )
+
+    def serve(self, connection):
+        if not self.handle(connection):
+            connection.close()
+
+    def respond(self, connection, cmd, message, watcher=None):
+        """Writes the response, then closes the connection or keeps it
+        alive for the next request. The events of a successful watch are
+        pushed to the connection from then on.
+        """
+        keepalive = False
+        timeout = KEEPALIVE_TIMEOUT
+        watching = False
+        ok = self.is_ok(message)
+        state = json.loads(message)['result'] if ok else None
+        try:
+            message = self.response_message(cmd, message)
+            logger.debug("Body:[%s]" % message)
+            connection.sendall(self.pack_response(message))
+            keepalive = cmd.get('keepalive') is True
+            if watcher is not None and ok:
+                connection.setblocking(False)
+                with self.idle_lock:
+                    self.watchers[connection] = watcher
+                watching = True
+                watcher.start(state)
+                keepalive = True
+                timeout = float('inf')
+
+        except socket.error as e:
+            if not e.args or e.args[0] != errno.EPIPE:
+                logger.error("Socket Error: %s" %
+                             (''.join(traceback
+                              .format_exception(*sys.exc_info())[-2:])
+                              .strip().replace('\n', ': '))
+                             )
+
+        except Exception:
+            logger.error("Unexpected Error: %s" %
+                         (''.join(traceback
+                          .format_exception(*sys.exc_info())[-2:])
+                          .strip().replace('\n', ': '))
+                         )
+            keepalive = False
+
+        finally:
+            if watcher is not None and not (watching and keepalive):
+                self.unwatch_connection(connection)
+                watcher.stop()
+            if keepalive:
+                self.keep_alive(connection, timeout)
+            else:
+                connection.close()
+
+    def response_message(self, cmd, message):
+        """Puts the request ID, if any, into the response message"""
+        if 'id' not in cmd or not message or not message.startswith('{'):
+            return message
+        return '{"id": %s, %s' % (json.dumps(cmd['id']), message[1:])
+
+    def pack_response(self, message):
+        body = message.encode('utf-8') if message else b''
+        return struct.pack("I", len(body)) + body
+
+    def handle(self, connection):
+        """Reads a request from the connection and performs it. The
+        response is written by a worker once the command is done, while
+        this one goes on serving the other connections. Returns False
+        when the connection is to be closed right away.
+        """
+        header_packer = struct.Struct("I")
+        try:
+            connection.settimeout(RECV_TIMEOUT)
+
+            # request
+            header = self.recv(connection, header_packer.size)
+            if header is None:
+                return False
+            logger.debug("Request has arrived!")
+            size = header_packer.unpack(header)
+            logger.debug("Size:%d" % size)
+            unpacker_body = struct.Struct("%is" % size)
+            cmd_json = self.recv(connection, unpacker_body.size)
+            if cmd_json is None:
+                raise IOError("Connection closed")
+            logger.debug("Body:[%s]" % cmd_json)
+            cmd = json.loads(cmd_json.decode('utf-8'))
+
+            # response
+            logger.debug("Performing a command")
+            watcher = None
+            feed = self.stream_feed(cmd)
+            if feed is not None:
+                # watching before the state is read, so no change is missed
+                watcher = Watcher(
+                    feed, lambda message: self.push_event(connection, message))
+                feed.watch(watcher)
+            self.perform_later(cmd, lambda message: self.tasks.put(
+                (self.respond, (connection, cmd, message, watcher))),
+                connection.fileno())
+            return True
+
+        except socket.error as e:
+            if e.args and e.args[0] == errno.EPIPE:
+                return False
+            logger.error("Socket Error: %s" %
+                                  (''.join(traceback
+                                   .format_exception(*sys.exc_info())[-2:])
+                                   .strip().replace('\n', ': '))
+                                  )
+
+        except Exception:
+            logger.error("Unexpected Error: %s" %
+                                  (''.join(traceback
+                                   .format_exception(*sys.exc_info())[-2:])
+                                   .strip().replace('\n', ': '))
+                                  )
+        return False
+
+    def _lookup(self, cmd):
+        if cmd['category'][0] == '_':
+            raise AttributeError()
+        return getattr(self.__class__,
+                       "%s_%s" % (cmd['category'], cmd['action']))
+
+    def command_method(self, cmd):
+        """Returns the method performing the given command, or None."""
+        try:
+            return self._lookup(cmd)
+        except Exception:
+            return None
+
+    def perform(self, cmd):
+        try:
+            m = self._lookup(cmd)
+            cmd = self._with_deadline(cmd)
+        except AttributeError:
+            return self.error_message("Unknown Command")
+        except (KeyError, TypeError, ValueError):
+            return self.error_message("Invalid Args")
+        meta = command_meta(m)
+        if (cmd.get('async') or meta['later'] is not None) and \
+                self.in_modem_call():
+            # a job would run to completion right away, and waiting for
+            # one would keep it from running
+            return self.error_message("Invalid Args")
+        if cmd.get('async'):
+            return self.start_job(cmd)
+        message = self._stored_message(m, meta, cmd)
+        if message is not None:
+            return message
+        if meta['readonly'] and meta['modem'] and \
+                (self.modem is None or not self.modem.is_current()):
+            # identical requests in flight share a single run on the modem
+            try:
+                return self.flights.call(self._flight_key(cmd),
+                                         self._perform_command, m, meta, cmd,
+                                         deadline=cmd.get('deadline'))
+            except DeadlineExceeded:
+                return self.error_message("Deadline Exceeded")
+        return self._perform_command(m, meta, cmd)
+
+    def in_modem_call(self):
+        """Returns whether a command is performed on the modem by this
+        thread, e.g. a command of batch run
+        """
+        return self.memo is not None or \
+            (self.modem is not None and self.modem.is_current())
+
+    def perform_later(self, cmd, callback, client=None):
+        """Performs the command as perform() does and calls
+        `callback(message)` with its response. A command talking to the
+        modem is queued without waiting for it, taking turns with the
+        other clients, and the callback is then called on the modem
+        thread.
+        """
+        m = self.command_method(cmd)
+        if m is not None and command_meta(m)['later'] is not None and \
+                not cmd.get('async'):
+            getattr(self, command_meta(m)['later'])(cmd, callback)
+            return
+        if m is None or self.modem is None or self.modem.is_current() or \
+                not command_meta(m)['modem'] or cmd.get('async'):
+            callback(self.perform(cmd))
+            return
+        try:
+            # the time spent in the queue counts
+            cmd = self._with_deadline(cmd)
+        except (TypeError, ValueError):
+            callback(self.error_message("Invalid Args"))
+            return
+        meta = command_meta(m)
+        message = self._stored_message(m, meta, cmd)
+        if message is not None:
+            callback(message)
+            return
+
+        started = []
+        lock = threading.Lock()
+        answered = []
+        timers = []
+
+        def start():
+            started.append(True)
+            return self.modem.submit(self._perform_command, m, meta, cmd,
+                                     priority=meta['priority'], client=client)
+
+        def respond(message):
+            with lock:
+                if answered:
+                    return
+                answered.append(True)
+            for timer in timers:
+                timer.cancel()
+            callback(message)
+
+        def done(modem_call):
+            if modem_call.error is not None:
+                respond(self.error_message(
+                    "Unexpected error: %s" % modem_call.error[1]))
+            else:
+                respond(modem_call.result)
+
+        if meta['readonly']:
+            modem_call = self.flights.submit(self._flight_key(cmd), start)
+        else:
+            modem_call = start()
+        if not started and 'deadline' in cmd:
+            # joined the identical call in flight, waiting for it no
+            # longer than the own deadline
+            timer = threading.Timer(
+                max(0.0, float(cmd['deadline']) - time.time()), respond,
+                (self.error_message("Deadline Exceeded"),))
+            timer.daemon = True
+            timers.append(timer)
+            timer.start()
+        modem_call.add_done_callback(done)
+
+    def start_job(self, cmd):
+        """Performs the command in the background and responds with the
+        id of its Job right away
+        """
+        meta = command_meta(self._lookup(cmd))
+        if meta['stream'] is not None or meta['later'] is not None:
+            return self.error_message("Invalid Args")
+        job = self._start_job(cmd)
+        message = {
+            'status': 'OK',
+            'result': {
+                'job': job.id
+            }
+        }
+        return json.dumps(message)
+
+    def _start_job(self, cmd):
+        job = Job(cmd)
+        self.jobs.add(job)
+        # nobody waits for the response of a job
+        job_cmd = dict((k, v) for k, v in cmd.items()
+                       if k not in ('async', 'deadline', 'timeout_ms'))
+        job_cmd['job'] = job.id
+
+        def done(message):
+            job.finish(message)
+            self.jobs.on_finished(job)
+        self.perform_later(job_cmd, done)
+        return job
+
+    def _with_deadline(self, cmd):
+        """Returns the command with the `deadline` implied by its
+        `timeout_ms`, the time the client waits for the response.
+        Raises ValueError or TypeError when they're invalid.
+        """
+        if 'timeout_ms' in cmd and 'deadline' not in cmd:
+            timeout = float(cmd['timeout_ms']) / 1000
+            if timeout <= 0:
+                raise ValueError("timeout_ms must be positive")
+            cmd = dict(cmd, deadline=time.time() + timeout)
+        elif 'deadline' in cmd:
+            float(cmd['deadline'])
+        return cmd
+
+    def _flight_key(self, cmd):
+        # the callers of a shared run keep their own deadlines
+        return json.dumps(dict((k, v) for k, v in cmd.items()
+                               if k not in ('id', 'keepalive', 'deadline',
+                                            'timeout_ms')),
+                          sort_keys=True)
+
+    def _stored_message(self, m, meta, cmd):
+        """Returns the polled or cached response to the command, if any"""
+        if not cmd.get('fresh'):
+            message = self.snapshot_message(m.__name__)
+            if message is not None:
+                return message
+        if meta['cache'] is not None:
+            self.cache.check_session(getattr(self.serial, 'session', None))
+            if not cmd.get('fresh'):
+                return self.cache.get(m.__name__)
+        return None
 
-            finally:
-                if 'connection' in locals():
-                    connection.close()
+    def snapshot_message(self, name):
+        """Returns the polled response of the command marked with its age,
+        or None when it isn't polled or the poller has fallen behind.
+        """
+        snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            return None
+        now = time.time()
+        if now >= snapshot.expires or \
+                snapshot.session != getattr(self.serial, 'session', None):
+            return None
+        return '{"cached": true, "age": %.3f, %s' % (now - snapshot.timestamp,
+                                                      snapshot.message[1:])
+
+    def _perform_command(self, m, meta, cmd):
+        if not meta['modem']:
+            message = self._perform(m, cmd)
+        elif self.modem is not None:
+            message = self.modem.call(self._perform_on_modem, m, cmd,
+                                      priority=meta['priority'])
+        else:
+            message = self._perform_on_modem(m, cmd)
+        if meta['cache'] is not None:
+            self.cache.put(m.__name__, meta['cache'], message)
+        if meta['invalidates']:
+            self.cache.clear()
+            with self.snapshot_lock:
+                self.generation += 1
+                self.snapshots = {}
+        return message
 
-    def perform(self, cmd):
+    def _perform_on_modem(self, m, cmd):
         if self.serial is None or self.serial.available() is False:
             return self.error_message("Modem is not ready")
+        deadline = cmd.get('deadline', self.deadline)
+        if deadline is not None and time.time() >= deadline:
+            # the client has given up while the command was queued
+            return self.error_message("Deadline Exceeded")
+        outer = (self.deadline, self.at_timeout, self.job)
+        # commands of a batch inherit the ones of the batch
+        self.deadline = deadline
+        if 'timeout_ms' in cmd:
+            self.at_timeout = float(cmd['timeout_ms']) / 1000
+        if 'job' in cmd:
+            self.job = self.jobs.get(cmd['job'])
+        try:
+            return self._perform(m, cmd)
+        finally:
+            (self.deadline, self.at_timeout, self.job) = outer
+
+    def _perform(self, m, cmd):
         try:
-            if cmd['category'][0] == '_':
-                raise AttributeError()
-            m = getattr(self.__class__,
-                        "%s_%s" % (cmd['category'], cmd['action']))
             return m(self, cmd)
         except AttributeError:
             return self.error_message("Unknown Command")
@@ -388,6 +2269,8 @@ class SockServer(threading.Thread):
             return self.error_message("Invalid Args")
         except OSError:  # I/O Error
             return self.error_message("Modem is not ready")
+        except DeadlineExceeded:
+            return self.error_message("Deadline Exceeded")
         except Exception:
             return self.error_message("Unexpected error: %s" %
                                       (''.join(traceback
@@ -398,38 +2281,99 @@ class SockServer(threading.Thread):
     def error_message(self, msg):
         return json.dumps({"status": "ERROR", "result": msg})
 
-    def read_line(self):
-        line = self.serial.read_line()
+    def read_line(self, timeout=READ_LINE_TIMEOUT):
+        if self.demux is not None:
+            line = self.demux.read_line(timeout)
+        else:
+            line = self.serial.read_line(timeout)
         if self.debug:
             print("[modem:IN] => [%s]" % line)
         return line
 
-    def send_at(self, cmd, ok="OK"):
+    def _discard_input(self):
+        # Drop lines left over from a previous command, e.g. the trailing
+        # OK after "+CME ERROR: 0", so that they aren't taken as a part of
+        # the next response. The demux publishes them as unsolicited.
+        if self.demux is not None:
+            return
+        while True:
+            line = self.serial.read_line(0)
+            if line is None:
+                break
+            if line != "":
+                logger.debug("Discarded a stale line: [%s]" % line)
+
+    def send_at(self, cmd, ok="OK", timeout=None):
+        """Sends the AT command line and returns (status, result). The
+        response is waited for `timeout` seconds, by default the
+        `timeout_ms` of the request or the time in AT_TIMEOUTS, and no
+        longer than the deadline of the request.
+        """
+        if self.memo is not None:
+            if not is_query(cmd):
+                self.memo.clear()
+            elif cmd in self.memo:
+                return self.memo[cmd]
+        if self.job is not None:
+            self.job.on_at(cmd)
+        if timeout is None:
+            timeout = self.at_timeout or at_timeout(cmd)
+        response = self._send_at_once(cmd, ok, self._until_deadline(timeout))
+        if self.memo is not None and is_query(cmd):
+            self.memo[cmd] = response
+        return response
+
+    def _until_deadline(self, timeout):
+        """Returns the timeout (in seconds) cut down to the deadline of
+        the request. Raises DeadlineExceeded once the deadline has passed.
+        """
+        if self.deadline is not None:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                raise DeadlineExceeded()
+            timeout = min(timeout, remaining)
+        return timeout
+
+    def _send_at_once(self, cmd, ok, timeout):
+        self._discard_input()
+        if self.demux is not None:
+            self.demux.begin(at_prefixes(cmd))
+        try:
+            return self._send_at(cmd, ok, timeout)
+        finally:
+            if self.demux is not None:
+                self.demux.end()
+
+    def _send_at(self, cmd, ok, timeout):
         line = "%s\r" % cmd
         if self.debug:
             print("[modem:OUT] => [%s]" % line)
         self.serial.write(line)
-        time.sleep(0.1)
+        return self._read_response(cmd, ok, timeout)
+
+    def _read_response(self, cmd, ok, timeout):
         result = ""
         status = None
-        count = 0
+        deadline = time.time() + timeout
         while True:
-            line = self.read_line()
+            if status is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+            else:
+                # Don't wait any longer once a final result code arrives,
+                # but take the lines the modem has already sent with it.
+                remaining = 0
+            line = self.read_line(remaining)
             if line is None:
-                if status is not None or count > 650:
+                if status is not None:
                     break
-                time.sleep(0.1)
-                count = count + 1
+                continue
             elif line == cmd:
                 continue
-            elif line == ok or \
-                    line == "ERROR" or \
-                    line == "NO DIALTONE" or \
-                    line == "NO CARRIER" or \
+            elif line == ok or line in FINAL_RESULT_CODES or \
                     line.startswith("+CME ERROR"):
                 status = line
-            elif line is None:
-                status = "UNKNOWN"
             elif line.strip() != "":
                 result += line + "\n"
         if self.debug:
@@ -437,6 +2381,87 @@ class SockServer(threading.Thread):
                   (cmd, status, result))
         return (status, result.strip())
 
+    def upload_file(self, name, data, timeout=UPLOAD_TIMEOUT):
+        """Uploads the bytes to the file `name` of the module with
+        AT+QFUPL and returns (status, result) as send_at() does. The
+        result is "+QFUPL: <size>,<checksum>" on success. The upload is
+        cut down to the deadline of the request, which the module is told
+        as well so that it doesn't keep waiting for the data.
+        """
+        if self.memo is not None:
+            self.memo.clear()
+        timeout = self._until_deadline(timeout)
+        deadline = time.time() + timeout
+        cmd = 'AT+QFUPL="%s",%d,%d' % (name, len(data),
+                                       max(1, int(math.ceil(timeout))))
+        if self.job is not None:
+            self.job.on_at(cmd)
+        self._discard_input()
+        if self.demux is not None:
+            self.demux.begin(at_prefixes(cmd))
+        try:
+            status, result = self._send_at(cmd, "CONNECT",
+                                           min(AT_TIMEOUT, timeout))
+            if status != "CONNECT":
+                return (status, result)
+            if self.debug:
+                print("[modem:OUT] => [%d bytes]" % len(data))
+            self.serial.write_bytes(data, max(0, deadline - time.time()))
+            return self._read_response(None, "OK",
+                                       max(0, deadline - time.time()))
+        finally:
+            if self.demux is not None:
+                self.demux.end()
+
+    def send_at_compound(self, cmds, timeout=None):
+        """Sends the AT commands in a single command line, e.g.
+        "AT+CSQ;+COPS?", and returns a list of (status, result), one per
+        command. Information responses are split by their prefixes, so
+        only the first command may have a response without a prefix
+        (e.g. ATI or AT+CIMI). Falls back to sending the commands one by
+        one when the module rejects the command line.
+        """
+        if len(cmds) == 1:
+            return [self.send_at(cmds[0], timeout=timeout)]
+        line = cmds[0] + ''.join([';' + c[2:] for c in cmds[1:]])
+        status, result = self.send_at(line, timeout=timeout)
+        if status != "OK":
+            logger.debug("Compound command rejected: [%s] => [%s]" %
+                         (line, status))
+            return [self.send_at(c, timeout=timeout) for c in cmds]
+        prefixes = [(at_prefixes(c) or [None])[0] for c in cmds]
+        responses = [[] for c in cmds]
+        for res in result.split("\n"):
+            if res.strip() == "":
+                continue
+            for i, prefix in enumerate(prefixes):
+                if prefix and res.startswith(prefix + ":"):
+                    responses[i].append(res)
+                    break
+            else:
+                if not any(responses[1:]):
+                    # e.g. the response of ATI, AT+CIMI or AT+GSN
+                    responses[0].append(res)
+                else:
+                    logger.debug("Unexpected line in [%s]: [%s]" %
+                                 (line, res))
+        return [(status, "\n".join(r).strip()) for r in responses]
+
+    def modem_identity(self, refresh=False):
+        """Returns (status, ModemIdentity), probing the modem with ATI
+        only once per serial session.
+        """
+        session = getattr(self.serial, 'session', None)
+        if self.identity is not None and not refresh and \
+                self.identity_session == session:
+            return ("OK", self.identity)
+        status, result = self.send_at("ATI")
+        if status != "OK":
+            return (status, None)
+        self.identity = ModemIdentity.parse(result)
+        self.identity_session = session
+        return (status, self.identity)
+
     def _apn_ls(self):
         status, result = self.send_at("AT+CGDCONT?")
         apn_list = []
@@ -475,9 +2500,11 @@ class SockServer(threading.Thread):
         }
         return message
 
+    @command(cache={'apns': CACHE_FOREVER})
     def apn_ls(self, cmd={}):
         return json.dumps(self._apn_ls())
 
+    @command(invalidates=True)
     def apn_set(self, cmd={}):
         (name, user_id, password) = (cmd['name'], cmd['user_id'],
                                      cmd['password'])
@@ -515,18 +2542,42 @@ class SockServer(threading.Thread):
         }
         return message
 
+    @command(invalidates=True)
     def apn_del(self, cmd={}):
         apn_id = "1"
         if 'id' in cmd:
             apn_id = cmd['id']
         return json.dumps(self._apn_del(apn_id))
 
+    @command(cache={
+        'rssi': 5,
+        'rssiDesc': 5,
+        'network': 10,
+        'operator': 10,
+        'registration': 10,
+        'access': 10,
+        'band': 10,
+    })
     def network_show(self, cmd={}):
         rssi = ""
         network = "UNKNOWN"
         rssi_desc = ""
         operator = "UNKNOWN"
-        status, result = self.send_at("AT+CSQ")
+        registration = {
+            "cs": "N/A",
+            "ps": "N/A",
+            "eps": "N/A"
+        }
+        access = 'N/A'
+        band = 'N/A'
+        _, identity = self.modem_identity()
+        qnwinfo_supported = identity is None or identity.qnwinfo
+        (csq, cops, creg, cgreg, cereg, qnwinfo) = self.send_at_compound([
+            "AT+CSQ", "AT+COPS?", "AT+CREG?", "AT+CGREG?", "AT+CEREG?",
+            "AT+QNWINFO" if qnwinfo_supported else "AT+QGBAND"
+        ])
+        status, result = csq
+        result = result.split("\n")[0]
         if status == "OK":
             rssi_level = int(result[5:].split(",")[0])
             if rssi_level == 0:
@@ -551,39 +2602,41 @@ class SockServer(threading.Thread):
                 rssi_desc = "OR_MORE"
             else:
                 rssi_desc = "NO_SIGANL"
-            status, result = self.send_at("AT+COPS?")
+            status, result = cops
+            result = result.split("\n")[0]
             try:
                 operator = result.split(',')[2][1:-1]
-            except IndexError:
+            except (IndexError, ValueError):
                 operator = "N/A"
-            registration = {
-                "cs": "N/A",
-                "ps": "N/A",
-                "eps": "N/A"
-            }
-            status, result = self.send_at("AT+CREG?")
+            status, result = creg
+            result = result.split("\n")[0]
             try:
                 cs = int(result.split(",")[1])
                 registration["cs"] = CGREG_STATS[cs]
-            except IndexError:
+            except (IndexError, ValueError):
                 pass
-            status, result = self.send_at("AT+CGREG?")
+            status, result = cgreg
+            result = result.split("\n")[0]
             try:
                 ps = int(result.split(",")[1])
                 registration["ps"] = CGREG_STATS[ps]
-            except IndexError:
+            except (IndexError, ValueError):
                 pass
-            status, result = self.send_at("AT+CEREG?")
+            status, result = cereg
+            result = result.split("\n")[0]
             try:
                 eps = int(result.split(",")[1])
                 registration["eps"] = CGREG_STATS[eps]
-            except IndexError:
+            except (IndexError, ValueError):
                 pass
-            access = 'N/A'
-            band = 'N/A'
-            status, result = self.send_at("AT+QNWINFO")
-            if status == 'ERROR':
+            status, result = qnwinfo
+            result = result.split("\n")[0]
+            if qnwinfo_supported and status == 'ERROR':
+                if identity is not None:
+                    identity.qnwinfo = False
+                qnwinfo_supported = False
                 status, result = self.send_at("AT+QGBAND")
+            if not qnwinfo_supported:
                 try:
                     currentband = int(result.split(': ')[1])
                     if currentband == 1:
@@ -604,15 +2657,24 @@ class SockServer(threading.Thread):
                         access, band = 'WCDMA', 'WCDMA 900'
                     elif currentband == 256:
                         access, band = 'WCDMA', 'WCDMA 800'
-                except IndexError:
+                except (IndexError, ValueError):
                     pass
             else:
                 try:
                     nwinfo = result.split(': ')[1].split(',')
                     access = nwinfo[0].replace('"', '')
                     band = nwinfo[2].replace('"', '')
-                except IndexError:
+                except (IndexError, ValueError):
                     pass
+        if status == "OK":
+            self.network_state.update({
+                'cs': registration['cs'],
+                'ps': registration['ps'],
+                'eps': registration['eps'],
+                'access': access,
+                'band': band,
+                'rssiBucket': rssi_bucket(rssi),
+            })
         message = {
             'status': status,
             'result': {
@@ -627,6 +2689,99 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
+    @command(stream='network_state')
+    def network_watch(self, cmd={}):
+        """
+        - Respond with the current network state, then keep the connection
+          open and push an event whenever the registration, access
+          technology, band or RSSI bucket changes
+        - Events are fed by the registration URCs and a network show
+          poller shared by all the watchers
+        - Sending anything to the connection ends the watch
+        """
+        session = getattr(self.serial, 'session', None)
+        if self.demux is not None and \
+                (not self.watch_urcs or self.watch_session != session):
+            self.send_at_compound(
+                ["AT+CREG=1", "AT+CGREG=1", "AT+CEREG=1"])
+            self.watch_urcs = True
+            self.watch_session = session
+        if not self.network_state.state:
+            self.perform({'category': 'network', 'action': 'show',
+                          'fresh': True})
+        message = {
+            'status': 'OK',
+            'result': self.network_state.state
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
+    def network_scan(self, cmd={}):
+        """
+        - Respond with the operators found by the last scan, their status,
+          names, numeric id (the `operator` of network register) and
+          access technology, and when they were scanned
+        - Scan again with network operators in a background job when
+          `refresh` is true or the last scan is older than
+          NETWORK_SCAN_TTL seconds or of another modem session, and
+          respond with the id of the job as well. A job already scanning
+          is shared.
+        """
+        session = getattr(self.serial, 'session', None)
+        scan = self.operator_scan
+        if scan is not None and scan.session != session:
+            scan = None
+        job = None
+        if cmd.get('refresh') or scan is None or \
+                time.time() - scan.timestamp >= NETWORK_SCAN_TTL:
+            with self.scan_lock:
+                job = self.scan_job
+                if job is None or job.done.is_set():
+                    job = self._start_job(
+                        {'category': 'network', 'action': 'operators'})
+                    self.scan_job = job
+        message = {
+            'status': 'OK',
+            'result': {
+                'operators': scan.operators if scan is not None else [],
+                'scanned': track.format_timestamp(scan.timestamp)
+                if scan is not None else None,
+                'age': round(time.time() - scan.timestamp, 3)
+                if scan is not None else None,
+                'job': job.id if job is not None else None
+            }
+        }
+        return json.dumps(message)
+
+    @command(readonly=True)
+    def network_operators(self, cmd={}):
+        """
+        - Scan for the operators with AT+COPS=?, taking up to 3 minutes,
+          and respond with them as network scan does
+        """
+        status, result = self.send_at("AT+COPS=?")
+        if status != "OK":
+            message = {
+                'status': status,
+                'result': result
+            }
+            return json.dumps(message)
+        scan = OperatorScan(time.time(),
+                            getattr(self.serial, 'session', None),
+                            parse_operators(result))
+        self.operator_scan = scan
+        message = {
+            'status': status,
+            'result': {
+                'operators': scan.operators,
+                'scanned': track.format_timestamp(scan.timestamp),
+                'age': 0.0,
+                'job': None
+            }
+        }
+        return json.dumps(message)
+
+    @command(invalidates=True)
     def network_deregister(self, cmd={}):
         status, result = self.send_at("AT+COPS=2")
         message = {
@@ -635,6 +2790,7 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
+    @command(invalidates=True)
     def network_register(self, cmd={}):
         operator = None
         if 'operator' in cmd:
@@ -653,6 +2809,13 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
+    @command(cache={
+        'msisdn': CACHE_FOREVER,
+        'imsi': CACHE_FOREVER,
+        'iccid': CACHE_FOREVER,
+        # the SIM may be removed
+        'state': 5,
+    })
     def sim_show(self, cmd={}):
         state = "SIM_STATE_ABSENT"
         msisdn = ""
@@ -662,16 +2825,27 @@ class SockServer(threading.Thread):
         if status == "OK":
             imsi = result
             state = "SIM_STATE_READY"
-            status, result = self.send_at("AT+CNUM")
-            if len(result) > 5:
-                msisdn = re.sub('"', '', result[6:].split(",")[1])
-            else:
-                msisdn = ""
-            status, result = self.send_at("AT+QCCID")
-            if len(result) > 7:
-                iccid = result.split(':')[1].strip()
+            cached = None
+            if not cmd.get('fresh'):
+                cached = self.cache.fields('sim_show',
+                                           ('imsi', 'msisdn', 'iccid'))
+            # AT+CIMI tells whether the SIM is still the same one
+            if cached is not None and cached['imsi'] == imsi and \
+                    cached['iccid'] != "":
+                msisdn = cached['msisdn']
+                iccid = cached['iccid']
             else:
-                iccid = ""
+                cnum, qccid = self.send_at_compound(["AT+CNUM", "AT+QCCID"])
+                status, result = cnum
+                if len(result) > 5:
+                    msisdn = re.sub('"', '', result[6:].split(",")[1])
+                else:
+                    msisdn = ""
+                status, result = qccid
+                if len(result) > 7:
+                    iccid = result.split(':')[1].strip()
+                else:
+                    iccid = ""
         message = {
             'status': status,
             'result': {
@@ -683,11 +2857,11 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
-    def _counter_show(self):
+    def _counter_show(self, response=None):
         """
         - Show TX/RX packet counter
         """
-        status, result = self.send_at("AT+QGDCNT?")
+        status, result = response or self.send_at("AT+QGDCNT?")
         tx = '0'
         rx = '0'
         if status == "OK":
@@ -714,33 +2888,33 @@ class SockServer(threading.Thread):
         }
         return message
 
-    def _imei_show(self):
+    def _imei_show(self, response=None):
         """
         - Show IMEI
         """
-        status, result = self.send_at("AT+GSN")
+        status, result = response or self.send_at("AT+GSN")
         message = {
             'status': status,
             'result': result
         }
         return message
 
-    def _timestamp_show(self):
+    def _timestamp_show(self, response=None):
         """
         - Show timestamp
         """
-        status, result = self.send_at("AT+CCLK?")
+        status, result = response or self.send_at("AT+CCLK?")
         message = {
             'status': status,
             'result': result
         }
         return message
 
-    def _functionality_show(self):
+    def _functionality_show(self, response=None):
         """
         - Show phone functionality
         """
-        status, result = self.send_at("AT+CFUN?")
+        status, result = response or self.send_at("AT+CFUN?")
         func = "Error"
         if status == "OK":
             func = result.split(':')[1].strip()
@@ -760,8 +2934,13 @@ class SockServer(threading.Thread):
         }
         return message
 
+    @command(cache={
+        'manufacturer': CACHE_FOREVER,
+        'model': CACHE_FOREVER,
+        'revision': CACHE_FOREVER,
+        'imei': CACHE_FOREVER,
+    })
     def modem_show(self, cmd={}):
-        status, result = self.send_at("ATI")
         man = "UNKNOWN"
         mod = "UNKNOWN"
         rev = "UNKNOWN"
@@ -770,18 +2949,29 @@ class SockServer(threading.Thread):
         counter = None
         utc = None
         timezone_hrs = None
+        status, identity = self.modem_identity(refresh=cmd.get('fresh'))
         if status == "OK":
-            info = result.split("\n")
-            man = info[0]
-            mod = info[1]
-            rev = info[2][10:]
-            result = self._imei_show()
-            if result['status'] == "OK":
-                imei = result['result']
-            result = self._counter_show()
+            man = identity.manufacturer
+            mod = identity.model
+            rev = identity.revision
+            queries = ["AT+QGDCNT?", "AT+CCLK?", "AT+CFUN?"]
+            cached = None
+            if not cmd.get('fresh'):
+                cached = self.cache.fields('modem_show', ('imei',))
+            if cached is not None and cached['imei'] != "UNKNOWN":
+                imei = cached['imei']
+            else:
+                queries.insert(0, "AT+GSN")
+            responses = self.send_at_compound(queries)
+            if len(responses) > 3:
+                result = self._imei_show(responses.pop(0))
+                if result['status'] == "OK":
+                    imei = result['result']
+            (qgdcnt, cclk, cfun) = responses
+            result = self._counter_show(qgdcnt)
             if result['status'] == "OK":
                 counter = result['result']
-            result = self._timestamp_show()
+            result = self._timestamp_show(cclk)
             if result['status'] == "OK":
                 datelen = len(result['result'])
                 if datelen == 29:
@@ -790,7 +2980,7 @@ class SockServer(threading.Thread):
                 elif datelen == 26:
                     utc = result['result'][8:-1]
                     timezone_hrs = 0.0
-            result = self._functionality_show()
+            result = self._functionality_show(cfun)
             func = result['result']['functionality']
         message = {
             'status': status,
@@ -823,6 +3013,7 @@ class SockServer(threading.Thread):
                     pass
         return opts
 
+    @command(invalidates=True)
     def modem_reset(self, cmd={}):
         """
         - opts counter=yes
@@ -845,7 +3036,7 @@ class SockServer(threading.Thread):
                 for apn in apns:
                     self._apn_del(apn['apn_id'])
             status, qnvw_result = self.send_at(
-                'AT+QNVW=4548,0,"0000400C00000210"')
+                'AT+QNVW=4548,0,"%s"' % MODEM_INIT_NV_4548)
             if status != "OK":
                 result = qnvw_result
             status, qnvw_result = self.send_at(
@@ -861,6 +3052,7 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
+    @command(invalidates=True)
     def modem_off(self, cmd={}):
         """
         PRIVATE COMMAND (not available from CLI)
@@ -876,6 +3068,7 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
+    @command(invalidates=True)
     def modem_init(self, cmd={}):
         """
         PRIVATE COMMAND (not available from CLI)
@@ -885,33 +3078,69 @@ class SockServer(threading.Thread):
         - Reset Phone Functionality
         - Set baudrate (optional)
         - Reset packet counter (optional)
+        - The current settings are read first and the steps they already
+          match are skipped and listed in `skipped`
         """
         tz_update = "N/A"
         counter_reset_ret = "N/A"
         baudrate_ret = "N/A"
-        if 'tz_update' not in cmd or cmd['tz_update'] is True:
-            status, result = self.send_at("AT+CTZU?")
-            if status == "OK":
-                tz_update = "OK"
-                for at in ["AT+COPS=2", "AT+CTZU=1", "AT+COPS=0"]:
-                    status, result = self.send_at(at)
-                    if status != "OK":
-                        tz_update = "ERROR"
-                        break
+        tz = 'tz_update' not in cmd or cmd['tz_update'] is True
+        pu_unlock = 'pu' not in cmd or cmd['pu'] is False
+        # read the current configuration in one go and skip the writes
+        # that wouldn't change it, above all the network detach of
+        # AT+COPS=2
+        reads = [('nv', "AT+QNVR=4548,0")]
+        if tz:
+            reads[:0] = [('tz_update', "AT+CTZU?"), ('mode', "AT+COPS?")]
+        if pu_unlock:
+            reads.append(('pu', 'AT+CLCK="PU",2'))
+        if 'baudrate' in cmd:
+            reads.append(('baudrate', "AT+IPR?"))
+        current = dict(zip([name for name, at in reads],
+                           [info_value(r) for r in self.send_at_compound(
+                               [at for name, at in reads])]))
+        skipped = []
+        if tz and current['tz_update'] is not None:
+            tz_update = "OK"
+            mode = (current['mode'] or '').split(',')[0]
+            if current['tz_update'] != '1':
+                ats = ["AT+COPS=2", "AT+CTZU=1", "AT+COPS=0"]
+            elif mode != '0':
+                # e.g. deregistered, back to automatic registration
+                ats = ["AT+COPS=0"]
+            else:
+                ats = []
+                skipped.append('tz_update')
+            for at in ats:
+                status, result = self.send_at(at)
+                if status != "OK":
+                    tz_update = "ERROR"
+                    break
         if 'counter_reset' in cmd and cmd['counter_reset']:
             counter_reset_ret = self._counter_reset()['status']
-        status, result_qnvw = self.send_at(
-            'AT+QNVW=4548,0,"0000400C00000210"')
-        if status != "OK":
-            message = {
-                'status': status,
-                'result': result_qnvw,
-                'cmd': 'AT+QNVW'
-            }
-            return json.dumps(message)
-        self._modem_clck_unlock(cmd)
+        if (current['nv'] or '').upper() == MODEM_INIT_NV_4548:
+            skipped.append('nv')
+        else:
+            status, result_qnvw = self.send_at(
+                'AT+QNVW=4548,0,"%s"' % MODEM_INIT_NV_4548)
+            if status != "OK":
+                message = {
+                    'status': status,
+                    'result': result_qnvw,
+                    'cmd': 'AT+QNVW'
+                }
+                return json.dumps(message)
+        if pu_unlock and current['pu'] == '0':
+            skipped.append('pu')
+        else:
+            self._modem_clck_unlock(cmd)
         if 'baudrate' in cmd:
-            baudrate_ret, result = self.send_at("AT+IPR=%s" % cmd['baudrate'])
+            if current['baudrate'] == str(cmd['baudrate']):
+                baudrate_ret = "OK"
+                skipped.append('baudrate')
+            else:
+                baudrate_ret, result = self.send_at(
+                    "AT+IPR=%s" % cmd['baudrate'])
             if baudrate_ret != "OK":
                 message = {
                     'status': baudrate_ret,
@@ -920,10 +3149,11 @@ class SockServer(threading.Thread):
                 }
                 return json.dumps(message)
         message = {
-            'status': status,
+            'status': 'OK',
             'result': {
                 'counter_reset': counter_reset_ret,
-                'baudrate': baudrate_ret
+                'baudrate': baudrate_ret,
+                'skipped': skipped
             }
         }
         return json.dumps(message)
@@ -1023,13 +3253,12 @@ class SockServer(threading.Thread):
             return json.dumps(message)
 
     def _gnss_config(self, cmd={}):
-        status, result = self.send_at("ATI")
+        status, identity = self.modem_identity()
         if status == "OK":
-            info = result.split("\n")
-            if info[1] == 'UC20':
-                return self._gnss_config_uc2x(cmd)
-            else:
+            if identity.gnssconfig:
                 return self._gnss_config_ec2x(cmd)
+            else:
+                return self._gnss_config_uc2x(cmd)
 
     def gnss_start(self, cmd={}):
         status, result = self.send_at('AT+QGPSCFG="gpsnmeatype",31')
@@ -1045,6 +3274,7 @@ class SockServer(threading.Thread):
         message_json = self._gnss_config(cmd)
         if message_json is not None:
             return message_json
+        self._apply_fresh_xtra()
         status, result = self.send_at('AT+QGPSCFG="nmeasrc",1')
         if status != "OK":
             result = status
@@ -1058,8 +3288,11 @@ class SockServer(threading.Thread):
         status, result = self.send_at("AT+QGPS=1,30,50,0,1")
         if status == "OK":
             result = ""
+            self._start_gnss_session(cmd)
         elif status == "+CME ERROR: 504":
             status = "OK"
+            if self.gnss_session is None:
+                self._start_gnss_session(cmd)
         else:
             result = status
             status = "ERROR"
@@ -1069,6 +3302,143 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
+    def _start_gnss_session(self, cmd):
+        self._end_gnss_session()
+        self.gnss_session = GnssSession({
+            'qzss': bool(cmd.get('qzss')),
+            'all': bool(cmd.get('all')),
+            'xtra': self.xtra_injected ==
+            (getattr(self.serial, 'session', None),),
+        })
+        self.update_nmea_reader()
+
+    def _end_gnss_session(self):
+        session = self.gnss_session
+        if session is None:
+            return
+        self.gnss_session = None
+        session.end()
+        self.gnss_sessions.append(session)
+        self.update_nmea_reader()
+
+    def gnss_xtra(self, cmd={}):
+        """
+        - Upload the XTRA file given with `file`, or the one of the
+          server, and inject it with the current time while the GNSS
+          session is stopped
+        - Respond with the validity of the XTRA data in the module, only
+          reporting it when there's no file
+        """
+        path = cmd.get('file') or self.xtra_file
+        if path:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError):
+                return self.error_message("File Not Found")
+            error = self._apply_xtra(data)
+            if error is not None:
+                message = {
+                    'status': 'ERROR',
+                    'result': error[1],
+                    'cmd': error[0]
+                }
+                return json.dumps(message)
+        status, result = self.send_at("AT+QGPSXTRADATA?")
+        if status != "OK":
+            message = {
+                'status': 'ERROR',
+                'result': status
+            }
+            return json.dumps(message)
+        validity = {
+            'valid': False,
+            'duration': 0,
+            'since': None,
+            'until': None
+        }
+        try:
+            duration, since = result.split(':', 1)[1].split(',', 1)
+            validity['duration'] = int(duration)
+            since = calendar.timegm(time.strptime(
+                since.strip().strip('"'), '%Y/%m/%d,%H:%M:%S'))
+        except (IndexError, ValueError):
+            since = None
+        if since is not None and validity['duration'] > 0:
+            until = since + validity['duration'] * 60
+            validity.update({
+                'valid': since <= time.time() < until,
+                'since': track.format_timestamp(since),
+                'until': track.format_timestamp(until),
+            })
+        message = {
+            'status': 'OK',
+            'result': validity
+        }
+        return json.dumps(message)
+
+    def _apply_xtra(self, data):
+        """Uploads and injects the XTRA data. Returns None on success, and
+        (<failed command>, <error>) otherwise.
+        """
+        status, result = self.send_at("AT+QGPSXTRA?")
+        if status == "OK" and result.split(':')[-1].strip() == "0":
+            status, result = self.send_at("AT+QGPSXTRA=1")
+            if status != "OK":
+                return ('QGPSXTRA', status)
+            # XTRA data can't be injected until the module restarts
+            return ('QGPSXTRA', "Restart Required")
+        # the upload fails when the file exists
+        self.send_at('AT+QFDEL="%s"' % XTRA_UFS_FILE)
+        status, result = self.upload_file(XTRA_UFS_FILE, data)
+        if status != "OK":
+            return ('QFUPL', status)
+        try:
+            size, checksum = result.split(':', 1)[1].split(',')
+            uploaded = int(size) == len(data) and \
+                int(checksum, 16) == qfupl_checksum(data)
+        except (IndexError, ValueError):
+            uploaded = False
+        if not uploaded:
+            return ('QFUPL', "Corrupted Upload")
+        status, result = self.send_at(
+            'AT+QGPSXTRATIME=0,"%s",1,1,5' %
+            time.strftime('%Y/%m/%d,%H:%M:%S', time.gmtime()))
+        if status != "OK":
+            return ('QGPSXTRATIME', status)
+        status, result = self.send_at(
+            'AT+QGPSXTRADATA="%s"' % XTRA_UFS_FILE)
+        if status != "OK":
+            return ('QGPSXTRADATA', status)
+        self.send_at('AT+QFDEL="%s"' % XTRA_UFS_FILE)
+        self.xtra_injected = (getattr(self.serial, 'session', None),)
+        return None
+
+    def _apply_fresh_xtra(self):
+        """Applies the XTRA file of the server while it's fresh, once per
+        modem session and file version. GNSS starts anyway on failure.
+        """
+        if not self.xtra_file:
+            return
+        try:
+            mtime = os.path.getmtime(self.xtra_file)
+            if time.time() - mtime > XTRA_MAX_AGE:
+                return
+            applied = (getattr(self.serial, 'session', None),
+                       self.xtra_file, mtime)
+            if self.xtra_applied == applied:
+                return
+            # not retried until the file or the session changes
+            self.xtra_applied = applied
+            with open(self.xtra_file, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return
+        error = self._apply_xtra(data)
+        if error is not None:
+            logger.error("XTRA Error: %s => %s" % error)
+
+    @command(readonly=True)
     def gnss_status(self, cmd={}):
         status, result = self.send_at("AT+QGPS?")
         if status == "OK":
@@ -1088,10 +3458,9 @@ class SockServer(threading.Thread):
             return json.dumps(message)
 
         qzss = 'N/A'
-        status, result = self.send_at("ATI")
+        status, identity = self.modem_identity()
         if status == "OK":
-            info = result.split("\n")
-            if info[1] != 'UC20':
+            if identity.qzss:
                 status, result = self.send_at('AT+QGPSCFG="gnssconfig"')
                 if status != "OK":
                     result = status
@@ -1121,8 +3490,11 @@ class SockServer(threading.Thread):
         status, result = self.send_at("AT+QGPSEND")
         if status == "OK":
             result = ""
+            self.gnss.latest = None
+            self._end_gnss_session()
         elif status == "+CME ERROR: 505":
             status = "OK"
+            self._end_gnss_session()
         else:
             result = status
             status = "ERROR"
@@ -1132,6 +3504,180 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
+    @command(readonly=True)
+    def gnss_nmea(self, cmd={}):
+        """
+        - Respond with the latest NMEA sentences of the types given with
+          `types`, GSA, GGA and RMC by default
+        """
+        types = cmd.get('types') or NMEA_POLL_TYPES
+        responses = self.send_at_compound(
+            ['AT+QGPSGNMEA="%s"' % t for t in types])
+        sentences = []
+        for status, result in responses:
+            if status != "OK":
+                if status == "+CME ERROR: 505":
+                    result = "Session not started"
+                else:
+                    result = status
+                message = {
+                    'status': 'ERROR',
+                    'result': result
+                }
+                return json.dumps(message)
+            for line in result.split("\n"):
+                line = line.split(':', 1)[-1].strip()
+                if line.startswith('$'):
+                    sentences.append(line)
+        message = {
+            'status': 'OK',
+            'result': sentences
+        }
+        return json.dumps(message)
+
+    @command(modem=False, stream='gnss')
+    def gnss_watch(self, cmd={}):
+        """
+        - Respond with the latest fix, or null before the first one, then
+          keep the connection open and push an event with every fix
+        - The fixes are parsed from the NMEA sentences at the native 1 Hz
+          while there are watchers, without a QGPSLOC per fix
+        - Sending anything to the connection ends the watch
+        """
+        message = {
+            'status': 'OK',
+            'result': self.gnss.latest
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
+    def geofence_set(self, cmd={}):
+        """
+        - Add or replace the fence `id`, a circle given with `latitude`,
+          `longitude` and `radius` (meters) or a polygon given with
+          `polygon`, a list of [latitude, longitude]
+        - Geofence watchers are pushed an event whenever a fix enters or
+          exits a fence
+        """
+        try:
+            fence = geofence.Fence(str(cmd['id']), cmd)
+        except (TypeError, ValueError):
+            return self.error_message("Invalid Args")
+        self.geofences.put(fence)
+        message = {
+            'status': 'OK',
+            'result': ''
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
+    def geofence_del(self, cmd={}):
+        if not self.geofences.remove(str(cmd['id'])):
+            return self.error_message("Not Found")
+        message = {
+            'status': 'OK',
+            'result': ''
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
+    def geofence_ls(self, cmd={}):
+        message = {
+            'status': 'OK',
+            'result': self.geofences.specs()
+        }
+        return json.dumps(message)
+
+    @command(modem=False, stream='geofence_feed')
+    def geofence_watch(self, cmd={}):
+        """
+        - Respond with the ids of the fences the last fix is inside of,
+          then keep the connection open and push an event whenever a fix
+          enters or exits a fence
+        - Fixes are read as gnss watch does while there are watchers
+        - Sending anything to the connection ends the watch
+        """
+        message = {
+            'status': 'OK',
+            'result': {
+                'inside': self.geofences.inside_ids()
+            }
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
+    def gnss_metrics(self, cmd={}):
+        """
+        - Respond with the time to first fix and first 3D fix (seconds),
+          the number of 516 (not fixed yet) responses and the satellite
+          count and HDOP trend of the current GNSS session and of the last
+          GNSS_SESSIONS_KEPT ended ones, along with their configuration
+        """
+        session = self.gnss_session
+        message = {
+            'status': 'OK',
+            'result': {
+                'current': session.to_dict() if session is not None
+                else None,
+                'sessions': [s.to_dict() for s in list(self.gnss_sessions)]
+            }
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
+    def gnss_history(self, cmd={}):
+        """
+        - Respond with the fixes kept from `since` to `until`, both
+          optional and inclusive, as fix timestamps or seconds since the
+          epoch, keeping every `decimate`-th fix
+        - The last GNSS_HISTORY_SIZE fixes located or watched are kept
+        """
+        try:
+            since, until = self._history_window(cmd)
+            decimate = int(cmd.get('decimate', 1))
+        except (AttributeError, TypeError, ValueError):
+            return self.error_message("Invalid Args")
+        if decimate < 1:
+            return self.error_message("Invalid Args")
+        message = {
+            'status': 'OK',
+            'result': self.history.fixes(since, until, decimate)
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
+    def gnss_stats(self, cmd={}):
+        """
+        - Respond with the distance (m), the max and average speeds
+          (km/h), the bounding box and the stops of the fixes kept from
+          `since` to `until`, as gnss history takes them
+        - A stop lasts `stopDuration` seconds or more below `stopSpeed`
+          km/h
+        """
+        try:
+            since, until = self._history_window(cmd)
+            stop_speed = float(cmd.get('stopSpeed', track.STOP_SPEED))
+            stop_duration = float(cmd.get('stopDuration',
+                                          track.STOP_MIN_DURATION))
+        except (AttributeError, TypeError, ValueError):
+            return self.error_message("Invalid Args")
+        message = {
+            'status': 'OK',
+            'result': self.history.stats(since, until, stop_speed,
+                                         stop_duration)
+        }
+        return json.dumps(message)
+
+    def _history_window(self, cmd):
+        since = cmd.get('since')
+        if since is not None:
+            since = track.parse_timestamp(since)
+        until = cmd.get('until')
+        if until is not None:
+            until = track.parse_timestamp(until)
+        return since, until
+
+    @command(readonly=True)
     def gnss_locate(self, cmd={}):
         if 'format' in cmd and cmd['format']:
             format = str(cmd['format'])
@@ -1178,6 +3724,8 @@ class SockServer(threading.Thread):
                 'spkn': float(csv[8]),
                 'nsat': int(csv[10])
             }
+            if format == '2':
+                self.put_fix(result)
         else:
             code = status.split(':')
             if len(code) > 1:
@@ -1187,6 +3735,9 @@ class SockServer(threading.Thread):
                 code = code[0]
             if code == "516":
                 result = "Not fixed yet"
+                session = self.gnss_session
+                if session is not None:
+                    session.on_not_fixed()
             elif code == "502":
                 result = "Invalid format"
             elif code == "505":
@@ -1199,6 +3750,109 @@ class SockServer(threading.Thread):
         }
         return json.dumps(message)
 
+    def batch_run(self, cmd={}):
+        """
+        - Perform the commands in `commands` back to back without
+          letting other requests use the modem in between
+        - AT query responses are shared between the commands
+        """
+        commands = cmd['commands']
+        if not isinstance(commands, list):
+            return self.error_message("Invalid Args")
+        messages = []
+        self.memo = {}
+        try:
+            for c in commands:
+                if isinstance(c, dict) and \
+                        (c.get('category'), c.get('action')) == \
+                        ('batch', 'run'):
+                    messages.append(self.error_message("Nested Batch"))
+                    continue
+                messages.append(self.perform(c) or 'null')
+        finally:
+            self.memo = None
+        return '{"status": "OK", "result": [%s]}' % ', '.join(messages)
+
+    @command(modem=False)
+    def job_status(self, cmd={}):
+        """
+        - Respond with the state (running or done), the progress and the
+          result of the job `id` started by a request with "async": true
+        - The last JOB_TABLE_SIZE finished jobs are kept
+        """
+        job = self.jobs.get(cmd['id'])
+        if job is None:
+            return self.error_message("Not Found")
+        return self._job_message(job)
+
+    @command(modem=False, later='_job_wait_later')
+    def job_wait(self, cmd={}):
+        """
+        - Respond as job status does once the job `id` is done, or after
+          `timeout_ms` (JOB_WAIT_TIMEOUT seconds by default) while it's
+          still running
+        """
+        job = self.jobs.get(cmd['id'])
+        if job is None:
+            return self.error_message("Not Found")
+        job.done.wait(self._job_wait_timeout(cmd))
+        return self._job_message(job)
+
+    def _job_wait_later(self, cmd, callback):
+        try:
+            job = self.jobs.get(cmd['id'])
+            timeout = self._job_wait_timeout(cmd)
+        except (KeyError, TypeError, ValueError):
+            callback(self.error_message("Invalid Args"))
+            return
+        if job is None:
+            callback(self.error_message("Not Found"))
+            return
+        lock = threading.Lock()
+        answered = []
+
+        def answer(job):
+            with lock:
+                if answered:
+                    return
+                answered.append(True)
+            timer.cancel()
+            job.remove_done_callback(answer)
+            callback(self._job_message(job))
+        timer = threading.Timer(timeout, answer, (job,))
+        timer.daemon = True
+        timer.start()
+        job.add_done_callback(answer)
+
+    def _job_wait_timeout(self, cmd):
+        return float(cmd.get('timeout_ms', JOB_WAIT_TIMEOUT * 1000)) / 1000
+
+    def _job_message(self, job):
+        message = {
+            'status': 'OK',
+            'result': job.to_dict()
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
+    def service_metrics(self, cmd={}):
+        """
+        - Respond with the number of calls queued for the modem and the
+          time (in seconds) they have waited, per priority
+        - Respond with the current GNSS session as gnss metrics does
+        """
+        session = self.gnss_session
+        message = {
+            'status': 'OK',
+            'result': {
+                'modem': self.modem.metrics() if self.modem is not None
+                else None,
+                'gnss': session.to_dict() if session is not None else None
+            }
+        }
+        return json.dumps(message)
+
+    @command(modem=False)
     def service_version(self, cmd={}):
         message = {
             'status': 'OK',
@@ -1207,3 +3861,7 @@ class SockServer(threading.Thread):
             }
         }
         return json.dumps(message)
+
+
+if sys.version_info >= (3, 5):
+    from candy_board_qws.aio import AsyncSockServer  # noqa: E402,F401
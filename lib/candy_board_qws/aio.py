@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Python 3.5+ only, imported by candy_board_qws when available.
+
+import asyncio
+import json
+import struct
+import sys
+import traceback
+
+from candy_board_qws import (
+    logger,
+    ModemDemux,
+    ModemQueue,
+    SockServer,
+    Watcher,
+    KEEPALIVE_TIMEOUT,
+    READER_TIMEOUT,
+    RECV_TIMEOUT,
+    WATCH_BUFFER_LIMIT,
+)
+
+
+class AsyncSockServer(SockServer):
+    """SockServer serving the clients on an asyncio event loop.
+
+    The clients are handled by coroutines rather than threads. The modem
+    port is registered to the loop with add_reader() and its lines are
+    routed by the same ModemDemux as SockServer. Commands are dispatched
+    by the same perform_later(); the ones talking to the modem are
+    queued to the modem thread while the loop keeps serving the other
+    clients.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncSockServer, self).__init__(*args, **kwargs)
+        self.loop = None
+        self.server = None
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.start_serving())
+        self.loop.run_forever()
+
+    async def start_serving(self):
+        if self.modem is None:
+            self.modem = ModemQueue()
+            self.modem.start()
+        self.attach_serial()
+        self.start_pollers()
+        self.server = await asyncio.start_unix_server(
+            self.handle_client, path=self.sock_path)
+        print("Listening to the socket[%s]...." % self.sock_path)
+
+    def attach_serial(self):
+        if self.serial is None:
+            return
+        if not hasattr(self.serial, 'fileno'):
+            # No file descriptor to watch, e.g. an emulated port
+            self.start_reader()
+            return
+        if self.demux is None:
+            self.demux = ModemDemux(self.urc)
+        try:
+            fd = self.serial.fileno()
+        except OSError:
+            self.loop.call_later(READER_TIMEOUT, self.attach_serial)
+            return
+        self.loop.add_reader(fd, self._on_serial_readable, fd)
+
+    def _on_serial_readable(self, fd):
+        try:
+            lines = self.serial.read_lines()
+        except OSError:
+            logger.error("Modem is disconnected")
+            self.loop.remove_reader(fd)
+            self.loop.call_later(READER_TIMEOUT, self.attach_serial)
+            return
+        for line in lines:
+            self.demux.feed(line)
+
+    async def perform_async(self, cmd, client=None):
+        future = self.loop.create_future()
+
+        def done(message):
+            self.loop.call_soon_threadsafe(future.set_result, message)
+        self.perform_later(cmd, done, client)
+        return await future
+
+    def push_event(self, writer, message):
+        if writer.transport.is_closing():
+            raise IOError("Network watcher is gone")
+        self.loop.call_soon_threadsafe(
+            self._write_event, writer, self.pack_response(message))
+
+    def _write_event(self, writer, frame):
+        if writer.transport.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > WATCH_BUFFER_LIMIT:
+            logger.error("Network watcher can't keep up with the events")
+            writer.transport.abort()
+            return
+        writer.write(frame)
+
+    async def handle_client(self, reader, writer):
+        header_packer = struct.Struct("I")
+        timeout = RECV_TIMEOUT
+        watcher = None
+        try:
+            while True:
+                # request
+                try:
+                    header = await asyncio.wait_for(
+                        reader.readexactly(header_packer.size), timeout)
+                except asyncio.IncompleteReadError as e:
+                    if not e.partial:
+                        break  # closed by the peer
+                    raise
+                except asyncio.TimeoutError:
+                    if timeout == KEEPALIVE_TIMEOUT:
+                        break  # idle kept-alive connection
+                    raise
+                finally:
+                    # anything sent by a watching client ends the watch
+                    if watcher is not None:
+                        watcher.stop()
+                        watcher = None
+                size = header_packer.unpack(header)[0]
+                cmd_json = await asyncio.wait_for(
+                    reader.readexactly(size), RECV_TIMEOUT)
+                logger.debug("Body:[%s]" % cmd_json)
+                cmd = json.loads(cmd_json.decode('utf-8'))
+
+                # response
+                feed = self.stream_feed(cmd)
+                if feed is not None:
+                    # watching before the state is read, no change is missed
+                    watcher = Watcher(
+                        feed, lambda message: self.push_event(writer, message))
+                    feed.watch(watcher)
+                message = await self.perform_async(cmd, id(writer))
+                writer.write(self.pack_response(
+                    self.response_message(cmd, message)))
+                await writer.drain()
+                if watcher is not None:
+                    if self.is_ok(message):
+                        watcher.start(json.loads(message)['result'])
+                        timeout = None
+                        continue
+                    watcher.stop()
+                    watcher = None
+                if cmd.get('keepalive') is not True:
+                    break
+                timeout = KEEPALIVE_TIMEOUT
+
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                ConnectionError):
+            logger.error("Socket Error: %s" %
+                         (''.join(traceback
+                          .format_exception(*sys.exc_info())[-2:])
+                          .strip().replace('\n', ': '))
+                         )
+
+        except Exception:
+            logger.error("Unexpected Error: %s" %
+                         (''.join(traceback
+                          .format_exception(*sys.exc_info())[-2:])
+                          .strip().replace('\n', ': '))
+                         )
+
+        finally:
+            if watcher is not None:
+                watcher.stop()
+            writer.close()
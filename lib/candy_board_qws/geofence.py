@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Circle and polygon geofences looked up through a grid of bounding
+boxes, so that a fix is only tested against the fences around it.
+"""
+
+import math
+import threading
+
+from candy_board_qws.track import EARTH_RADIUS
+
+# Size (in degrees) of the grid cells, about 1 km of latitude
+GRID_CELL = 0.01
+
+# Fences whose bounding box covers more cells than this are tested
+# against every fix instead of being indexed
+MAX_FENCE_CELLS = 1024
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = 111320.0
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Haversine distance in meters"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * \
+        math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class Fence(object):
+    """A circle given with `latitude`, `longitude` and `radius` (meters),
+    or a polygon given with `polygon`, a list of [latitude, longitude]
+    vertices. Raises ValueError when the definition is invalid.
+    """
+
+    def __init__(self, fence_id, spec):
+        self.id = fence_id
+        if 'polygon' in spec:
+            self.polygon = [(float(lat), float(lon))
+                            for lat, lon in spec['polygon']]
+            if len(self.polygon) < 3:
+                raise ValueError("polygon needs 3 vertices or more")
+            lats = [v[0] for v in self.polygon]
+            lons = [v[1] for v in self.polygon]
+            self.box = (min(lats), max(lats), min(lons), max(lons))
+            self.circle = None
+        else:
+            lat = float(spec['latitude'])
+            lon = float(spec['longitude'])
+            radius = float(spec['radius'])
+            if radius <= 0:
+                raise ValueError("radius must be positive")
+            self.circle = (lat, lon, radius)
+            dlat = radius / METERS_PER_DEGREE
+            dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+            self.box = (lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+            self.polygon = None
+
+    def spec(self):
+        if self.circle is not None:
+            return {
+                'latitude': self.circle[0],
+                'longitude': self.circle[1],
+                'radius': self.circle[2],
+            }
+        return {'polygon': [list(v) for v in self.polygon]}
+
+    def contains(self, lat, lon):
+        if not (self.box[0] <= lat <= self.box[1] and
+                self.box[2] <= lon <= self.box[3]):
+            return False
+        if self.circle is not None:
+            return distance(self.circle[0], self.circle[1], lat, lon) <= \
+                self.circle[2]
+        # ray casting
+        inside = False
+        j = len(self.polygon) - 1
+        for i in range(len(self.polygon)):
+            lat_i, lon_i = self.polygon[i]
+            lat_j, lon_j = self.polygon[j]
+            if (lat_i > lat) != (lat_j > lat) and \
+                    lon < (lon_j - lon_i) * (lat - lat_i) / \
+                    (lat_j - lat_i) + lon_i:
+                inside = not inside
+            j = i
+        return inside
+
+
+def _cell(value):
+    return int(math.floor(value / GRID_CELL))
+
+
+class Geofences(object):
+    """Registered fences and the ones the last fix was inside of"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fences = {}
+        # {(<lat cell>, <lon cell>): set(<fence id>)}
+        self.grid = {}
+        # ids of the fences too large for the grid
+        self.large = set()
+        self.inside = set()
+
+    def _cells(self, fence):
+        box = fence.box
+        lats = range(_cell(box[0]), _cell(box[1]) + 1)
+        lons = range(_cell(box[2]), _cell(box[3]) + 1)
+        if len(lats) * len(lons) > MAX_FENCE_CELLS:
+            return None
+        return [(i, j) for i in lats for j in lons]
+
+    def put(self, fence):
+        """Adds or replaces the fence"""
+        with self.lock:
+            self._remove(fence.id)
+            self.fences[fence.id] = fence
+            cells = self._cells(fence)
+            if cells is None:
+                self.large.add(fence.id)
+                return
+            for cell in cells:
+                self.grid.setdefault(cell, set()).add(fence.id)
+
+    def remove(self, fence_id):
+        """Removes the fence. Returns False when there's no such fence."""
+        with self.lock:
+            return self._remove(fence_id)
+
+    def _remove(self, fence_id):
+        fence = self.fences.pop(fence_id, None)
+        if fence is None:
+            return False
+        self.large.discard(fence_id)
+        self.inside.discard(fence_id)
+        for cell in self._cells(fence) or []:
+            ids = self.grid.get(cell)
+            if ids is not None:
+                ids.discard(fence_id)
+                if not ids:
+                    del self.grid[cell]
+        return True
+
+    def specs(self):
+        """Returns the fences as geofence set takes them, sorted by id"""
+        with self.lock:
+            return [dict(self.fences[fence_id].spec(), id=fence_id)
+                    for fence_id in sorted(self.fences)]
+
+    def inside_ids(self):
+        """Ids of the fences the last fix was inside of, sorted"""
+        with self.lock:
+            return sorted(self.inside)
+
+    def candidates(self, lat, lon):
+        """Ids of the fences whose bounding box may contain the point"""
+        return self.grid.get((_cell(lat), _cell(lon)), set()) | self.large
+
+    def update(self, lat, lon):
+        """Moves to the point. Returns the (<fence id>, "enter"|"exit")
+        transitions sorted by fence id.
+        """
+        with self.lock:
+            inside = set([fence_id for fence_id in self.candidates(lat, lon)
+                          if self.fences[fence_id].contains(lat, lon)])
+            transitions = [(fence_id, 'enter')
+                           for fence_id in inside - self.inside] + \
+                [(fence_id, 'exit') for fence_id in self.inside - inside]
+            self.inside = inside
+        return sorted(transitions)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental NMEA 0183 parser turning GGA/RMC/GSA/GSV sentences into
+fixes shaped like the result of gnss locate.
+"""
+
+KNOTS_TO_KMH = 1.852
+
+
+def checksum_ok(sentence):
+    """Whether the "*hh" checksum, if any, matches the sentence"""
+    body, sep, checksum = sentence.partition('*')
+    if not sep:
+        return True
+    value = 0
+    for c in body[1:]:
+        value ^= ord(c)
+    try:
+        return value == int(checksum[:2], 16)
+    except ValueError:
+        return False
+
+
+def split(sentence):
+    """Returns the fields of a valid sentence, e.g. ['GGA', ...] for
+    "$GPGGA,...", or None.
+    """
+    sentence = sentence.strip()
+    if not sentence.startswith('$') or not checksum_ok(sentence):
+        return None
+    fields = sentence.partition('*')[0].split(',')
+    if len(fields[0]) < 6:
+        return None
+    return [fields[0][3:]] + fields[1:]
+
+
+def _degrees(value, hemisphere):
+    """Converts "ddmm.mmmm" and "N"/"S"/"E"/"W" to decimal degrees"""
+    point = value.index('.') if '.' in value else len(value)
+    degrees = float(value[:point - 2]) + float(value[point - 2:]) / 60
+    if hemisphere in ('S', 'W'):
+        degrees = -degrees
+    return round(degrees, 6)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def fixes(lines):
+    """Generator taking an iterable of NMEA sentences and yielding a fix
+    as soon as both the GGA and the RMC sentences of a position epoch
+    have arrived. GSA and GSV sentences add the fix type and the number
+    of satellites in view. Malformed sentences are skipped.
+    """
+    gga = None
+    rmc = None
+    fix_type = None
+    in_view = {}
+    emitted = None
+    for line in lines:
+        fields = split(line)
+        if fields is None:
+            continue
+        kind = fields[0]
+        try:
+            if kind == 'GGA' and len(fields) > 9:
+                gga = fields
+            elif kind == 'RMC' and len(fields) > 9:
+                rmc = fields
+            elif kind == 'GSA' and len(fields) > 2:
+                fix_type = int(fields[2]) if fields[2] else None
+                continue
+            elif kind == 'GSV' and len(fields) > 3:
+                in_view[line[1:3]] = int(fields[3])
+                continue
+            else:
+                continue
+        except ValueError:
+            continue
+        if gga is None or rmc is None or gga[1] != rmc[1] or \
+                gga[1] == emitted:
+            continue
+        if gga[6] in ('', '0') or rmc[2] != 'A':
+            continue
+        try:
+            fix = {
+                'timestamp': '20%s-%s-%sT%s:%s:%s.000Z' % (
+                    rmc[9][4:6], rmc[9][2:4], rmc[9][0:2],
+                    rmc[1][0:2], rmc[1][2:4], rmc[1][4:6]
+                ),
+                'latitude': _degrees(gga[2], gga[3]),
+                'longitude': _degrees(gga[4], gga[5]),
+                'hdop': _float(gga[8]),
+                'altitude': _float(gga[9]),
+                'fix': '%dD' % fix_type if fix_type in (2, 3) else None,
+                'cog': _float(rmc[8]),
+                'spkm': None,
+                'spkn': _float(rmc[7]),
+                'nsat': int(gga[7]) if gga[7] else None,
+            }
+        except (ValueError, IndexError):
+            continue
+        if fix['spkn'] is not None:
+            fix['spkm'] = round(fix['spkn'] * KNOTS_TO_KMH, 2)
+        if in_view:
+            fix['nsatView'] = sum(in_view.values())
+        emitted = gga[1]
+        yield fix
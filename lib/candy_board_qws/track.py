@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""GNSS fix history kept in preallocated column arrays, and the track
+statistics computed over it, vectorized with NumPy when it's installed.
+"""
+
+import array
+import calendar
+import math
+import threading
+import time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Mean radius of the Earth in meters
+EARTH_RADIUS = 6371008.8
+
+# Speed (in km/h) below which the device is considered stopped
+STOP_SPEED = 3.0
+
+# Seconds the device has to stay stopped for a stop to be reported
+STOP_MIN_DURATION = 60
+
+# (<column>, <fix field>) stored for every fix, missing values as NaN
+COLUMNS = (
+    ('lat', 'latitude'),
+    ('lon', 'longitude'),
+    ('alt', 'altitude'),
+    ('hdop', 'hdop'),
+    ('cog', 'cog'),
+    ('speed', 'spkm'),
+    ('nsat', 'nsat'),
+)
+
+
+def parse_timestamp(value):
+    """Converts a fix timestamp, e.g. "2018-05-21T07:12:17.000Z", or a
+    number of seconds since the epoch to seconds since the epoch.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds, _, fraction = value.rstrip('Z').partition('.')
+    t = calendar.timegm(time.strptime(seconds, TIMESTAMP_FORMAT))
+    if fraction:
+        t += float('0.' + fraction)
+    return float(t)
+
+
+def format_timestamp(t):
+    return '%s.%03dZ' % (time.strftime(TIMESTAMP_FORMAT, time.gmtime(t)),
+                         int(round((t % 1) * 1000)) % 1000)
+
+
+def _number(value):
+    if value is None:
+        return float('nan')
+    return float(value)
+
+
+def _value(value):
+    return None if math.isnan(value) else value
+
+
+def _track_python(t, lat, lon, speed, stop_speed):
+    """Returns (<distance>, <max speed>, <bounding box>, <stop runs>) of
+    the fixes given as lists, the stop runs as (<first>, <last>) index
+    pairs of the fixes slower than `stop_speed`.
+    """
+    distance = 0.0
+    for i in range(1, len(t)):
+        phi1 = math.radians(lat[i - 1])
+        phi2 = math.radians(lat[i])
+        a = math.sin((phi2 - phi1) / 2) ** 2 + \
+            math.cos(phi1) * math.cos(phi2) * \
+            math.sin(math.radians(lon[i] - lon[i - 1]) / 2) ** 2
+        distance += 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+    speeds = [v for v in speed if not math.isnan(v)]
+    box = (min(lat), max(lat), min(lon), max(lon))
+    runs = []
+    first = None
+    for i, v in enumerate(speed):
+        if v < stop_speed:
+            if first is None:
+                first = i
+        elif first is not None:
+            runs.append((first, i - 1))
+            first = None
+    if first is not None:
+        runs.append((first, len(speed) - 1))
+    return distance, max(speeds) if speeds else None, box, runs
+
+
+def _track_numpy(t, lat, lon, speed, stop_speed):
+    """NumPy version of _track_python() taking arrays"""
+    phi = numpy.radians(lat)
+    a = numpy.sin(numpy.diff(phi) / 2) ** 2 + \
+        numpy.cos(phi[:-1]) * numpy.cos(phi[1:]) * \
+        numpy.sin(numpy.radians(numpy.diff(lon)) / 2) ** 2
+    distance = float(numpy.sum(
+        2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))))
+    known = speed[~numpy.isnan(speed)]
+    box = (float(lat.min()), float(lat.max()),
+           float(lon.min()), float(lon.max()))
+    with numpy.errstate(invalid='ignore'):
+        stopped = (speed < stop_speed).astype(numpy.int8)
+    edges = numpy.diff(numpy.concatenate(([0], stopped, [0])))
+    runs = list(zip(numpy.flatnonzero(edges == 1).tolist(),
+                    (numpy.flatnonzero(edges == -1) - 1).tolist()))
+    return distance, float(known.max()) if len(known) else None, box, runs
+
+
+class FixHistory(object):
+    """Ring buffer of the last `size` fixes in chronological order. A fix
+    not newer than the last one, e.g. the same fix located again, is
+    ignored.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.t = array.array('d', [0.0] * size)
+        self.columns = dict([(column, array.array('d', [0.0] * size))
+                             for column, _ in COLUMNS])
+        # physical index of the oldest fix
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _index(self, i):
+        return (self.start + i) % self.size
+
+    def append(self, fix):
+        """Stores the fix. Returns False when it isn't newer than the
+        last one or has no position.
+        """
+        try:
+            t = parse_timestamp(fix['timestamp'])
+            values = [(column, _number(fix.get(field)))
+                      for column, field in COLUMNS]
+        except (KeyError, TypeError, ValueError):
+            return False
+        if math.isnan(values[0][1]) or math.isnan(values[1][1]):
+            return False
+        with self.lock:
+            if self.count and t <= self.t[self._index(self.count - 1)]:
+                return False
+            if self.count < self.size:
+                i = self._index(self.count)
+                self.count += 1
+            else:
+                i = self.start
+                self.start = (self.start + 1) % self.size
+            self.t[i] = t
+            for column, value in values:
+                self.columns[column][i] = value
+        return True
+
+    def _bisect(self, t, after=False):
+        """Returns the logical index of the first fix at or, when `after`
+        is True, after `t`
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.t[self._index(mid)]
+            if value < t or (after and value == t):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _window(self, since, until):
+        """Returns the physical indices of the fixes from `since` to
+        `until` (inclusive, seconds since the epoch) in chronological
+        order. The lock must be held.
+        """
+        first = 0 if since is None else self._bisect(since)
+        last = self.count if until is None else self._bisect(until, True)
+        return [self._index(i) for i in range(first, last)]
+
+    def fixes(self, since=None, until=None, decimate=1):
+        """Returns the fixes from `since` to `until`, keeping every
+        `decimate`-th one, shaped like the result of gnss locate.
+        """
+        fixes = []
+        with self.lock:
+            for i in self._window(since, until)[::decimate]:
+                fix = {
+                    'timestamp': format_timestamp(self.t[i]),
+                }
+                for column, field in COLUMNS:
+                    fix[field] = _value(self.columns[column][i])
+                if fix['nsat'] is not None:
+                    fix['nsat'] = int(fix['nsat'])
+                fixes.append(fix)
+        return fixes
+
+    def _columns(self, since, until):
+        """Returns the timestamps, latitudes, longitudes and speeds of the
+        fixes from `since` to `until`, as arrays with NumPy and as lists
+        otherwise.
+        """
+        with self.lock:
+            window = self._window(since, until)
+            columns = (self.t, self.columns['lat'], self.columns['lon'],
+                       self.columns['speed'])
+            if numpy is not None:
+                index = numpy.array(window, dtype=numpy.intp)
+                return [numpy.frombuffer(c, dtype=numpy.float64)[index]
+                        for c in columns]
+            return [[c[i] for i in window] for c in columns]
+
+    def stats(self, since=None, until=None, stop_speed=STOP_SPEED,
+              stop_duration=STOP_MIN_DURATION):
+        """Returns the statistics of the track from `since` to `until`:
+        the distance in meters, the max and average speeds in km/h, the
+        bounding box and the stops, i.e. the periods of at least
+        `stop_duration` seconds slower than `stop_speed`.
+        """
+        t, lat, lon, speed = self._columns(since, until)
+        result = {
+            'count': len(t),
+            'since': None,
+            'until': None,
+            'duration': 0.0,
+            'distance': 0.0,
+            'maxSpeed': None,
+            'avgSpeed': None,
+            'boundingBox': None,
+            'stops': [],
+        }
+        if not len(t):
+            return result
+        track = _track_numpy if numpy is not None else _track_python
+        distance, max_speed, box, runs = track(t, lat, lon, speed,
+                                               stop_speed)
+        duration = float(t[-1] - t[0])
+        result.update({
+            'since': format_timestamp(t[0]),
+            'until': format_timestamp(t[-1]),
+            'duration': duration,
+            'distance': round(distance, 1),
+            'maxSpeed': max_speed,
+            'avgSpeed': round(distance / duration * 3.6, 2)
+            if duration > 0 else None,
+            'boundingBox': {
+                'minLatitude': box[0],
+                'maxLatitude': box[1],
+                'minLongitude': box[2],
+                'maxLongitude': box[3],
+            },
+        })
+        for first, last in runs:
+            if t[last] - t[first] < stop_duration:
+                continue
+            count = last - first + 1
+            result['stops'].append({
+                'since': format_timestamp(t[first]),
+                'until': format_timestamp(t[last]),
+                'duration': float(t[last] - t[first]),
+                'latitude': round(float(sum(lat[first:last + 1])) / count,
+                                  6),
+                'longitude': round(float(sum(lon[first:last + 1])) / count,
+                                   6),
+            })
+        return result
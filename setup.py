@@ -80,6 +80,10 @@ setup(
         'CANDY Pi Lite',
         'CANDY Pi Lite+'
         ),
+    extras_require={
+        # vectorized gnss stats
+        'numpy': ['numpy'],
+    },
     tests_require=['pytest-cov>=2.2.0',
                    'pytest>=2.6.4',
                    'terminaltables>=1.2.1'],
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import path_hack
+import candy_board_qws
+from emulator_serialport import SerialPortEmurator
+from sock_client import request, start_server
+import pytest
+import os
+import select
+import threading
+import time
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(candy_board_qws, 'AsyncSockServer'),
+    reason="asyncio is not available")
+
+
+class PtyModem(threading.Thread):
+    """Answers AT commands written to a pseudo terminal"""
+
+    def __init__(self, master, responses):
+        super(PtyModem, self).__init__()
+        self.daemon = True
+        self.master = master
+        self.responses = responses
+        self.stopped = threading.Event()
+
+    def stop(self):
+        """Stops reading so that the master can be closed"""
+        self.stopped.set()
+        self.join()
+
+    def run(self):
+        buf = b''
+        while not self.stopped.is_set():
+            try:
+                if not select.select([self.master], [], [], 0.1)[0]:
+                    continue
+                buf += os.read(self.master, 1024)
+            except (OSError, select.error):
+                break
+            while b'\r' in buf:
+                cmd, buf = buf.split(b'\r', 1)
+                res = self.responses.get(cmd.decode(), "OK")
+                os.write(self.master, (res + "\n").encode())
+
+
+@pytest.fixture(scope='function')
+def setup_emulator_server(request):
+    return start_server(request, candy_board_qws.AsyncSockServer,
+                        SerialPortEmurator())
+
+
+PTY_RESPONSES = {
+    'AT+CGDCONT?': '+CGDCONT: 1,"IP","apn.example.com","0.0.0.0",0,0'
+                   '\nOK',
+    'AT$QCPDPP?': '$QCPDPP: 1,0\nOK',
+}
+
+
+@pytest.fixture(scope='function')
+def setup_pty_server(request):
+    master, slave = os.openpty()
+    PtyModem(master, PTY_RESPONSES).start()
+    serialport = candy_board_qws.SerialPort(os.ttyname(slave), 115200)
+    return start_server(request, candy_board_qws.AsyncSockServer, serialport)
+
+
+@pytest.fixture(scope='function')
+def setup_lazy_pty_server(request):
+    master, slave = os.openpty()
+    modem = PtyModem(master, PTY_RESPONSES)
+    modem.start()
+    serialport = candy_board_qws.LazySerialPort(os.ttyname(slave), 115200)
+    server = start_server(request, candy_board_qws.AsyncSockServer,
+                          serialport)
+    # (<master>, <slave>) of the port and the PtyModem answering on it,
+    # replaced when the module restarts
+    server.pty = (master, slave)
+    server.pty_modem = modem
+
+    def teardown():
+        server.pty_modem.stop()
+        serialport.close()
+        for fd in server.pty:
+            os.close(fd)
+    request.addfinalizer(teardown)
+    return server
+
+
+def test_service_version(setup_emulator_server):
+    act = request(setup_emulator_server.sock_path,
+                  {'category': 'service', 'action': 'version'})
+    assert act == {'status': 'OK', 'result': {'version': 'devel'}}
+
+
+def test_unknown_command(setup_emulator_server):
+    act = request(setup_emulator_server.sock_path,
+                  {'category': 'no-such-category', 'action': 'show'})
+    assert act == {'status': 'ERROR', 'result': 'Unknown Command'}
+
+
+def test_network_show(setup_emulator_server):
+    act = request(setup_emulator_server.sock_path,
+                  {'category': 'network', 'action': 'show'})
+    assert act['status'] == 'OK'
+    assert act['result']['rssi'] == '-105'
+    assert act['result']['operator'] == 'NTT DOCOMO'
+
+
+def test_concurrent_clients(setup_emulator_server):
+    results = []
+
+    def client():
+        for i in range(5):
+            results.append(request(setup_emulator_server.sock_path,
+                                   {'category': 'sim', 'action': 'show'}))
+    threads = [threading.Thread(target=client) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 100
+    for act in results:
+        assert act['result']['imsi'] == '440111111111111'
+
+
+def test_apn_ls_with_loop_reader(setup_pty_server):
+    server = setup_pty_server
+    act = request(server.sock_path, {'category': 'apn', 'action': 'ls'})
+    assert server.reader is None
+    assert act['status'] == 'OK'
+    assert act['result']['apns'][0]['apn'] == 'apn.example.com'
+    assert act['result']['apns'][0]['user'] == ''
+
+
+
+def test_lazy_serial_port_reattached(setup_lazy_pty_server):
+    server = setup_lazy_pty_server
+    serialport = server.seralport
+    act = request(server.sock_path, {'category': 'apn', 'action': 'ls'})
+    assert act['status'] == 'OK'
+    assert serialport.session == 1
+    # the module restarts as another port
+    server.pty_modem.stop()
+    os.close(server.pty[0])
+    os.close(server.pty[1])
+    server.pty = os.openpty()
+    server.pty_modem = PtyModem(server.pty[0], PTY_RESPONSES)
+    server.pty_modem.start()
+    serialport.serialport = os.ttyname(server.pty[1])
+    for i in range(50):
+        if serialport.session == 2:
+            break
+        time.sleep(0.1)
+    assert serialport.session == 2
+    act = request(server.sock_path, {'category': 'apn', 'action': 'ls'})
+    assert act['result']['apns'][0]['apn'] == 'apn.example.com'
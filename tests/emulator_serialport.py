@@ -16,8 +16,25 @@
 # limitations under the License.
 
 
+import threading
+import time
+
+
 class SerialPortEmurator:
-    def __init__(self):
+    def __init__(self, latency=0):
+        # Time (in seconds) the emulated modem takes to start responding
+        self.latency = latency
+        self.cmd = None
+        self.line = -1
+        self.urcs = []
+        self.cond = threading.Condition()
+        # Whether to accept commands concatenated with ';'
+        self.compound = True
+        self.writes = []
+        # {<UFS file name>: <bytes>} uploaded with AT+QFUPL
+        self.files = {}
+        # [<file name>, <size>, <bytes received>] while uploading
+        self.upload = None
         self.org_res = {
             'AT+COPS?': [
                 "AT+COPS?",
@@ -46,6 +63,49 @@ class SerialPortEmurator:
                 "OK",
                 ""
             ],
+            'AT+COPS=?': [
+                "AT+COPS=?",
+                "",
+                "",
+                "+COPS: (2,\"NTT DOCOMO\",\"DOCOMO\",\"44010\",7),"
+                "(1,\"SoftBank\",\"SoftBank\",\"44020\",7),"
+                "(3,\"KDDI\",\"KDDI\",\"44051\",7),,"
+                "(0,1,2,3,4),(0,1,2)",
+                "",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+IPR?': [
+                "AT+IPR?",
+                "",
+                "",
+                "+IPR: 115200",
+                "",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+QNVR=': [
+                "AT+QNVR=",
+                "",
+                "",
+                "+QNVR: \"0000000000000000\"",
+                "",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+CLCK="PU",2': [
+                "AT+CLCK=\"PU\",2",
+                "",
+                "",
+                "+CLCK: 1",
+                "",
+                "",
+                "OK",
+                ""
+            ],
             'AT+COPS=': [
                 "AT+COPS=",
                 "",
@@ -243,6 +303,17 @@ class SerialPortEmurator:
                 "OK",
                 ""
             ],
+            'AT+QCCID': [
+                "AT+QCCID",
+                "",
+                "",
+                "+QCCID: 89811000000000000000",
+                "",
+                "",
+                "",
+                "OK",
+                ""
+            ],
             'AT+CPAS': [
                 "AT+CPAS",
                 "",
@@ -324,6 +395,70 @@ class SerialPortEmurator:
                 "OK",
                 ""
             ],
+            'AT+QGPSGNMEA="GGA"': [
+                'AT+QGPSGNMEA="GGA"',
+                "",
+                "",
+                "+QGPSGNMEA: $GPGGA,071217.0,3540.869600,N,13945.891600,E,1,09,0.7,50.4,M,39.0,M,,*64",
+                "",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+QGPSGNMEA="RMC"': [
+                'AT+QGPSGNMEA="RMC"',
+                "",
+                "",
+                "+QGPSGNMEA: $GPRMC,071217.0,A,3540.869600,N,13945.891600,E,0.0,0.0,210518,,,A*6C",
+                "",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+QGPSGNMEA="GSA"': [
+                'AT+QGPSGNMEA="GSA"',
+                "",
+                "",
+                "+QGPSGNMEA: $GPGSA,A,3,02,05,12,13,15,18,20,25,29,,,,1.2,0.7,1.0*32",
+                "",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+QGPSXTRA?': [
+                "AT+QGPSXTRA?",
+                "",
+                "+QGPSXTRA: 1",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+QGPSXTRA=': [
+                "AT+QGPSXTRA=",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+QGPSXTRATIME=': [
+                "AT+QGPSXTRATIME=",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+QGPSXTRADATA=': [
+                "AT+QGPSXTRADATA=",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+QGPSXTRADATA?': [
+                "AT+QGPSXTRADATA?",
+                "",
+                "+QGPSXTRADATA: 10080,\"2018/05/21,00:00:00\"",
+                "",
+                "OK",
+                ""
+            ],
             'AT+QGPSEND': [
                 "AT+QGPSEND",
                 "",
@@ -342,6 +477,24 @@ class SerialPortEmurator:
                 "OK",
                 ""
             ],
+            'AT+CREG=': [
+                "AT+CREG=",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+CGREG=': [
+                "AT+CGREG=",
+                "",
+                "OK",
+                ""
+            ],
+            'AT+CEREG=': [
+                "AT+CEREG=",
+                "",
+                "OK",
+                ""
+            ],
         }
         self.reset_res()
 
@@ -351,22 +504,96 @@ class SerialPortEmurator:
     def available(self):
         return True
 
-    def read_line(self):
-        if self.line < 0:
-            return None
-        try:
-            text = self.res[self.cmd][self.line]
-            self.line += 1
-            return text
-        except Exception:
-            self.line = -1
-            return None
+    def push_urc(self, line):
+        with self.cond:
+            self.urcs.append(line)
+            self.cond.notify_all()
+
+    def read_line(self, timeout=None):
+        with self.cond:
+            if not self.urcs and self.line >= 0:
+                if self.cmd not in self.res or \
+                        self.line >= len(self.res[self.cmd]):
+                    self.line = -1
+            if not self.urcs and self.line < 0 and timeout:
+                self.cond.wait(timeout)
+            if self.urcs:
+                return self.urcs.pop(0)
+            if self.line < 0:
+                return None
+        if self.line == 0 and self.latency > 0:
+            time.sleep(self.latency)
+        with self.cond:
+            try:
+                text = self.res[self.cmd][self.line]
+                self.line += 1
+                return text
+            except Exception:
+                self.line = -1
+                return None
+
+    def lookup(self, cmd):
+        if cmd not in self.res:
+            if cmd.find('=') >= 0:
+                cmd = cmd[:cmd.find('=') + 1]
+        return cmd
+
+    def compound_res(self, cmd):
+        if not self.compound:
+            return [cmd, "", "", "ERROR", ""]
+        parts = cmd.split(';')
+        res = [cmd]
+        for part in [parts[0]] + ['AT' + p for p in parts[1:]]:
+            for text in self.res[self.lookup(part)][1:]:
+                if text == "OK":
+                    break
+                res.append(text)
+                if text == "ERROR" or text.startswith("+CME ERROR"):
+                    return res + [""]
+        return res + ["OK", ""]
+
+    def file_res(self, cmd):
+        """Models AT+QFUPL, which answers CONNECT and then takes the
+        bytes of the file, and AT+QFDEL
+        """
+        name = cmd[cmd.find('"') + 1:cmd.rfind('"')]
+        if cmd.startswith('AT+QFDEL='):
+            if self.files.pop(name, None) is None:
+                return [cmd, "", "+CME ERROR: 405", ""]
+            return [cmd, "", "OK", ""]
+        if name in self.files:
+            return [cmd, "", "+CME ERROR: 407", ""]
+        self.upload = [name, int(cmd.split(',')[1]), bytearray()]
+        return [cmd, "", "CONNECT", ""]
+
+    def write_bytes(self, data, timeout=None):
+        with self.cond:
+            name, size, received = self.upload
+            received.extend(data)
+            if len(received) < size:
+                return
+            self.upload = None
+            self.files[name] = bytes(received)
+            words = received + bytearray(len(received) % 2)
+            checksum = 0
+            for i in range(0, len(words), 2):
+                checksum ^= (words[i] << 8) | words[i + 1]
+            self.cmd = '<upload>'
+            self.res[self.cmd] = ["", "+QFUPL: %d,%x" % (size, checksum),
+                                  "", "OK", ""]
+            self.line = 0
+            self.cond.notify_all()
 
     def write(self, str):
         print("[SerialportEmulator:write]:[%s]\n" % str)
-        self.cmd = str.strip()
-        if self.cmd not in self.res:
-            if self.cmd.find('=') >= 0:
-                self.cmd = self.cmd[:self.cmd.find('=') + 1]
-        self.line = 0
-        self.res[self.cmd][0] = str.strip()
+        with self.cond:
+            self.writes.append(str.strip())
+            self.cmd = str.strip()
+            if ';' in self.cmd:
+                self.res[self.cmd] = self.compound_res(self.cmd)
+            elif self.cmd.startswith(('AT+QFUPL=', 'AT+QFDEL=')):
+                self.res[self.cmd] = self.file_res(self.cmd)
+            self.cmd = self.lookup(self.cmd)
+            self.line = 0
+            self.res[self.cmd][0] = str.strip()
+            self.cond.notify_all()
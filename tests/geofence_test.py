@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import path_hack
+from candy_board_qws import geofence
+import pytest
+
+TOKYO = (35.68116, 139.76486)
+
+
+def test_circle():
+    fence = geofence.Fence('station', {
+        'latitude': TOKYO[0], 'longitude': TOKYO[1], 'radius': 100})
+    assert fence.contains(*TOKYO)
+    # about 89 m north
+    assert fence.contains(TOKYO[0] + 0.0008, TOKYO[1])
+    # about 111 m north
+    assert not fence.contains(TOKYO[0] + 0.001, TOKYO[1])
+    with pytest.raises(ValueError):
+        geofence.Fence('bad', {'latitude': 0, 'longitude': 0, 'radius': 0})
+
+
+def test_polygon():
+    # a concave "L" shape
+    fence = geofence.Fence('l', {'polygon': [
+        [0, 0], [0, 2], [1, 2], [1, 1], [2, 1], [2, 0]]})
+    assert fence.contains(0.5, 0.5)
+    assert fence.contains(0.5, 1.5)
+    assert fence.contains(1.5, 0.5)
+    assert not fence.contains(1.5, 1.5)
+    assert not fence.contains(-0.5, 0.5)
+    with pytest.raises(ValueError):
+        geofence.Fence('line', {'polygon': [[0, 0], [1, 1]]})
+
+
+def test_transitions():
+    fences = geofence.Geofences()
+    fences.put(geofence.Fence('a', {
+        'latitude': TOKYO[0], 'longitude': TOKYO[1], 'radius': 100}))
+    fences.put(geofence.Fence('b', {
+        'latitude': TOKYO[0], 'longitude': TOKYO[1], 'radius': 1000}))
+    assert fences.update(TOKYO[0] + 0.1, TOKYO[1]) == []
+    assert fences.update(TOKYO[0] + 0.005, TOKYO[1]) == [('b', 'enter')]
+    assert fences.update(*TOKYO) == [('a', 'enter')]
+    assert fences.update(*TOKYO) == []
+    assert fences.inside_ids() == ['a', 'b']
+    assert fences.update(TOKYO[0] + 0.1, TOKYO[1]) == [
+        ('a', 'exit'), ('b', 'exit')]
+
+
+def test_index():
+    fences = geofence.Geofences()
+    for i in range(1000):
+        fences.put(geofence.Fence(str(i), {
+            'latitude': i * 0.1, 'longitude': 0, 'radius': 100}))
+    # a whole hemisphere, too large for the grid
+    fences.put(geofence.Fence('north', {
+        'polygon': [[0, -180], [90, -180], [90, 180], [0, 180]]}))
+    assert fences.candidates(50.0, 0) == set(['500', 'north'])
+    assert fences.update(50.0, 0) == [('500', 'enter'), ('north', 'enter')]
+    fences.put(geofence.Fence('500', {
+        'latitude': 10, 'longitude': 10, 'radius': 100}))
+    assert fences.candidates(50.0, 0) == set(['north'])
+    assert fences.remove('north')
+    assert not fences.remove('north')
+    assert fences.update(50.0, 0) == []
+    assert fences.grid and fences.large == set()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import path_hack
+from candy_board_qws import nmea
+
+GGA = "$GPGGA,071217.0,3540.869600,N,13945.891600,E,1,09,0.7,50.4,M," \
+      "39.0,M,,*64"
+RMC = "$GPRMC,071217.0,A,3540.869600,N,13945.891600,E,0.0,0.0,210518,,," \
+      "A*6C"
+GSA = "$GPGSA,A,3,02,05,12,13,15,18,20,25,29,,,,1.2,0.7,1.0*32"
+GSV = "$GPGSV,3,1,11,02,45,120,40,05,30,200,38,12,60,300,42,13,20,050," \
+      "35*73"
+
+
+def test_checksum():
+    assert nmea.checksum_ok(GGA)
+    assert not nmea.checksum_ok(GGA[:-2] + '00')
+    assert nmea.split(GGA[:-2] + '00') is None
+    assert nmea.split("+QGPSGNMEA: ") is None
+    assert nmea.split(RMC)[:3] == ['RMC', '071217.0', 'A']
+
+
+def test_fixes():
+    act = list(nmea.fixes([GSV, GSA, GGA, RMC]))
+    assert act == [{
+        'timestamp': '2018-05-21T07:12:17.000Z',
+        'latitude': 35.68116,
+        'longitude': 139.76486,
+        'hdop': 0.7,
+        'altitude': 50.4,
+        'fix': '3D',
+        'cog': 0.0,
+        'spkm': 0.0,
+        'spkn': 0.0,
+        'nsat': 9,
+        'nsatView': 11,
+    }]
+
+
+def test_fixes_once_per_epoch():
+    assert len(list(nmea.fixes([GGA, RMC, GGA, RMC, GSA]))) == 1
+
+
+def test_fixes_incremental():
+    def lines():
+        yield GGA
+        yield RMC
+        raise AssertionError("read beyond the fix")
+    assert next(nmea.fixes(lines()))['nsat'] == 9
+
+
+def resum(sentence):
+    body = sentence.partition('*')[0]
+    value = 0
+    for c in body[1:]:
+        value ^= ord(c)
+    return '%s*%02X' % (body, value)
+
+
+def test_fixes_not_fixed():
+    void_rmc = resum(RMC.replace(',A,', ',V,'))
+    assert nmea.checksum_ok(void_rmc)
+    assert list(nmea.fixes([GGA, void_rmc])) == []
+    no_fix_gga = resum(GGA.replace(',E,1,', ',E,0,'))
+    assert list(nmea.fixes([no_fix_gga, RMC])) == []
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-request latency of SockServer commands against the emulator.
+
+Usage:
+    $ python tests/send_at_benchmark.py [rounds] [modem latency in ms]
+
+Run it from the top directory of the repository.
+
+The `legacy` rows replay the former fixed-sleep send_at() so that the
+numbers before and after can be compared in a single run.
+"""
+
+import path_hack
+import candy_board_qws
+from emulator_serialport import SerialPortEmurator
+import sys
+import time
+
+COMMANDS = [
+    ('service', 'version'),
+    ('apn', 'ls'),
+    ('sim', 'show'),
+    ('modem', 'show'),
+    ('network', 'show'),
+]
+
+
+class LegacySockServer(candy_board_qws.SockServer):
+    def send_at(self, cmd, ok="OK", timeout=None):
+        self.serial.write("%s\r" % cmd)
+        time.sleep(0.1)
+        result = ""
+        status = None
+        count = 0
+        while True:
+            line = self.serial.read_line()
+            if line is None:
+                if status is not None or count > 650:
+                    break
+                time.sleep(0.1)
+                count = count + 1
+            elif line == cmd:
+                continue
+            elif line == ok or line in candy_board_qws.FINAL_RESULT_CODES \
+                    or line.startswith("+CME ERROR"):
+                status = line
+            elif line.strip() != "":
+                result += line + "\n"
+        return (status, result.strip())
+
+
+def measure(server_class, category, action, rounds, latency):
+    server = server_class('bench', '/dev/null', SerialPortEmurator(latency))
+    start = time.time()
+    for i in range(rounds):
+        # measure the modem round trips rather than the response cache
+        server.cache.clear()
+        server.perform({'category': category, 'action': action,
+                        'fresh': True})
+    return (time.time() - start) * 1000.0 / rounds
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005
+    print("%-16s %12s %12s" % ('command', 'legacy[ms]', 'current[ms]'))
+    for category, action in COMMANDS:
+        legacy = measure(LegacySockServer, category, action, rounds,
+                         latency)
+        current = measure(candy_board_qws.SockServer, category, action,
+                          rounds, latency)
+        print("%-16s %12.1f %12.1f" %
+              ("%s %s" % (category, action), legacy, current))
+
+
+if __name__ == '__main__':
+    main()
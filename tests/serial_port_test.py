@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import path_hack
+import candy_board_qws
+import pytest
+import os
+import threading
+import time
+
+
+@pytest.fixture(scope='function')
+def setup_pty(request):
+    master, slave = os.openpty()
+    serialport = candy_board_qws.SerialPort(os.ttyname(slave), 115200)
+
+    def teardown():
+        serialport.close()
+        os.close(slave)
+        os.close(master)
+    request.addfinalizer(teardown)
+    # discard the ping sent by the constructor
+    os.read(master, 1024)
+    return master, serialport
+
+
+def test_read_line(setup_pty):
+    master, serialport = setup_pty
+    os.write(master, b"+CSQ: 4,99\n\nOK\n")
+    assert serialport.read_line() == "+CSQ: 4,99"
+    assert serialport.read_line() == ""
+    assert serialport.read_line() == "OK"
+    assert serialport.read_line() is None
+
+
+def test_read_line_partial(setup_pty):
+    master, serialport = setup_pty
+    os.write(master, b"+COPS: 0,0,")
+    assert serialport.read_line() is None
+    os.write(master, b"\"NTT DOCOMO\",4\n")
+    assert serialport.read_line() == "+COPS: 0,0,\"NTT DOCOMO\",4"
+
+
+def test_read_line_multibyte(setup_pty):
+    master, serialport = setup_pty
+    text = u"+COPS: 0,0,\"ドコモ\",4\n".encode('utf-8')
+    os.write(master, text[:14])
+    assert serialport.read_line() is None
+    os.write(master, text[14:])
+    assert serialport.read_line() == u"+COPS: 0,0,\"ドコモ\",4"
+
+
+def test_read_line_invalid_bytes(setup_pty):
+    master, serialport = setup_pty
+    os.write(master, b"\xff\xfeOK\n")
+    assert serialport.read_line() == u"\ufffd\ufffdOK"
+
+
+def test_read_line_blocks_until_ready(setup_pty):
+    master, serialport = setup_pty
+    timer = threading.Timer(0.2, os.write, (master, b"OK\n"))
+    timer.start()
+    start = time.time()
+    assert serialport.read_line(timeout=5) == "OK"
+    elapsed = time.time() - start
+    timer.join()
+    assert 0.15 < elapsed < 1
+
+
+def test_read_line_timeout(setup_pty):
+    master, serialport = setup_pty
+    start = time.time()
+    assert serialport.read_line(timeout=0.3) is None
+    assert time.time() - start >= 0.3
+
+
+def test_write_bytes(setup_pty):
+    master, serialport = setup_pty
+    # larger than the pty buffer, written as the peer reads
+    data = bytes(bytearray(range(256))) * 256
+    received = []
+
+    def read():
+        size = 0
+        while size < len(data):
+            chunk = os.read(master, 4096)
+            received.append(chunk)
+            size += len(chunk)
+    reader = threading.Thread(target=read)
+    reader.start()
+    serialport.write_bytes(data, timeout=5)
+    reader.join(5)
+    assert b''.join(received) == data
+
+
+def test_lazy_serial_port_reopened_after_disconnect():
+    master, slave = os.openpty()
+    port = candy_board_qws.LazySerialPort(os.ttyname(slave), 115200)
+    urc = candy_board_qws.UrcRegistry()
+    urcs = []
+    received = threading.Event()
+    urc.subscribe("RDY", lambda line: (urcs.append(line), received.set()))
+    demux = candy_board_qws.ModemDemux(urc)
+    reader = candy_board_qws.ModemReader(port, demux)
+    assert port.available()
+    assert port.session == 1
+    os.read(master, 1024)
+    reader.start()
+    try:
+        # the module restarts as another port
+        os.close(master)
+        os.close(slave)
+        master, slave = os.openpty()
+        port.serialport = os.ttyname(slave)
+        for i in range(50):
+            if port.session == 2:
+                break
+            time.sleep(0.1)
+        assert port.session == 2
+        os.write(master, b"RDY\n")
+        assert received.wait(5)
+        assert urcs == ["RDY"]
+    finally:
+        reader.stop()
+        reader.join()
+        port.close()
+        os.close(slave)
+        os.close(master)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import time
+
+header_packer = struct.Struct("I")
+
+# Time (in seconds) to wait for a response before failing the test
+RESPONSE_TIMEOUT = 10
+
+
+def recv_exactly(sock, size):
+    if sock.gettimeout() is None:
+        sock.settimeout(RESPONSE_TIMEOUT)
+    buf = b''
+    while len(buf) < size:
+        data = sock.recv(size - len(buf))
+        assert data
+        buf += data
+    return buf
+
+
+def send_request(sock, cmd):
+    body = json.dumps(cmd).encode('utf-8')
+    sock.sendall(header_packer.pack(len(body)) + body)
+
+
+def recv_response(sock):
+    size = header_packer.unpack(recv_exactly(sock, header_packer.size))
+    return json.loads(recv_exactly(sock, size[0]).decode('utf-8'))
+
+
+def connect(sock_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(sock_path)
+    return sock
+
+
+def request(sock_path, cmd):
+    sock = connect(sock_path)
+    try:
+        send_request(sock, cmd)
+        return recv_response(sock)
+    finally:
+        sock.close()
+
+
+def start_server(request, server_class, serialport):
+    """Starts the server on a temporary socket path"""
+    tmpdir = tempfile.mkdtemp()
+    sock_path = os.path.join(tmpdir, 'candy-board-service.sock')
+    server = server_class('devel', sock_path, serialport)
+    server.daemon = True
+    server.seralport = serialport
+    server.start()
+    while not os.path.exists(sock_path):
+        time.sleep(0.01)
+    request.addfinalizer(lambda: shutil.rmtree(tmpdir))
+    return server
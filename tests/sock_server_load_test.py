@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import path_hack
+import candy_board_qws
+from emulator_serialport import SerialPortEmurator
+from sock_client import connect, recv_response, request, send_request, \
+    start_server
+import pytest
+import threading
+import time
+
+
+@pytest.fixture(scope='function')
+def setup_running_server(request):
+    return start_server(request, candy_board_qws.SockServer,
+                        SerialPortEmurator(latency=0.005))
+
+
+def run_clients(sock_path, cmds, clients):
+    """Sends the commands from the clients, all of them connected before
+    the first request is sent
+    """
+    results = []
+    errors = []
+    connected = threading.Semaphore(0)
+    go = threading.Event()
+
+    def client():
+        try:
+            sock = connect(sock_path)
+        except Exception as e:
+            errors.append(e)
+            return
+        finally:
+            connected.release()
+        go.wait()
+        try:
+            send_request(sock, cmds[0])
+            results.append((cmds[0], recv_response(sock)))
+        except Exception as e:
+            errors.append(e)
+            return
+        finally:
+            sock.close()
+        try:
+            for cmd in cmds[1:]:
+                results.append((cmd, request(sock_path, cmd)))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=client) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        connected.acquire()
+    go.set()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_concurrent_clients(setup_running_server):
+    server = setup_running_server
+    cmds = [
+        {'category': 'network', 'action': 'show'},
+        {'category': 'service', 'action': 'version'},
+        {'category': 'sim', 'action': 'show'},
+        {'category': 'modem', 'action': 'show'},
+    ]
+    results, errors = run_clients(server.sock_path, cmds, 32)
+    assert errors == []
+    assert len(results) == 32 * len(cmds)
+    for cmd, act in results:
+        assert act['status'] == 'OK'
+        if cmd['category'] == 'network':
+            assert act['result']['rssi'] == '-105'
+            assert act['result']['band'] == 'LTE BAND 1'
+        elif cmd['category'] == 'sim':
+            assert act['result']['imsi'] == '440111111111111'
+        elif cmd['category'] == 'modem':
+            assert act['result']['imei'] == '999999999999999'
+
+
+def test_modem_free_command_not_blocked(setup_running_server):
+    server = setup_running_server
+    server.seralport.latency = 0.5
+    slow = threading.Thread(target=request, args=(
+        server.sock_path, {'category': 'modem', 'action': 'show'}))
+    slow.start()
+    time.sleep(0.1)
+    start = time.time()
+    act = request(server.sock_path, {'category': 'service',
+                                     'action': 'version'})
+    elapsed = time.time() - start
+    slow.join()
+    assert act['result']['version'] == 'devel'
+    assert elapsed < 0.4
+
+
+def test_identical_requests_coalesced(setup_running_server):
+    server = setup_running_server
+    server.seralport.latency = 0.2
+    cmd = {'category': 'network', 'action': 'show', 'fresh': True}
+    results, errors = run_clients(server.sock_path, [cmd],
+                                  candy_board_qws.WORKER_THREADS)
+    assert errors == []
+    assert len(results) == candy_board_qws.WORKER_THREADS
+    for _, act in results:
+        assert act == results[0][1]
+        assert act['result']['operator'] == 'NTT DOCOMO'
+    compound = 'AT+CSQ;+COPS?;+CREG?;+CGREG?;+CEREG?;+QNWINFO'
+    assert server.seralport.writes.count(compound) == 1
+
+
+def test_identical_requests_with_deadlines_coalesced(setup_running_server):
+    server = setup_running_server
+    server.seralport.latency = 0.2
+    cmd = {'category': 'network', 'action': 'show', 'fresh': True,
+           'timeout_ms': 5000}
+    results, errors = run_clients(server.sock_path, [cmd],
+                                  candy_board_qws.WORKER_THREADS)
+    assert errors == []
+    for _, act in results:
+        assert act['result']['operator'] == 'NTT DOCOMO'
+    compound = 'AT+CSQ;+COPS?;+CREG?;+CGREG?;+CEREG?;+QNWINFO'
+    assert server.seralport.writes.count(compound) == 1
+
+
+def test_modem_free_command_with_saturated_workers(setup_running_server):
+    server = setup_running_server
+    server.seralport.latency = 0.1
+    cmd = {'category': 'network', 'action': 'deregister'}
+    clients = [threading.Thread(target=request, args=(server.sock_path, cmd))
+               for i in range(candy_board_qws.WORKER_THREADS * 2)]
+    for c in clients:
+        c.start()
+    # clients connecting without sending anything
+    idle = [connect(server.sock_path)
+            for i in range(candy_board_qws.WORKER_THREADS)]
+    time.sleep(0.1)
+    start = time.time()
+    act = request(server.sock_path, {'category': 'service',
+                                     'action': 'version'})
+    elapsed = time.time() - start
+    for c in clients:
+        c.join()
+    for sock in idle:
+        sock.close()
+    assert act['result']['version'] == 'devel'
+    assert elapsed < 0.3
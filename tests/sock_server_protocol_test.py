@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import path_hack
+import candy_board_qws
+from emulator_serialport import SerialPortEmurator
+from sock_client import (
+    connect, recv_response, request, send_request, start_server
+)
+import pytest
+import time
+
+SERVER_CLASSES = [candy_board_qws.SockServer]
+if hasattr(candy_board_qws, 'AsyncSockServer'):
+    SERVER_CLASSES.append(candy_board_qws.AsyncSockServer)
+
+
+@pytest.fixture(scope='function', params=SERVER_CLASSES)
+def setup_running_server(request):
+    return start_server(request, request.param, SerialPortEmurator())
+
+
+def test_one_shot(setup_running_server):
+    act = request(setup_running_server.sock_path,
+                  {'category': 'service', 'action': 'version', 'id': 1})
+    assert act == {'id': 1, 'status': 'OK', 'result': {'version': 'devel'}}
+
+
+def test_keepalive(setup_running_server):
+    sock = connect(setup_running_server.sock_path)
+    try:
+        for i in range(3):
+            send_request(sock, {'category': 'network', 'action': 'show',
+                                'keepalive': True, 'id': 'req-%d' % i})
+            act = recv_response(sock)
+            assert act['id'] == 'req-%d' % i
+            assert act['result']['operator'] == 'NTT DOCOMO'
+        send_request(sock, {'category': 'service', 'action': 'version'})
+        act = recv_response(sock)
+        assert act == {'status': 'OK', 'result': {'version': 'devel'}}
+        # closed as the last request didn't ask to keep alive
+        assert sock.recv(1) == b''
+    finally:
+        sock.close()
+
+
+def test_pipelined(setup_running_server):
+    sock = connect(setup_running_server.sock_path)
+    try:
+        cmds = [
+            {'category': 'sim', 'action': 'show'},
+            {'category': 'service', 'action': 'version'},
+            {'category': 'modem', 'action': 'show'},
+            {'category': 'no-such-category', 'action': 'show'},
+        ]
+        for i, cmd in enumerate(cmds):
+            cmd.update({'keepalive': True, 'id': i})
+            send_request(sock, cmd)
+        responses = [recv_response(sock) for cmd in cmds]
+        assert [act['id'] for act in responses] == [0, 1, 2, 3]
+        assert responses[0]['result']['imsi'] == '440111111111111'
+        assert responses[1]['result']['version'] == 'devel'
+        assert responses[2]['result']['imei'] == '999999999999999'
+        assert responses[3]['result'] == 'Unknown Command'
+    finally:
+        sock.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_network_watch(setup_running_server):
+    server = setup_running_server
+    sock = connect(server.sock_path)
+    try:
+        send_request(sock, {'category': 'network', 'action': 'watch',
+                            'id': 'watch'})
+        act = recv_response(sock)
+        assert act['id'] == 'watch'
+        assert act['status'] == 'OK'
+        assert act['result']['eps'] == 'Registered'
+        assert act['result']['band'] == 'LTE BAND 1'
+        assert act['result']['rssiBucket'] == 1
+        assert 'AT+CREG=1;+CGREG=1;+CEREG=1' in server.seralport.writes
+        # polled below instead, the background poll would race the URCs
+        server.watch_poller.stop()
+        server.watch_poller.join()
+
+        server.seralport.push_urc('+CEREG: 2')
+        act = recv_response(sock)
+        assert act['event'] == 'network'
+        assert act['changed'] == ['eps']
+        assert act['result']['eps'] == 'Searching'
+        # unchanged state isn't pushed again
+        server.seralport.push_urc('+CEREG: 2')
+
+        server.seralport.res['AT+CSQ'] = ["AT+CSQ", "", "+CSQ: 25,99",
+                                          "", "OK", ""]
+        server.seralport.push_urc('+CEREG: 1')
+        server.watch_poller.poll()
+        act = recv_response(sock)
+        assert act['changed'] == ['eps']
+        act = recv_response(sock)
+        assert act['changed'] == ['rssiBucket']
+        assert act['result']['rssiBucket'] == 4
+    finally:
+        sock.close()
+    wait_for(lambda: not server.network_state.watchers)
+    assert server.watch_poller is None
+    assert server.network_poll_interval is None
+
+
+def test_network_watch_ended_by_request(setup_running_server):
+    server = setup_running_server
+    sock = connect(server.sock_path)
+    try:
+        send_request(sock, {'category': 'network', 'action': 'watch'})
+        assert recv_response(sock)['status'] == 'OK'
+        wait_for(lambda: server.network_state.watchers)
+        send_request(sock, {'category': 'service', 'action': 'version'})
+        act = recv_response(sock)
+        assert act == {'status': 'OK', 'result': {'version': 'devel'}}
+        assert sock.recv(1) == b''
+        assert server.network_state.watchers == []
+    finally:
+        sock.close()
+
+
+def test_gnss_watch(setup_running_server):
+    server = setup_running_server
+    sock = connect(server.sock_path)
+    try:
+        send_request(sock, {'category': 'gnss', 'action': 'watch'})
+        act = recv_response(sock)
+        assert act['status'] == 'OK'
+        fix = act['result']
+        if fix is None:
+            act = recv_response(sock)
+            assert act['event'] == 'gnss'
+            fix = act['result']
+        assert fix['timestamp'] == '2018-05-21T07:12:17.000Z'
+        assert fix['nsat'] == 9
+        assert all(not w.startswith('AT+QGPSLOC')
+                   for w in server.seralport.writes)
+    finally:
+        sock.close()
+    wait_for(lambda: not server.gnss.watchers)
+    assert server.nmea_reader is None
+
+
+def test_async_job(setup_running_server):
+    server = setup_running_server
+    # keeps the job running for a while
+    server.seralport.latency = 0.5
+    act = request(server.sock_path, {'category': 'gnss', 'action': 'xtra',
+                                     'async': True})
+    job_id = act['result']['job']
+    act = request(server.sock_path, {'category': 'job', 'action': 'wait',
+                                     'id': job_id, 'timeout_ms': 50})
+    assert act['result']['state'] == 'running'
+    assert act['result']['progress'] == {'steps': 1,
+                                         'at': 'AT+QGPSXTRADATA?'}
+    act = request(server.sock_path, {'category': 'job', 'action': 'wait',
+                                     'id': job_id})
+    assert act['result']['state'] == 'done'
+    assert act['result']['result']['status'] == 'OK'
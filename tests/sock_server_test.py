@@ -20,6 +20,9 @@ import candy_board_qws
 from emulator_serialport import SerialPortEmurator
 import pytest
 import json
+import os
+import threading
+import time
 
 
 @pytest.fixture(scope='function')
@@ -34,6 +37,14 @@ def setup_sock_server(request):
     return server
 
 
+@pytest.fixture(scope='function')
+def setup_urc_reader(request, setup_sock_server):
+    server = setup_sock_server
+    server.start_reader()
+    request.addfinalizer(server.stop_reader)
+    return server
+
+
 def test_perform_nok(setup_sock_server):
     ret = setup_sock_server.perform(
         {'category': 'no-such-category', 'action': 'no-such-action'})
@@ -245,6 +256,126 @@ def test_network_show_denied_in_cs_networks(setup_sock_server):
     assert act['result']['rssiDesc'] == ''
 
 
+def test_network_show_compound(setup_sock_server):
+    server = setup_sock_server
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    act = json.loads(ret)
+    assert act['status'] == 'OK'
+    assert act['result']['band'] == 'LTE BAND 1'
+    assert act['result']['operator'] == 'NTT DOCOMO'
+    assert server.seralport.writes == [
+        'ATI', 'AT+CSQ;+COPS?;+CREG?;+CGREG?;+CEREG?;+QNWINFO']
+
+
+def test_network_show_compound_rejected(setup_sock_server):
+    server = setup_sock_server
+    server.seralport.compound = False
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    act = json.loads(ret)
+    assert act['status'] == 'OK'
+    assert act['result']['access'] == 'FDD LTE'
+    assert act['result']['band'] == 'LTE BAND 1'
+    assert act['result']['registration']['eps'] == 'Registered'
+    assert act['result']['operator'] == 'NTT DOCOMO'
+    assert act['result']['rssi'] == '-105'
+    assert server.seralport.writes == [
+        'ATI', 'AT+CSQ;+COPS?;+CREG?;+CGREG?;+CEREG?;+QNWINFO',
+        'AT+CSQ', 'AT+COPS?', 'AT+CREG?', 'AT+CGREG?', 'AT+CEREG?',
+        'AT+QNWINFO']
+
+
+def test_network_show_compound_stray_line(setup_sock_server):
+    server = setup_sock_server
+    server.seralport.res['AT+CEREG?'] = [
+        "AT+CEREG?",
+        "",
+        "+CEREG: 0,1",
+        "",
+        "+CEREG: 0,1",
+        "NO PREFIX",
+        "",
+        "OK",
+        ""
+    ]
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    act = json.loads(ret)
+    assert act['status'] == 'OK'
+    assert act['result']['registration']['eps'] == 'Registered'
+    assert act['result']['band'] == 'LTE BAND 1'
+
+
+def test_network_show_with_urc_reader(setup_urc_reader):
+    server = setup_urc_reader
+    received = []
+    server.urc.subscribe('+QIND:', received.append)
+    server.seralport.res['AT+CSQ'] = [
+        "AT+CSQ",
+        "",
+        "",
+        "+CSQ: 4,99",
+        "",
+        "+QIND: \"csq\",4,99",
+        "",
+        "OK",
+        ""
+    ]
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    act = json.loads(ret)
+    assert act['status'] == 'OK'
+    assert act['result']['rssi'] == '-105'
+    assert act['result']['registration']['cs'] == 'Registered'
+    assert received == ['+QIND: "csq",4,99']
+
+
+def test_registration_urc_during_query(setup_urc_reader):
+    server = setup_urc_reader
+    received = []
+    server.urc.subscribe('+CEREG:', received.append)
+    server.seralport.res['AT+CGREG?'] = [
+        "AT+CGREG?",
+        "",
+        "+CEREG: 2",
+        "",
+        "+CGREG: 0,1",
+        "",
+        "+CREG: 1,\"1A2B\",\"01234567\",7",
+        "",
+        "OK",
+        ""
+    ]
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    act = json.loads(ret)
+    assert act['status'] == 'OK'
+    assert act['result']['registration']['cs'] == 'Registered'
+    assert act['result']['registration']['ps'] == 'Registered'
+    assert act['result']['registration']['eps'] == 'Registered'
+    assert received == ['+CEREG: 2']
+    assert server.urc.last('+CREG') == '+CREG: 1,"1A2B","01234567",7'
+
+
+def test_urc_reader_publish(setup_urc_reader):
+    server = setup_urc_reader
+    received = []
+    arrived = threading.Event()
+
+    def on_creg(line):
+        received.append(line)
+        arrived.set()
+    server.urc.subscribe('+CREG:', on_creg)
+    server.seralport.push_urc('+CTZV: "+36"')
+    server.seralport.push_urc('+CREG: 5')
+    assert arrived.wait(5)
+    assert received == ['+CREG: 5']
+    assert server.urc.last('+CREG') == '+CREG: 5'
+    assert server.urc.last('+CTZV') == '+CTZV: "+36"'
+    server.urc.unsubscribe('+CREG:', on_creg)
+    server.seralport.push_urc('+CREG: 1')
+    ret = server.perform({'category': 'apn', 'action': 'ls'})
+    assert json.loads(ret)['status'] == 'OK'
+    assert server.urc.last('+CREG') == '+CREG: 1'
+    assert received == ['+CREG: 5']
+
+
 def test_network_deregister(setup_sock_server):
     server = setup_sock_server
     server.seralport.res['AT+COPS='] = [
@@ -322,6 +453,7 @@ def test_sim_show(setup_sock_server):
     assert act['result']['state'] == 'SIM_STATE_READY'
     assert act['result']['imsi'] == '440111111111111'
     assert act['result']['iccid'] == '00000000000000000000'
+    assert server.seralport.writes == ['AT+CIMI', 'AT+CNUM;+QCCID']
 
 
 def test_modem_show(setup_sock_server):
@@ -337,6 +469,8 @@ def test_modem_show(setup_sock_server):
     assert act['result']['model'] == 'MOD'
     assert act['result']['manufacturer'] == 'MAN'
     assert act['result']['revision'] == 'REV'
+    assert setup_sock_server.seralport.writes == [
+        'ATI', 'AT+GSN;+QGDCNT?;+CCLK?;+CFUN?']
 
 
 def test_modem_show_anomaly(setup_sock_server):
@@ -505,7 +639,8 @@ def test_modem_init(setup_sock_server):
          'counter_reset': True
          })
     assert ret == '{"status": "OK", ' \
-                  '"result": {"counter_reset": "OK", "baudrate": "OK"}}'
+                  '"result": {"counter_reset": "OK", "baudrate": "OK", ' \
+                  '"skipped": ["baudrate"]}}'
 
 
 def test_modem_init_pu_true(setup_sock_server):
@@ -517,7 +652,51 @@ def test_modem_init_pu_true(setup_sock_server):
          'pu': True
          })
     assert ret == '{"status": "OK", ' \
-                  '"result": {"counter_reset": "OK", "baudrate": "OK"}}'
+                  '"result": {"counter_reset": "OK", "baudrate": "OK", ' \
+                  '"skipped": ["baudrate"]}}'
+
+
+def test_modem_init_skips_current_settings(setup_sock_server):
+    server = setup_sock_server
+    server.seralport.res['AT+CTZU?'] = [
+        "AT+CTZU?", "", "", "+CTZU: 1", "", "", "OK", ""]
+    server.seralport.res['AT+QNVR='] = [
+        "AT+QNVR=", "", "", "+QNVR: \"0000400c00000210\"", "", "", "OK", ""]
+    server.seralport.res['AT+CLCK="PU",2'] = [
+        "AT+CLCK=\"PU\",2", "", "", "+CLCK: 0", "", "", "OK", ""]
+    server.seralport.writes = []
+    act = json.loads(server.perform(
+        {'category': 'modem', 'action': 'init', 'baudrate': 115200}))
+    assert act == {
+        'status': 'OK',
+        'result': {
+            'counter_reset': 'N/A',
+            'baudrate': 'OK',
+            'skipped': ['tz_update', 'nv', 'pu', 'baudrate']
+        }
+    }
+    assert server.seralport.writes == [
+        'AT+CTZU?;+COPS?;+QNVR=4548,0;+CLCK="PU",2;+IPR?']
+
+    # deregistered, e.g. by network deregister
+    server.seralport.res['AT+COPS?'] = [
+        "AT+COPS?", "", "", "+COPS: 2", "", "", "OK", ""]
+    server.seralport.writes = []
+    act = json.loads(server.perform(
+        {'category': 'modem', 'action': 'init', 'baudrate': 115200}))
+    assert act['result']['skipped'] == ['nv', 'pu', 'baudrate']
+    assert server.seralport.writes[1:] == ['AT+COPS=0']
+    server.seralport.res['AT+COPS?'] = server.seralport.org_res['AT+COPS?']
+
+    server.seralport.res['AT+CLCK='] = ["AT+CLCK=", "", "", "OK", ""]
+    server.seralport.res['AT+CTZU?'] = [
+        "AT+CTZU?", "", "", "+CTZU: 0", "", "", "OK", ""]
+    server.seralport.writes = []
+    act = json.loads(server.perform(
+        {'category': 'modem', 'action': 'init', 'baudrate': 9600}))
+    assert act['result']['skipped'] == ['nv', 'pu']
+    assert server.seralport.writes[1:] == [
+        'AT+COPS=2', 'AT+CTZU=1', 'AT+COPS=0', 'AT+IPR=9600']
 
 
 def test_modem_init_qnvw_failure(setup_sock_server):
@@ -719,6 +898,477 @@ def test_gnss_locate_ok(setup_sock_server):
     assert act['result']['timestamp'] == '2018-05-21T07:12:17.000Z'
 
 
+def test_gnss_xtra(setup_sock_server, tmpdir):
+    server = setup_sock_server
+    xtra = tmpdir.join('xtra2.bin')
+    xtra.write_binary(b'\x01\x02\x03\x04\x05' * 1001)
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'xtra', 'file': str(xtra)}))
+    assert act == {
+        'status': 'OK',
+        'result': {
+            'valid': False,
+            'duration': 10080,
+            'since': '2018-05-21T00:00:00.000Z',
+            'until': '2018-05-28T00:00:00.000Z'
+        }
+    }
+    writes = server.seralport.writes
+    assert 'AT+QFUPL="UFS:xtra2.bin",5005,60' in writes
+    assert writes.index('AT+QGPSXTRADATA="UFS:xtra2.bin"') > \
+        [w[:16] for w in writes].index('AT+QGPSXTRATIME=')
+    # deleted once injected
+    assert server.seralport.files == {}
+
+
+def test_gnss_xtra_upload_error(setup_sock_server, tmpdir):
+    server = setup_sock_server
+    xtra = tmpdir.join('xtra2.bin')
+    xtra.write_binary(b'XTRA')
+    server.seralport.file_res = lambda cmd: [cmd, "", "+CME ERROR: 421", ""]
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'xtra', 'file': str(xtra)}))
+    assert act == {'status': 'ERROR', 'result': '+CME ERROR: 421',
+                   'cmd': 'QFUPL'}
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'xtra',
+         'file': str(tmpdir.join('none'))}))
+    assert act == {'status': 'ERROR', 'result': 'File Not Found'}
+
+
+def test_gnss_xtra_restart_required(setup_sock_server, tmpdir):
+    server = setup_sock_server
+    xtra = tmpdir.join('xtra2.bin')
+    xtra.write_binary(b'XTRA')
+    server.seralport.res['AT+QGPSXTRA?'] = [
+        "AT+QGPSXTRA?", "", "+QGPSXTRA: 0", "", "OK", ""]
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'xtra', 'file': str(xtra)}))
+    assert act == {'status': 'ERROR', 'result': 'Restart Required',
+                   'cmd': 'QGPSXTRA'}
+    assert server.seralport.writes == ['AT+QGPSXTRA?', 'AT+QGPSXTRA=1']
+
+
+def test_upload_file_deadline(setup_sock_server):
+    server = setup_sock_server
+    server.job = candy_board_qws.Job({'category': 'gnss', 'action': 'xtra'})
+    server.deadline = time.time() + 10
+    assert server.upload_file('UFS:test.bin', b'data') == ('OK',
+                                                          '+QFUPL: 4,1000')
+    # the module gives up on the data at the deadline as well
+    assert server.job.at == 'AT+QFUPL="UFS:test.bin",4,10'
+    server.deadline = time.time()
+    with pytest.raises(candy_board_qws.DeadlineExceeded):
+        server.upload_file('UFS:test.bin', b'data')
+
+
+def test_gnss_xtra_validity(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform({'category': 'gnss', 'action': 'xtra'}))
+    assert act['result']['duration'] == 10080
+    assert not any(w.startswith('AT+QFUPL') for w in server.seralport.writes)
+    server.seralport.res['AT+QGPSXTRADATA?'] = [
+        "AT+QGPSXTRADATA?", "", "+QGPSXTRADATA: 0,\"1980/01/06,00:00:00\"",
+        "", "OK", ""]
+    act = json.loads(server.perform({'category': 'gnss', 'action': 'xtra'}))
+    assert act['result'] == {'valid': False, 'duration': 0, 'since': None,
+                             'until': None}
+
+
+def test_gnss_start_applies_fresh_xtra(setup_sock_server, tmpdir):
+    server = setup_sock_server
+    xtra = tmpdir.join('xtra2.bin')
+    xtra.write_binary(b'XTRA')
+    server.xtra_file = str(xtra)
+    for i in range(2):
+        act = json.loads(server.perform(
+            {'category': 'gnss', 'action': 'start'}))
+        assert act['status'] == 'OK'
+    uploads = [w for w in server.seralport.writes
+               if w.startswith('AT+QFUPL')]
+    assert uploads == ['AT+QFUPL="UFS:xtra2.bin",4,60']
+    assert server.seralport.writes.index(uploads[0]) < \
+        server.seralport.writes.index('AT+QGPS=1,30,50,0,1')
+    # stale data isn't applied
+    stale = time.time() - candy_board_qws.XTRA_MAX_AGE - 60
+    os.utime(str(xtra), (stale, stale))
+    del server.seralport.writes[:]
+    server.perform({'category': 'gnss', 'action': 'start'})
+    assert not any(w.startswith('AT+QFUPL') for w in server.seralport.writes)
+
+
+def test_gnss_metrics(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform({'category': 'gnss', 'action': 'metrics'}))
+    assert act == {'status': 'OK', 'result': {'current': None,
+                                              'sessions': []}}
+    server.perform({'category': 'gnss', 'action': 'start', 'qzss': True})
+    loc = server.seralport.res['AT+QGPSLOC=']
+    server.seralport.res['AT+QGPSLOC='] = [
+        "AT+QGPSLOC=", "", "+CME ERROR: 516", ""]
+    server.perform({'category': 'gnss', 'action': 'locate'})
+    server.perform({'category': 'gnss', 'action': 'locate'})
+    server.seralport.res['AT+QGPSLOC='] = loc
+    server.perform({'category': 'gnss', 'action': 'locate'})
+    act = json.loads(server.perform({'category': 'gnss', 'action': 'metrics'}))
+    current = act['result']['current']
+    assert current['config'] == {'qzss': True, 'all': False, 'xtra': False}
+    assert current['notFixed'] == 2
+    assert current['fixes'] == 1
+    assert current['ttff'] >= 0
+    # QGPSLOC reports a 2D fix
+    assert current['ttff3d'] is None
+    assert current['trend'] == [{'elapsed': 0, 'fixes': 1, 'nsat': 9.0,
+                                 'hdop': 0.7}]
+    assert current['ended'] is None
+    server.perform({'category': 'gnss', 'action': 'stop'})
+    act = json.loads(server.perform({'category': 'gnss', 'action': 'metrics'}))
+    assert act['result']['current'] is None
+    assert act['result']['sessions'][0]['ended'] is not None
+    assert act['result']['sessions'][0]['notFixed'] == 2
+
+
+def test_gnss_session_reads_nmea_until_3d_fix(setup_sock_server):
+    server = setup_sock_server
+    server.modem = candy_board_qws.ModemQueue()
+    server.modem.start()
+    try:
+        server.perform({'category': 'gnss', 'action': 'start'})
+        # no client locates, the reader stops once there's a 3D fix
+        for i in range(50):
+            if server.nmea_reader is None:
+                break
+            time.sleep(0.1)
+        assert server.nmea_reader is None
+        act = json.loads(server.perform({'category': 'service',
+                                         'action': 'metrics'}))
+        assert act['result']['gnss']['ttff3d'] is not None
+        assert act['result']['gnss']['fixes'] == 1
+    finally:
+        server.modem.stop()
+
+
+def test_gnss_session():
+    session = candy_board_qws.GnssSession({})
+    session.on_fix({'fix': '2D', 'nsat': 4, 'hdop': 2.0})
+    session.on_fix({'fix': '3D', 'nsat': 7, 'hdop': None})
+    session.started -= candy_board_qws.GNSS_TREND_INTERVAL
+    session.on_fix({'fix': '3D', 'nsat': 8, 'hdop': 0.9})
+    act = session.to_dict()
+    assert act['ttff'] <= act['ttff3d'] < 1
+    assert act['trend'] == [
+        {'elapsed': 0, 'fixes': 2, 'nsat': 5.5, 'hdop': 2.0},
+        {'elapsed': 10, 'fixes': 1, 'nsat': 8.0, 'hdop': 0.9},
+    ]
+    session.end()
+    session.on_fix({'fix': '3D', 'nsat': 8, 'hdop': 0.9})
+    session.on_not_fixed()
+    assert session.to_dict()['fixes'] == 3
+    assert session.to_dict()['notFixed'] == 0
+
+
+def test_at_timeout():
+    assert candy_board_qws.at_timeout("AT+CSQ") == 5
+    assert candy_board_qws.at_timeout("AT+COPS?") == 5
+    assert candy_board_qws.at_timeout("AT+COPS=0") == 180
+    assert candy_board_qws.at_timeout("AT+COPS=?") == 180
+    assert candy_board_qws.at_timeout('AT+QNVW=4548,0,"0000"') == 65
+    assert candy_board_qws.at_timeout("AT+CSQ;+COPS=2") == 185
+
+
+def test_timeout_ms(setup_sock_server):
+    server = setup_sock_server
+    server.seralport.res['AT+QGPSXTRADATA?'] = ["AT+QGPSXTRADATA?", ""]
+    start = time.time()
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'xtra', 'timeout_ms': 300}))
+    assert time.time() - start < 1
+    assert act['status'] == 'ERROR'
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'xtra', 'timeout_ms': 'soon'}))
+    assert act == {'status': 'ERROR', 'result': 'Invalid Args'}
+
+
+def test_deadline(setup_sock_server, tmpdir):
+    server = setup_sock_server
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'locate', 'deadline': time.time()}))
+    assert act == {'status': 'ERROR', 'result': 'Deadline Exceeded'}
+    assert server.seralport.writes == []
+    # the next steps are abandoned once the deadline has passed
+    xtra = tmpdir.join('xtra2.bin')
+    xtra.write_binary(b'XTRA')
+    server.seralport.res['AT+QGPSXTRA?'] = ["AT+QGPSXTRA?", ""]
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'xtra', 'file': str(xtra),
+         'timeout_ms': 300}))
+    assert act == {'status': 'ERROR', 'result': 'Deadline Exceeded'}
+    assert server.seralport.writes == ['AT+QGPSXTRA?']
+    assert server.deadline is None and server.at_timeout is None
+
+
+def test_modem_queue_priority():
+    modem = candy_board_qws.ModemQueue()
+    submitted = [
+        modem.submit(None, 'a1', priority='telemetry', client='a'),
+        modem.submit(None, 'a2', priority='telemetry', client='a'),
+        modem.submit(None, 'b1', priority='telemetry', client='b'),
+        modem.submit(None, 'off', priority='control', client='c'),
+        modem.submit(None, 'set', client='c'),
+    ]
+    with modem.cond:
+        order = [modem._next().args for c in submitted]
+    # clients take turns within a priority
+    assert order == [('off',), ('set',), ('a1',), ('b1',), ('a2',)]
+    assert modem.turns == {}
+
+
+def test_modem_queue_aging():
+    modem = candy_board_qws.ModemQueue()
+    modem.submit(None, 'set')
+    modem.submit(None, 'show', priority='telemetry')
+    modem.submit(None, 'off', priority='control')
+    modem.pending[1].queued -= candy_board_qws.MODEM_AGING_INTERVAL * 2
+    with modem.cond:
+        order = [modem._next().args for i in range(3)]
+    assert order == [('off',), ('show',), ('set',)]
+    act = modem.metrics()
+    assert act['depth'] == {'control': 0, 'default': 0, 'telemetry': 0}
+    assert act['wait']['telemetry']['count'] == 1
+    assert act['wait']['telemetry']['max'] >= \
+        candy_board_qws.MODEM_AGING_INTERVAL * 2
+
+
+def test_modem_queue_stop():
+    modem = candy_board_qws.ModemQueue()
+    modem_call = modem.submit(lambda: 'done')
+    modem.stop()
+    modem.start()
+    modem.join(5)
+    assert not modem.is_alive()
+    assert modem_call.wait() == 'done'
+
+
+def test_command_priority(setup_sock_server):
+    server = setup_sock_server
+    priority = lambda c, a: candy_board_qws.command_meta(  # noqa: E731
+        server.command_method({'category': c, 'action': a}))['priority']
+    assert priority('modem', 'off') == 'control'
+    assert priority('network', 'deregister') == 'control'
+    assert priority('network', 'show') == 'telemetry'
+    assert priority('gnss', 'start') == 'default'
+
+
+def test_service_metrics(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform({'category': 'service',
+                                     'action': 'metrics'}))
+    assert act == {'status': 'OK', 'result': {'modem': None, 'gnss': None}}
+    server.modem = candy_board_qws.ModemQueue()
+    server.modem.start()
+    try:
+        server.perform({'category': 'network', 'action': 'show'})
+        act = json.loads(server.perform({'category': 'service',
+                                         'action': 'metrics'}))
+        assert act['result']['modem']['wait']['telemetry']['count'] == 1
+    finally:
+        server.modem.stop()
+
+
+def test_async_job(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform(
+        {'category': 'network', 'action': 'show', 'async': True}))
+    assert act['status'] == 'OK'
+    job_id = act['result']['job']
+    act = json.loads(server.perform(
+        {'category': 'job', 'action': 'status', 'id': job_id}))
+    assert act['status'] == 'OK'
+    assert act['result']['id'] == job_id
+    assert act['result']['command'] == 'network show'
+    assert act['result']['state'] == 'done'
+    assert act['result']['progress']['steps'] > 0
+    assert act['result']['result']['status'] == 'OK'
+    assert act['result']['result']['result']['operator'] == 'NTT DOCOMO'
+    act = json.loads(server.perform(
+        {'category': 'job', 'action': 'wait', 'id': job_id}))
+    assert act['result']['state'] == 'done'
+    act = json.loads(server.perform(
+        {'category': 'job', 'action': 'wait', 'id': 'none'}))
+    assert act == {'status': 'ERROR', 'result': 'Not Found'}
+    act = json.loads(server.perform(
+        {'category': 'network', 'action': 'watch', 'async': True}))
+    assert act == {'status': 'ERROR', 'result': 'Invalid Args'}
+
+
+def test_async_job_without_deadline(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform(
+        {'category': 'modem', 'action': 'show', 'async': True,
+         'timeout_ms': 500, 'deadline': time.time() - 1}))
+    act = json.loads(server.perform(
+        {'category': 'job', 'action': 'wait', 'id': act['result']['job']}))
+    assert act['result']['state'] == 'done'
+    assert act['result']['result']['status'] == 'OK'
+
+
+def test_parse_operators():
+    assert candy_board_qws.parse_operators(
+        '+COPS: (2,"NTT DOCOMO","DOCOMO","44010",7),(1,"A","","00101"),'
+        '(9,"B","B","00102",1),,(0,1,2,3,4),(0,1,2)') == [
+        {'status': 'Current', 'longName': 'NTT DOCOMO',
+         'shortName': 'DOCOMO', 'numeric': '44010', 'access': 'E-UTRAN'},
+        {'status': 'Available', 'longName': 'A', 'shortName': '',
+         'numeric': '00101', 'access': 'N/A'},
+        {'status': 'Unknown', 'longName': 'B', 'shortName': 'B',
+         'numeric': '00102', 'access': 'N/A'},
+    ]
+    assert candy_board_qws.parse_operators('+COPS: ,,(0,1,2,3,4)') == []
+
+
+def test_network_scan(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform({'category': 'network', 'action': 'scan'}))
+    assert act['status'] == 'OK'
+    assert act['result']['scanned'] is None
+    job_id = act['result']['job']
+    act = json.loads(server.perform(
+        {'category': 'job', 'action': 'wait', 'id': job_id}))
+    assert act['result']['command'] == 'network operators'
+    assert act['result']['progress']['at'] == 'AT+COPS=?'
+    operators = act['result']['result']['result']['operators']
+    assert [o['numeric'] for o in operators] == ['44010', '44020', '44051']
+    assert [o['status'] for o in operators] == \
+        ['Current', 'Available', 'Forbidden']
+    assert operators[0]['longName'] == 'NTT DOCOMO'
+    assert operators[0]['access'] == 'E-UTRAN'
+
+    # served from the last scan
+    server.seralport.writes = []
+    act = json.loads(server.perform({'category': 'network', 'action': 'scan'}))
+    assert act['result']['operators'] == operators
+    assert act['result']['job'] is None
+    assert act['result']['age'] >= 0
+    assert server.seralport.writes == []
+
+    act = json.loads(server.perform(
+        {'category': 'network', 'action': 'scan', 'refresh': True}))
+    assert act['result']['operators'] == operators
+    assert act['result']['job'] not in (None, job_id)
+    assert server.seralport.writes == ['AT+COPS=?']
+
+    server.operator_scan = server.operator_scan._replace(
+        timestamp=time.time() - candy_board_qws.NETWORK_SCAN_TTL)
+    server.seralport.writes = []
+    act = json.loads(server.perform({'category': 'network', 'action': 'scan'}))
+    assert act['result']['job'] is not None
+    assert server.seralport.writes == ['AT+COPS=?']
+
+
+def test_single_flight_follower_deadline():
+    flights = candy_board_qws.SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flights.call,
+                              args=('key', release.wait, 5))
+    leader.start()
+    while 'key' not in flights.calls:
+        time.sleep(0.01)
+    with pytest.raises(candy_board_qws.DeadlineExceeded):
+        flights.call('key', release.wait, 5, deadline=time.time() + 0.1)
+    release.set()
+    leader.join()
+    assert flights.call('key', lambda: 'done',
+                        deadline=time.time() + 1) == 'done'
+
+
+def test_job_table():
+    jobs = candy_board_qws.JobTable(2)
+    cmd = {'category': 'modem', 'action': 'init'}
+    running = candy_board_qws.Job(cmd)
+    jobs.add(running)
+    finished = []
+    for i in range(3):
+        job = candy_board_qws.Job(cmd)
+        jobs.add(job)
+        job.finish('{"status": "OK", "result": ""}')
+        jobs.on_finished(job)
+        finished.append(job)
+    assert list(jobs.jobs) == [running.id, finished[1].id, finished[2].id]
+    assert jobs.get(finished[0].id) is None
+
+
+def test_gnss_history(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform({'category': 'gnss', 'action': 'history'}))
+    assert act == {'status': 'OK', 'result': []}
+    server.perform({'category': 'gnss', 'action': 'locate'})
+    server.perform({'category': 'gnss', 'action': 'locate'})
+    act = json.loads(server.perform({
+        'category': 'gnss', 'action': 'history',
+        'since': '2018-05-21T07:12:17.000Z', 'until': 1526886737}))
+    assert act['status'] == 'OK'
+    assert len(act['result']) == 1
+    assert act['result'][0]['latitude'] == 35.68116
+    assert act['result'][0]['timestamp'] == '2018-05-21T07:12:17.000Z'
+    act = json.loads(server.perform({
+        'category': 'gnss', 'action': 'history', 'since': '2018-05-21'}))
+    assert act == {'status': 'ERROR', 'result': 'Invalid Args'}
+    act = json.loads(server.perform({
+        'category': 'gnss', 'action': 'history', 'decimate': 0}))
+    assert act == {'status': 'ERROR', 'result': 'Invalid Args'}
+
+
+def test_geofence(setup_sock_server):
+    server = setup_sock_server
+    events = []
+    # fixes located below, without an NMEA reader
+    server.geofence_feed.on_watchers = None
+    server.geofence_feed.watch(events.append)
+    try:
+        act = json.loads(server.perform({
+            'category': 'geofence', 'action': 'set', 'id': 'station',
+            'latitude': 35.6812, 'longitude': 139.7671, 'radius': 500}))
+        assert act == {'status': 'OK', 'result': ''}
+        act = json.loads(server.perform({
+            'category': 'geofence', 'action': 'set', 'id': 'bad',
+            'polygon': [[35.6, 139.7]]}))
+        assert act == {'status': 'ERROR', 'result': 'Invalid Args'}
+        act = json.loads(server.perform(
+            {'category': 'geofence', 'action': 'ls'}))
+        assert act['result'] == [{'id': 'station', 'latitude': 35.6812,
+                                  'longitude': 139.7671, 'radius': 500.0}]
+        server.perform({'category': 'gnss', 'action': 'locate'})
+        act = json.loads(events[0])
+        assert act['event'] == 'geofence'
+        assert act['id'] == 'station'
+        assert act['transition'] == 'enter'
+        assert act['result']['latitude'] == 35.68116
+        act = json.loads(server.perform(
+            {'category': 'geofence', 'action': 'watch'}))
+        assert act['result'] == {'inside': ['station']}
+        act = json.loads(server.perform(
+            {'category': 'geofence', 'action': 'del', 'id': 'station'}))
+        assert act == {'status': 'OK', 'result': ''}
+        act = json.loads(server.perform(
+            {'category': 'geofence', 'action': 'del', 'id': 'station'}))
+        assert act == {'status': 'ERROR', 'result': 'Not Found'}
+    finally:
+        server.geofence_feed.unwatch(events.append)
+
+
+def test_gnss_stats(setup_sock_server):
+    server = setup_sock_server
+    server.perform({'category': 'gnss', 'action': 'locate'})
+    act = json.loads(server.perform({'category': 'gnss', 'action': 'stats'}))
+    assert act['status'] == 'OK'
+    assert act['result']['count'] == 1
+    assert act['result']['distance'] == 0.0
+    assert act['result']['boundingBox']['minLatitude'] == 35.68116
+    act = json.loads(server.perform({
+        'category': 'gnss', 'action': 'stats', 'stopSpeed': 'fast'}))
+    assert act == {'status': 'ERROR', 'result': 'Invalid Args'}
+
+
 def test_gnss_locate_error_not_yet_fixed(setup_sock_server):
     server = setup_sock_server
     server.seralport.res['AT+QGPSLOC='] = [
@@ -747,6 +1397,387 @@ def test_gnss_locate_error_other(setup_sock_server):
     assert ret == '{"status": "ERROR", "result": "500"}'
 
 
+def test_gnss_nmea(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform({'category': 'gnss', 'action': 'nmea'}))
+    assert act['status'] == 'OK'
+    assert [s[3:6] for s in act['result']] == ['GSA', 'GGA', 'RMC']
+    assert 'AT+QGPSGNMEA="GSA";+QGPSGNMEA="GGA";+QGPSGNMEA="RMC"' in \
+        server.seralport.writes
+
+
+def test_gnss_nmea_session_not_started(setup_sock_server):
+    server = setup_sock_server
+    server.seralport.res['AT+QGPSGNMEA="RMC"'] = [
+        "AT+QGPSGNMEA=\"RMC\"",
+        "",
+        "+CME ERROR: 505",
+        ""
+    ]
+    act = json.loads(server.perform(
+        {'category': 'gnss', 'action': 'nmea', 'types': ['RMC']}))
+    assert act == {'status': 'ERROR', 'result': 'Session not started'}
+
+
+def test_nmea_reader_polling(setup_sock_server):
+    server = setup_sock_server
+    fixes = []
+    server.gnss.watch(fixes.append)
+    try:
+        deadline = time.time() + 5
+        while not fixes and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        server.gnss.unwatch(fixes.append)
+    assert server.nmea_reader is None
+    act = json.loads(fixes[0])
+    assert act['event'] == 'gnss'
+    assert act['result']['latitude'] == 35.68116
+    assert act['result']['fix'] == '3D'
+    assert server.gnss.latest == act['result']
+
+
+def test_nmea_reader_port(setup_sock_server, tmpdir):
+    server = setup_sock_server
+    path = str(tmpdir.join('nmea'))
+    os.mkfifo(path)
+    # keeping the FIFO open for writing, the reader doesn't see EOF
+    fd = os.open(path, os.O_RDWR)
+    server.nmea_port = path
+    fixes = []
+    server.gnss.watch(fixes.append)
+    try:
+        os.write(fd, b'$GPGGA,071217.0,3540.869600,N,13945.891600,E,1,09,'
+                     b'0.7,50.4,M,39.0,M,,*64\r\n'
+                     b'$GPRMC,071217.0,A,3540.869600,N,13945.891600,E,0.0,'
+                     b'0.0,210518,,,A*6C\r\n')
+        deadline = time.time() + 5
+        while not fixes and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        reader = server.nmea_reader
+        server.gnss.unwatch(fixes.append)
+        reader.join()
+        os.close(fd)
+    assert json.loads(fixes[0])['result']['longitude'] == 139.76486
+    assert server.seralport.writes == []
+
+
+def test_batch_run(setup_sock_server):
+    server = setup_sock_server
+    ret = server.perform({
+        'category': 'batch', 'action': 'run',
+        'commands': [
+            {'category': 'modem', 'action': 'show', 'fresh': True},
+            {'category': 'modem', 'action': 'show', 'fresh': True},
+            {'category': 'service', 'action': 'version'},
+            {'category': 'no-such-category', 'action': 'show'},
+            {'category': 'batch', 'action': 'run', 'commands': []},
+            'network_show',
+        ]})
+    act = json.loads(ret)
+    assert act['status'] == 'OK'
+    assert len(act['result']) == 6
+    assert act['result'][0] == act['result'][1]
+    assert act['result'][1]['result']['model'] == 'MOD'
+    assert act['result'][2]['result']['version'] == 'devel'
+    assert act['result'][3]['result'] == 'Unknown Command'
+    assert act['result'][4]['result'] == 'Nested Batch'
+    assert act['result'][5]['result'] == 'Invalid Args'
+    # the responses of the first modem_show are shared with the second
+    assert server.seralport.writes == [
+        'ATI', 'AT+GSN;+QGDCNT?;+CCLK?;+CFUN?']
+    assert server.memo is None
+
+
+def test_batch_run_not_shared_after_update(setup_sock_server):
+    server = setup_sock_server
+    ret = server.perform({
+        'category': 'batch', 'action': 'run',
+        'commands': [
+            {'category': 'sim', 'action': 'show'},
+            {'category': 'apn', 'action': 'del', 'id': '1'},
+            {'category': 'sim', 'action': 'show'},
+            {'category': 'sim', 'action': 'show'},
+        ]})
+    act = json.loads(ret)
+    assert [r['status'] for r in act['result']] == ['OK'] * 4
+    assert server.seralport.writes == [
+        'AT+CIMI', 'AT+CNUM;+QCCID', 'AT+CGDCONT=1',
+        'AT+CIMI', 'AT+CNUM;+QCCID']
+
+
+def test_batch_run_job(setup_sock_server):
+    server = setup_sock_server
+    act = json.loads(server.perform(
+        {'category': 'modem', 'action': 'show', 'async': True}))
+    job_id = act['result']['job']
+    ret = server.perform({
+        'category': 'batch', 'action': 'run',
+        'commands': [
+            {'category': 'modem', 'action': 'show', 'async': True},
+            {'category': 'job', 'action': 'wait', 'id': job_id},
+            {'category': 'job', 'action': 'status', 'id': job_id},
+        ]})
+    act = json.loads(ret)
+    assert act['result'][:2] == [
+        {'status': 'ERROR', 'result': 'Invalid Args'},
+        {'status': 'ERROR', 'result': 'Invalid Args'},
+    ]
+    assert act['result'][2]['result']['state'] == 'done'
+
+
+def test_batch_run_nok(setup_sock_server):
+    ret = setup_sock_server.perform({'category': 'batch', 'action': 'run'})
+    assert ret == '{"status": "ERROR", "result": "Invalid Args"}'
+
+
+def test_network_show_cached(setup_sock_server):
+    server = setup_sock_server
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    act = json.loads(ret)
+    assert 'cached' not in act
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    cached = json.loads(ret)
+    assert cached['cached'] is True
+    assert 0 <= cached['age'] < 5
+    assert cached['result'] == act['result']
+    assert len(server.seralport.writes) == 2
+    ret = server.perform(
+        {'category': 'network', 'action': 'show', 'fresh': True})
+    assert 'cached' not in json.loads(ret)
+    assert len(server.seralport.writes) == 3
+
+
+def test_network_show_cache_expired(setup_sock_server, monkeypatch):
+    server = setup_sock_server
+    server.perform({'category': 'network', 'action': 'show'})
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 5)
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    assert 'cached' not in json.loads(ret)
+    assert len(server.seralport.writes) == 3
+
+
+def test_modem_show_cached_identity(setup_sock_server):
+    server = setup_sock_server
+    server.perform({'category': 'modem', 'action': 'show'})
+    ret = server.perform({'category': 'modem', 'action': 'show'})
+    act = json.loads(ret)
+    assert 'cached' not in act
+    assert act['result']['manufacturer'] == 'MAN'
+    assert act['result']['model'] == 'MOD'
+    assert act['result']['revision'] == 'REV'
+    assert act['result']['imei'] == '999999999999999'
+    assert act['result']['functionality'] == 'Full'
+    assert server.seralport.writes == [
+        'ATI', 'AT+GSN;+QGDCNT?;+CCLK?;+CFUN?', 'AT+QGDCNT?;+CCLK?;+CFUN?']
+
+
+def test_modem_identity_uc20(setup_sock_server):
+    server = setup_sock_server
+    server.seralport.res['ATI'] = [
+        "ATI",
+        "",
+        "Quectel",
+        "UC20",
+        "Revision: UC20GQBR03A12E1G",
+        "",
+        "OK",
+        ""
+    ]
+    server.seralport.res['AT+QGBAND'] = [
+        "AT+QGBAND",
+        "",
+        "+QGBAND: 16",
+        "",
+        "OK",
+        ""
+    ]
+    server.seralport.compound = False
+    server.perform({'category': 'gnss', 'action': 'start'})
+    server.perform({'category': 'gnss', 'action': 'status'})
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    act = json.loads(ret)
+    assert act['result']['access'] == 'WCDMA'
+    assert act['result']['band'] == 'WCDMA 2100'
+    assert server.identity.family == 'UC2x'
+    assert server.seralport.writes.count('ATI') == 1
+    assert 'AT+QNWINFO' not in server.seralport.writes
+    assert 'AT+QGPSCFG="gnssconfig"' not in server.seralport.writes
+
+
+def test_modem_identity_new_session(setup_sock_server):
+    server = setup_sock_server
+    server.seralport.session = 1
+    server.perform({'category': 'gnss', 'action': 'status'})
+    server.perform({'category': 'gnss', 'action': 'status'})
+    assert server.seralport.writes.count('ATI') == 1
+    server.seralport.session = 2
+    server.perform({'category': 'gnss', 'action': 'status'})
+    assert server.seralport.writes.count('ATI') == 2
+
+
+def test_network_show_snapshot(setup_sock_server):
+    server = setup_sock_server
+    poller = candy_board_qws.Poller(
+        server, {'category': 'network', 'action': 'show'}, 10)
+    poller.poll()
+    writes = len(server.seralport.writes)
+    server.cache.clear()
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    act = json.loads(ret)
+    assert act['cached'] is True
+    assert act['result']['operator'] == 'NTT DOCOMO'
+    assert len(server.seralport.writes) == writes
+    ret = server.perform(
+        {'category': 'network', 'action': 'show', 'fresh': True})
+    assert 'cached' not in json.loads(ret)
+    assert len(server.seralport.writes) == writes + 1
+
+
+def test_network_show_snapshot_stale(setup_sock_server, monkeypatch):
+    server = setup_sock_server
+    poller = candy_board_qws.Poller(
+        server, {'category': 'network', 'action': 'show'}, 1)
+    poller.poll()
+    server.cache.clear()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 3)
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    assert 'cached' not in json.loads(ret)
+
+
+def test_network_show_snapshot_invalidated_while_polling(setup_sock_server):
+    server = setup_sock_server
+    poller = candy_board_qws.Poller(
+        server, {'category': 'network', 'action': 'show'}, 10)
+    perform = server.perform
+
+    def perform_then_deregister(cmd):
+        message = perform(cmd)
+        perform({'category': 'network', 'action': 'deregister'})
+        return message
+    server.perform = perform_then_deregister
+    poller.poll()
+    assert server.snapshots == {}
+
+
+def test_network_show_snapshot_new_session(setup_sock_server):
+    server = setup_sock_server
+    poller = candy_board_qws.Poller(
+        server, {'category': 'network', 'action': 'show'}, 10)
+    poller.poll()
+    assert server.snapshot_message('network_show') is not None
+    server.seralport.session = 2
+    assert server.snapshot_message('network_show') is None
+
+
+def test_network_poller(setup_sock_server):
+    server = setup_sock_server
+    server.network_poll_interval = 0.05
+    server.start_pollers()
+    try:
+        for i in range(100):
+            if 'network_show' in server.snapshots:
+                break
+            time.sleep(0.01)
+    finally:
+        server.stop_pollers()
+    snapshot = server.snapshots['network_show']
+    assert json.loads(snapshot.message)['status'] == 'OK'
+    server.perform({'category': 'network', 'action': 'deregister'})
+    assert server.snapshots == {}
+
+
+def test_sim_show_state_expired(setup_sock_server, monkeypatch):
+    server = setup_sock_server
+    server.perform({'category': 'sim', 'action': 'show'})
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 5)
+    server.seralport.writes = []
+    ret = server.perform({'category': 'sim', 'action': 'show'})
+    act = json.loads(ret)
+    assert 'cached' not in act
+    assert act['result']['iccid'] != ''
+    # only the SIM state is queried again
+    assert server.seralport.writes == ['AT+CIMI']
+    # another SIM
+    server.seralport.res['AT+CIMI'] = [
+        "AT+CIMI", "", "440222222222222", "", "OK", ""]
+    monkeypatch.setattr(time, 'time', lambda: now + 10)
+    ret = server.perform({'category': 'sim', 'action': 'show'})
+    assert json.loads(ret)['result']['imsi'] == '440222222222222'
+    assert server.seralport.writes == [
+        'AT+CIMI', 'AT+CIMI', 'AT+CNUM;+QCCID']
+
+
+def test_network_show_cache_invalidated_by_modem_init(setup_sock_server):
+    server = setup_sock_server
+    server.perform({'category': 'network', 'action': 'show'})
+    server.perform({'category': 'modem', 'action': 'init'})
+    ret = server.perform({'category': 'network', 'action': 'show'})
+    assert 'cached' not in json.loads(ret)
+
+
+def test_watcher_holds_events_until_started():
+    written = []
+    state = candy_board_qws.NetworkState()
+    watcher = candy_board_qws.Watcher(state, written.append)
+    state.watch(watcher)
+    state.update({'eps': 'Registered'})
+    state.update({'eps': 'Searching'})
+    assert written == []
+    watcher.start({'eps': 'Registered'})
+    assert [json.loads(m)['result'] for m in written] == [
+        {'eps': 'Searching'}]
+    state.update({'eps': 'Denied'})
+    assert json.loads(written[-1])['changed'] == ['eps']
+
+
+def test_network_state_from_network_show(setup_sock_server):
+    server = setup_sock_server
+    counts = []
+    server.network_state.on_watchers = counts.append
+    server.perform({'category': 'network', 'action': 'show'})
+    assert server.network_state.state == {
+        'cs': 'Registered',
+        'ps': 'Registered',
+        'eps': 'Registered',
+        'access': 'FDD LTE',
+        'band': 'LTE BAND 1',
+        'rssiBucket': 1,
+    }
+    server.network_state.watch(len)
+    server.network_state.watch(None)
+    # a failing watcher is removed
+    server.network_state.update({'rssiBucket': 2})
+    assert counts == [1, 2, 1]
+
+
+def test_apn_ls_cache_invalidated(setup_sock_server):
+    server = setup_sock_server
+    server.perform({'category': 'apn', 'action': 'ls'})
+    ret = server.perform({'category': 'apn', 'action': 'ls'})
+    assert json.loads(ret)['cached'] is True
+    server.perform({'category': 'apn', 'action': 'del', 'id': '1'})
+    ret = server.perform({'category': 'apn', 'action': 'ls'})
+    assert 'cached' not in json.loads(ret)
+
+
+def test_sim_show_cache_cleared_on_reconnect(setup_sock_server):
+    server = setup_sock_server
+    server.seralport.session = 1
+    server.perform({'category': 'sim', 'action': 'show'})
+    ret = server.perform({'category': 'sim', 'action': 'show'})
+    assert json.loads(ret)['cached'] is True
+    server.seralport.session = 2
+    ret = server.perform({'category': 'sim', 'action': 'show'})
+    act = json.loads(ret)
+    assert 'cached' not in act
+    assert act['result']['imsi'] == '440111111111111'
+
+
 def test_service_version(setup_sock_server):
     ret = setup_sock_server.perform(
         {'category': 'service', 'action': 'version'})
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 CANDY LINE INC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import path_hack
+from candy_board_qws import track
+import pytest
+
+T0 = 1526886737.0  # 2018-05-21T07:12:17Z
+
+
+def fix(t, latitude=35.68116, longitude=139.76486, spkm=0.0):
+    return {
+        'timestamp': track.format_timestamp(t),
+        'latitude': latitude,
+        'longitude': longitude,
+        'hdop': 0.7,
+        'altitude': 50.4,
+        'fix': '3D',
+        'cog': 0.0,
+        'spkm': spkm,
+        'spkn': 0.0,
+        'nsat': 9,
+    }
+
+
+def test_timestamp():
+    assert track.parse_timestamp('2018-05-21T07:12:17.000Z') == T0
+    assert track.parse_timestamp('2018-05-21T07:12:17.500Z') == T0 + 0.5
+    assert track.parse_timestamp(T0) == T0
+    assert track.format_timestamp(T0 + 0.25) == '2018-05-21T07:12:17.250Z'
+
+
+def test_fix_history():
+    history = track.FixHistory(4)
+    assert history.fixes() == []
+    assert history.append(fix(T0))
+    act = history.fixes()
+    assert len(act) == 1
+    assert act[0]['timestamp'] == '2018-05-21T07:12:17.000Z'
+    assert act[0]['nsat'] == 9
+    assert act[0]['spkm'] == 0.0
+    assert 'fix' not in act[0]
+    # the same fix located again
+    assert not history.append(fix(T0))
+    assert not history.append(dict(fix(T0 + 1), latitude=None))
+    assert len(history) == 1
+
+
+def test_fix_history_wraps():
+    history = track.FixHistory(4)
+    for i in range(10):
+        assert history.append(fix(T0 + i, spkm=float(i)))
+    assert len(history) == 4
+    assert [f['spkm'] for f in history.fixes()] == [6.0, 7.0, 8.0, 9.0]
+
+
+def test_fix_history_range():
+    history = track.FixHistory(8)
+    for i in range(10):
+        history.append(fix(T0 + i, spkm=float(i)))
+    speeds = [f['spkm'] for f in history.fixes(T0 + 3, T0 + 5)]
+    assert speeds == [3.0, 4.0, 5.0]
+    speeds = [f['spkm'] for f in history.fixes(since=T0 + 7.5)]
+    assert speeds == [8.0, 9.0]
+    speeds = [f['spkm'] for f in history.fixes(until=T0 + 2)]
+    assert speeds == [2.0]
+    speeds = [f['spkm'] for f in history.fixes(decimate=3)]
+    assert speeds == [2.0, 5.0, 8.0]
+    assert history.fixes(T0 + 20) == []
+
+
+def drive(history):
+    # 60 s stopped, then north at 0.0001 deg/s (about 40 km/h)
+    for i in range(61):
+        history.append(fix(T0 + i, spkm=0.5))
+    for i in range(1, 61):
+        history.append(fix(T0 + 60 + i, latitude=35.68116 + i * 0.0001,
+                           spkm=40.0))
+
+
+def check_stats(history):
+    act = history.stats()
+    assert act['count'] == 121
+    assert act['since'] == '2018-05-21T07:12:17.000Z'
+    assert act['duration'] == 120.0
+    assert abs(act['distance'] - 667.2) < 0.5
+    assert act['maxSpeed'] == 40.0
+    assert abs(act['avgSpeed'] - 20.02) < 0.05
+    assert act['boundingBox'] == {
+        'minLatitude': 35.68116,
+        'maxLatitude': 35.68716,
+        'minLongitude': 139.76486,
+        'maxLongitude': 139.76486,
+    }
+    assert act['stops'] == [{
+        'since': '2018-05-21T07:12:17.000Z',
+        'until': '2018-05-21T07:13:17.000Z',
+        'duration': 60.0,
+        'latitude': 35.68116,
+        'longitude': 139.76486,
+    }]
+    assert history.stats(stop_duration=61)['stops'] == []
+    act = history.stats(T0 + 100)
+    assert act['count'] == 21
+    assert act['stops'] == []
+    act = history.stats(T0 + 1000)
+    assert act['count'] == 0
+    assert act['distance'] == 0.0
+    assert act['boundingBox'] is None
+
+
+def test_stats_python(monkeypatch):
+    monkeypatch.setattr(track, 'numpy', None)
+    history = track.FixHistory(200)
+    drive(history)
+    check_stats(history)
+
+
+@pytest.mark.skipif(track.numpy is None, reason="NumPy isn't installed")
+def test_stats_numpy():
+    history = track.FixHistory(100)
+    drive(history)
+    # wrapped around, the first 21 fixes are gone
+    assert history.stats()['count'] == 100
+    history = track.FixHistory(200)
+    drive(history)
+    check_stats(history)